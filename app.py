@@ -5,39 +5,253 @@ import datetime
 import io
 import logging
 import uuid
-from flask import Flask, request, render_template, jsonify, session, redirect, url_for, send_file, flash
-import google.generativeai as genai
+import time
+import select
+import socket
+import contextlib
+import gzip
+import zlib
+import struct
+import hashlib
+import ipaddress
+import zipfile
+import threading
+import contextvars
+import multiprocessing
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Request, Response, request, current_app, render_template, jsonify, session, redirect, url_for, send_file, flash, make_response
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
-import fitz  # PyMuPDF
-import docx
-from docx.shared import Pt, Inches, RGBColor, Cm
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 import tempfile
+from xml.sax.saxutils import escape as xml_escape
 
-# Configurar logging
-logging.basicConfig(level=logging.DEBUG)
+# Configurar logging (nível ajustável por LOG_LEVEL; DEBUG deixa o cold start mais lento)
+logging.basicConfig(level=getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper(), logging.INFO))
 logger = logging.getLogger(__name__)
 
+class HashingUploadFile:
+    """Arquivo em disco que recebe o upload em streaming e calcula o SHA-256 durante a gravação"""
+
+    def __init__(self, directory):
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload_', suffix='.part', delete=False)
+        self._hash = hashlib.sha256()
+        self.name = self._file.name
+
+    def write(self, data):
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        # O arquivo parcial é removido ao fim da requisição, a menos que já tenha sido movido
+        self._file.close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    """Requisição que grava uploads direto na pasta de uploads (sem cópia em memória)
+    e aceita o limite maior de tamanho no modo de autos completos (?autos=1)."""
+
+    @property
+    def max_content_length(self):
+        if self.args.get('autos'):
+            return current_app.config['LARGE_MAX_CONTENT_LENGTH']
+        return current_app.config['MAX_CONTENT_LENGTH']
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadFile(current_app.config['UPLOAD_FOLDER'])
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['RESULT_FOLDER'] = 'results'  # Pasta para guardar resultados temporários
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 16)) * 1024 * 1024  # 16MB max upload size
+app.config['LARGE_MAX_CONTENT_LENGTH'] = int(os.environ.get('LARGE_UPLOAD_MAX_MB', 512)) * 1024 * 1024  # Limite no modo de autos completos
+app.config['AUTOS_SCAN_PAGES'] = int(os.environ.get('AUTOS_SCAN_PAGES', 120))  # Páginas examinadas para achar o fim da petição nos autos
 app.config['SECRET_KEY'] = '208d68f338ce335f60117b11b4072a32'  # Chave fixa para sessões
+app.config['GENERATION_MODE'] = os.environ.get('GENERATION_MODE', 'single')  # 'single' ou 'parallel' (seções geradas em paralelo)
+app.config['RESULT_BACKEND'] = os.environ.get('RESULT_BACKEND', 'local')  # 'local', 'shared' ou 'redis'
+app.config['RESULT_SHARED_FOLDER'] = os.environ.get('RESULT_SHARED_FOLDER', '/mnt/minhahonrajus/results')  # Pasta compartilhada entre os nós
+app.config['RESULT_REDIS_URL'] = os.environ.get('RESULT_REDIS_URL', 'redis://localhost:6379/0')
+app.config['RESULT_TTL'] = int(os.environ.get('RESULT_TTL', 7 * 24 * 3600))  # Expiração dos resultados no Redis (segundos)
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', 256))  # Resultados mantidos no LRU local
+app.config['RESULT_CACHE_TTL'] = int(os.environ.get('RESULT_CACHE_TTL', 30))  # Segundos até revalidar um resultado no backend
+app.config['RESULT_PAGE_CACHE_SIZE'] = int(os.environ.get('RESULT_PAGE_CACHE_SIZE', 128))  # Páginas de resultado renderizadas mantidas em memória
+app.config['COMPRESSION_MIN_SIZE'] = 1024  # Respostas menores que isso não são comprimidas
+app.config['API_STREAM_MIN_SIZE'] = int(os.environ.get('API_STREAM_MIN_SIZE', 256 * 1024))  # Respostas JSON maiores que isso são serializadas em partes
+app.config['STATIC_MAX_AGE'] = 365 * 24 * 3600  # Cache longo apenas para arquivos de /static
+app.config['CONTEXT_CACHE_ENABLED'] = os.environ.get('CONTEXT_CACHE_ENABLED', '1') == '1'  # Cache de contexto do Gemini para PROMPT + modelo
+app.config['CONTEXT_CACHE_TTL'] = int(os.environ.get('CONTEXT_CACHE_TTL', 3600))  # Validade do cache de contexto (segundos)
+app.config['CONTEXT_CACHE_SIZE'] = int(os.environ.get('CONTEXT_CACHE_SIZE', 64))  # Prefixos (modelos) com cache de contexto mantidos em memória
+app.config['DOCX_ENGINE'] = os.environ.get('DOCX_ENGINE', 'fast')  # 'fast' (OOXML direto) ou 'python-docx'
+app.config['EXPORT_WORKERS'] = int(os.environ.get('EXPORT_WORKERS', os.cpu_count() or 2))  # Processos que renderizam DOCX/TXT na exportação em lote
+app.config['EXPORT_MAX_RESULTS'] = int(os.environ.get('EXPORT_MAX_RESULTS', 500))  # Máximo de resultados por exportação
+app.config['LLM_MAX_CONCURRENCY'] = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))  # Chamadas simultâneas ao Gemini por processo, por chave de API
+app.config['LLM_INTERACTIVE_RESERVED'] = int(os.environ.get('LLM_INTERACTIVE_RESERVED', 2))  # Vagas que o tráfego em lote nunca ocupa
+app.config['LLM_TENANT_WEIGHTS'] = os.environ.get('LLM_TENANT_WEIGHTS', '')  # Pesos por cliente (chaves X-API-Key reconhecidas ou IPs), ex.: "chave-a=3,chave-b=1"
+app.config['REQUEST_DEADLINE'] = float(os.environ.get('REQUEST_DEADLINE', 300))  # Prazo (segundos) de extração + Gemini + resposta por requisição
+app.config['DEADLINE_POLL_INTERVAL'] = float(os.environ.get('DEADLINE_POLL_INTERVAL', 0.5))  # Intervalo de verificação de prazos e desconexões
+app.config['GEMINI_MODEL_TIERS'] = os.environ.get('GEMINI_MODEL_TIERS', '')  # Modelos por tamanho de entrada, ex.: "gemini-2.0-flash-lite:20000,gemini-2.0-flash"
+app.config['GEMINI_KEY_RPM'] = int(os.environ.get('GEMINI_KEY_RPM', 2000))  # Cota de requisições por minuto de cada chave
+app.config['GEMINI_KEY_TPM'] = int(os.environ.get('GEMINI_KEY_TPM', 4000000))  # Cota de tokens por minuto de cada chave
+app.config['GEMINI_KEY_COOLDOWN'] = float(os.environ.get('GEMINI_KEY_COOLDOWN', 60))  # Segundos fora do pool após cota esgotada ou falhas seguidas
+app.config['ADMISSION_POLICY'] = os.environ.get('ADMISSION_POLICY', 'chunked')  # 'reject', 'chunked' ou 'queue' para trabalhos que não cabem no prazo
+app.config['ADMISSION_MAX_INPUT_TOKENS'] = int(os.environ.get('ADMISSION_MAX_INPUT_TOKENS', 1000000))  # Maior entrada (tokens estimados) aceita numa chamada
+app.config['ADMISSION_QUEUE_SIZE'] = int(os.environ.get('ADMISSION_QUEUE_SIZE', 20))  # Trabalhos aguardando na fila em segundo plano
+app.config['ADMISSION_QUEUE_WORKERS'] = int(os.environ.get('ADMISSION_QUEUE_WORKERS', 2))  # Trabalhos da fila processados ao mesmo tempo
+app.config['ADMISSION_QUEUE_DEADLINE'] = float(os.environ.get('ADMISSION_QUEUE_DEADLINE', 1800))  # Prazo (segundos) de cada trabalho da fila
+app.config['ESTIMATE_INPUT_TOKENS_PER_S'] = float(os.environ.get('ESTIMATE_INPUT_TOKENS_PER_S', 10000))  # Leitura da entrada pelo Gemini (tokens/s)
+app.config['ESTIMATE_OUTPUT_TOKENS_PER_S'] = float(os.environ.get('ESTIMATE_OUTPUT_TOKENS_PER_S', 100))  # Geração, até haver chamadas observadas (tokens/s)
+app.config['TEXT_CACHE_SIZE'] = int(os.environ.get('TEXT_CACHE_SIZE', 32))  # Textos extraídos de PDFs mantidos em memória
+app.config['HEDGE_ENABLED'] = os.environ.get('HEDGE_ENABLED', '0') == '1'  # Repetir chamadas lentas ao Gemini (hedging)
+app.config['HEDGE_PERCENTILE'] = float(os.environ.get('HEDGE_PERCENTILE', 90))  # Percentil da latência que dispara o hedge
+app.config['HEDGE_MAX_RATE'] = float(os.environ.get('HEDGE_MAX_RATE', 0.05))  # Fração máxima de chamadas extras
+app.config['HEDGE_MIN_SAMPLES'] = int(os.environ.get('HEDGE_MIN_SAMPLES', 20))  # Amostras necessárias antes do primeiro hedge
+app.config['IDEMPOTENCY_WINDOW'] = int(os.environ.get('IDEMPOTENCY_WINDOW', 600))  # Segundos em que um resultado concluído é reaproveitado
 
 # Create uploads folder if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RESULT_FOLDER'], exist_ok=True)
 
 # Configure Gemini API (you'll need to set your API key in environment variables)
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+GEMINI_API_KEYS = [k.strip() for k in os.environ.get("GEMINI_API_KEYS", "").split(',') if k.strip()]  # Chaves adicionais do pool
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY") or (GEMINI_API_KEYS[0] if GEMINI_API_KEYS else None)
+GEMINI_MODEL = 'gemini-2.0-flash'
+GEMINI_CACHED_MODEL = 'gemini-2.0-flash-001'  # O cache de contexto exige uma versão fixa do modelo
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT")  # Endpoint alternativo (ex.: http://127.0.0.1:8089 para o fake_gemini_server.py)
 
-# Configure Gemini
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    logger.info("Gemini API configurada com sucesso.")
-else:
+if not GEMINI_API_KEY:
     logger.warning("GEMINI_API_KEY environment variable not set")
 
+# Módulos pesados (google.generativeai, PyMuPDF, python-docx) são importados
+# apenas no primeiro uso, para que processos que servem só / e /resultado
+# não paguem esse custo no cold start.
+_genai = None
+_brotli = None
+
+def get_genai():
+    """Importar e configurar o SDK do Gemini no primeiro uso"""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        if GEMINI_API_KEY:
+            genai.configure(**gemini_client_options(GEMINI_API_KEY))
+            if GEMINI_API_ENDPOINT:
+                logger.info(f"Gemini API configurada com endpoint alternativo: {GEMINI_API_ENDPOINT}")
+            else:
+                logger.info("Gemini API configurada com sucesso.")
+        _genai = genai
+    return _genai
+
+def get_brotli():
+    """Importar o módulo brotli no primeiro uso (dependência opcional; None se ausente)"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli or None
+
+def gemini_client_options(api_key):
+    """Parâmetros de configuração do cliente do Gemini para uma chave"""
+    if GEMINI_API_ENDPOINT:
+        return {'api_key': api_key, 'transport': 'rest', 'client_options': {'api_endpoint': GEMINI_API_ENDPOINT}}
+    return {'api_key': api_key}
+
+# Métricas em memória (latências recentes e contadores), expostas em /api/metrics
+_metrics_lock = threading.Lock()
+_latency_samples = {}  # nome -> deque com as durações mais recentes (segundos)
+_counters = {}         # nome -> valor
+
+def record_latency(name, seconds):
+    """Registrar uma duração (em segundos) para a métrica informada"""
+    with _metrics_lock:
+        _latency_samples.setdefault(name, deque(maxlen=1000)).append(seconds)
+
+def increment_counter(name, amount=1):
+    """Incrementar um contador de métricas"""
+    with _metrics_lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+# Uso observado das chamadas ao Gemini, base das estimativas de duração da admissão
+_llm_usage = {}  # tipo de chamada -> deque de (tokens de entrada, tokens de saída, segundos)
+
+def record_llm_usage(kind, input_tokens, output_tokens, seconds):
+    """Registrar os tokens e a duração de uma chamada concluída"""
+    with _metrics_lock:
+        _llm_usage.setdefault(kind, deque(maxlen=200)).append((input_tokens, output_tokens, seconds))
+
+def observed_llm_usage(kind=None):
+    """Chamadas recentes do tipo informado (ou de todos os tipos)"""
+    with _metrics_lock:
+        if kind is not None:
+            return list(_llm_usage.get(kind, ()))
+        return [sample for samples in _llm_usage.values() for sample in samples]
+
+def _percentile(sorted_samples, percentile):
+    index = min(len(sorted_samples) - 1, int(round(percentile / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+def latency_percentile(name, percentile):
+    """Percentil (0-100) das durações recentes da métrica, ou None sem amostras"""
+    with _metrics_lock:
+        samples = sorted(_latency_samples.get(name, ()))
+    if not samples:
+        return None
+    return _percentile(samples, percentile)
+
+def metrics_snapshot():
+    """Resumo das métricas: contagem, média e percentis de cada latência, mais os contadores"""
+    with _metrics_lock:
+        latencies = {name: sorted(samples) for name, samples in _latency_samples.items()}
+        counters = dict(_counters)
+
+    summary = {}
+    for name, samples in latencies.items():
+        if not samples:
+            continue
+        summary[name] = {
+            'count': len(samples),
+            'mean_s': sum(samples) / len(samples),
+            'p50_s': _percentile(samples, 50),
+            'p95_s': _percentile(samples, 95),
+            'p99_s': _percentile(samples, 99)
+        }
+    return {'latencies': summary, 'counters': counters}
+
+# Expressões regulares pré-compiladas
+JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+JSON_FALLBACK_RE = re.compile(r'({[\s\S]*?"pedidos"\s*:\s*\[[\s\S]*?\]\s*})')
+
+# Padrões de seções principais
+MAIN_SECTION_PATTERNS = [
+    re.compile(r'PRELIMINARMENTE|PRELIMINAR', re.IGNORECASE),
+    re.compile(r'DO MÉRITO|MÉRITO', re.IGNORECASE),
+    re.compile(r'DOS PEDIDOS|DOS REQUERIMENTOS', re.IGNORECASE),
+    re.compile(r'DOCUMENTOS ANEXOS', re.IGNORECASE)
+]
+
+# Numeração e marcação antes do título de uma seção ("II - ", "2. ", "**", "#")
+HEADING_PREFIX_RE = re.compile(r'^[\s#*]*(?:(?:[IVXLC]+|\d+)\s*[-–—.)]\s*)?')
+
+# Padrões de subseções
+SUBSECTION_PATTERNS = [
+    re.compile(r'(\d+)[\.\)]\s*([A-Z][^\.]+)'),
+    re.compile(r'([a-z]\))\s*([A-Z][^\.]+)'),
+    re.compile(r'(\d+)[\.\)]\s*([A-Z][^\.]+)')
+]
+
 # Unified prompt for Gemini
 PROMPT = """
 Você é um assistente jurídico especializado em extração de dados e formatação de documentos jurídicos. Receberá dois documentos de texto extraídos de PDFs:
@@ -181,42 +395,752 @@ Sua tarefa é:
 2. Em seguida, retorne a contestação formatada seguindo EXATAMENTE a estrutura acima
 """
 
-def save_result_to_file(result):
-    """Salvar resultado em arquivo temporário e retornar o ID"""
-    result_id = str(uuid.uuid4())
-    result_path = os.path.join(app.config['RESULT_FOLDER'], f"{result_id}.txt")
+# Prompt para regenerar uma única seção da contestação
+SECTION_PROMPT = """
+Você é um assistente jurídico especializado em contestações. Reescreva APENAS a seção "{titulo}" de uma contestação jurídica já redigida.
+
+Use os dados extraídos da petição inicial (JSON) como fonte dos fatos e mantenha coerência de estilo, numeração e argumentação com as seções vizinhas fornecidas.
+
+⚠️ REGRAS:
+1. Retorne somente o texto da seção, começando pela linha de título "{titulo}"
+2. Não inclua JSON, comentários nem outras seções
+3. Mantenha a linguagem jurídica formal e as citações de artigos de lei
+{instrucoes}"""
+
+# Prompt da geração paralela: primeiro só a ETAPA 1 (JSON), depois cada seção em uma chamada própria
+EXTRACTION_PROMPT = PROMPT[:PROMPT.index("### ETAPA 2")] + """### SAÍDA:
+
+Retorne APENAS o JSON estruturado com todos os dados extraídos, dentro de um bloco ```json.
+"""
+
+SECTION_GENERATION_PROMPT = """
+Você é um assistente jurídico especializado em contestações. Redija APENAS a parte "{titulo}" de uma contestação jurídica, seguindo a estrutura formal do CPC.
+
+Use os dados extraídos da petição inicial (JSON) como fonte dos fatos e o modelo de contestação como referência de estrutura, estilo e linguagem.
+
+Conteúdo esperado:
+{instrucoes}
+
+⚠️ REGRAS:
+1. Retorne somente o texto desta parte, {inicio}
+2. Não inclua JSON, comentários nem outras partes da contestação
+3. Mantenha a linguagem jurídica formal e as citações de artigos de lei
+"""
+
+# Partes da contestação geradas em paralelo, na ordem do CPC (título, conteúdo, tem linha de título)
+PARALLEL_SECTIONS = [
+    ("CABEÇALHO", "- Endereçamento ao juízo\n- Qualificação da parte ré\n- Número do processo\n- Título CONTESTAÇÃO", False),
+    ("PRELIMINARMENTE", "- Argumentos processuais numerados\n- Cada argumento com fundamentação legal\n- Citações de artigos do CPC", True),
+    ("DO MÉRITO", "- Fatos e fundamentos jurídicos\n- Argumentação detalhada\n- Jurisprudência relevante\n- Artigos de lei aplicáveis", True),
+    ("DOS PEDIDOS", "- Pedidos numerados\n- Fundamentação de cada pedido\n- Valores e prazos quando aplicável", True),
+    ("DOCUMENTOS ANEXOS", "- Lista numerada de documentos, começando pela Procuração\n- Conclusão: Termos em que, Pede deferimento., cidade, data, nome do advogado e OAB", True),
+]
+
+# Armazenamento de resultados plugável: 'local' (RESULT_FOLDER), 'shared' (sistema de
+# arquivos compartilhado entre os nós) ou 'redis' (chave-valor em rede). Um LRU local
+# de leitura fica na frente, para que leituras frequentes não custem ida à rede.
+RESULT_ID_RE = re.compile(r'^[0-9a-fA-F-]{1,64}$')
+
+class FileResultBackend:
+    """Resultados em arquivos .txt numa pasta (local ou montada em todos os nós)"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, result_id):
+        return os.path.join(self.folder, f"{result_id}.txt")
+
+    def save(self, result_id, result):
+        # Escrita atômica: outros nós nunca leem um arquivo pela metade
+        path = self._path(result_id)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(result)
+        os.replace(temp_path, path)
+        return os.stat(path).st_mtime_ns
+
+    def load(self, result_id):
+        """Retornar (resultado, versão) ou (None, None)"""
+        path = self._path(result_id)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                version = os.fstat(f.fileno()).st_mtime_ns
+                return f.read(), version
+        except FileNotFoundError:
+            return None, None
+
+    def version(self, result_id):
+        try:
+            return os.stat(self._path(result_id)).st_mtime_ns
+        except OSError:
+            return None
+
+    def list_ids(self, since_ns, until_ns):
+        """IDs dos resultados salvos no intervalo [since_ns, until_ns), pela versão (mtime)"""
+        found = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                result_id, ext = os.path.splitext(entry.name)
+                if ext != '.txt' or not RESULT_ID_RE.match(result_id):
+                    continue
+                version = entry.stat().st_mtime_ns
+                if since_ns <= version < until_ns:
+                    found.append((version, result_id))
+        return [result_id for _, result_id in sorted(found)]
+
+class RedisResultBackend:
+    """Resultados num servidor Redis (ou compatível), como hash {body, version} com TTL"""
+
+    def __init__(self, url, ttl):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def _key(self, result_id):
+        return f"minhahonrajus:result:{result_id}"
+
+    def save(self, result_id, result):
+        version = time.time_ns()
+        pipeline = self.client.pipeline()
+        pipeline.hset(self._key(result_id), mapping={'body': result.encode('utf-8'), 'version': version})
+        if self.ttl:
+            pipeline.expire(self._key(result_id), self.ttl)
+        pipeline.execute()
+        return version
+
+    def load(self, result_id):
+        body, version = self.client.hmget(self._key(result_id), ['body', 'version'])
+        if body is None:
+            return None, None
+        return body.decode('utf-8'), int(version)
+
+    def version(self, result_id):
+        version = self.client.hget(self._key(result_id), 'version')
+        return int(version) if version is not None else None
+
+    def list_ids(self, since_ns, until_ns):
+        """IDs dos resultados salvos no intervalo [since_ns, until_ns), pela versão (instante da gravação)"""
+        keys = list(self.client.scan_iter(match=self._key('*'), count=500))
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hget(key, 'version')
+        found = []
+        for key, version in zip(keys, pipeline.execute()):
+            if version is not None and since_ns <= int(version) < until_ns:
+                found.append((int(version), key.decode('utf-8').rsplit(':', 1)[-1]))
+        return [result_id for _, result_id in sorted(found)]
+
+class CachedResultBackend:
+    """LRU local de leitura na frente de outro backend.
+
+    As entradas expiram após RESULT_CACHE_TTL segundos, limitando por quanto tempo
+    uma regeneração feita em outro nó pode deixar de ser vista aqui.
+    """
+
+    def __init__(self, backend, size, ttl):
+        self.backend = backend
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # result_id -> (resultado, versão, instante)
+        self._lock = threading.Lock()
+
+    def _get(self, result_id):
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[2] > self.ttl:
+                del self._entries[result_id]
+                return None
+            self._entries.move_to_end(result_id)
+            return entry
+
+    def _put(self, result_id, result, version):
+        with self._lock:
+            self._entries[result_id] = (result, version, time.monotonic())
+            self._entries.move_to_end(result_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def save(self, result_id, result):
+        version = self.backend.save(result_id, result)
+        self._put(result_id, result, version)
+        return version
+
+    def load(self, result_id):
+        entry = self._get(result_id)
+        if entry:
+            increment_counter('result_cache.hits')
+            return entry[0], entry[1]
+        increment_counter('result_cache.misses')
+        result, version = self.backend.load(result_id)
+        if result is not None:
+            self._put(result_id, result, version)
+        return result, version
+
+    def version(self, result_id):
+        entry = self._get(result_id)
+        if entry:
+            return entry[1]
+        return self.load(result_id)[1]
+
+    def list_ids(self, since_ns, until_ns):
+        return self.backend.list_ids(since_ns, until_ns)
+
+_result_backend = None
+
+def get_result_backend():
+    """Criar (uma vez) o backend de resultados configurado em RESULT_BACKEND"""
+    global _result_backend
+    if _result_backend is None:
+        kind = app.config['RESULT_BACKEND']
+        if kind == 'redis':
+            backend = RedisResultBackend(app.config['RESULT_REDIS_URL'], app.config['RESULT_TTL'])
+        elif kind == 'shared':
+            backend = FileResultBackend(app.config['RESULT_SHARED_FOLDER'])
+        else:
+            backend = FileResultBackend(app.config['RESULT_FOLDER'])
+        _result_backend = CachedResultBackend(backend, app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'])
+        logger.info(f"Backend de resultados: {kind}")
+    return _result_backend
+
+def save_result_to_file(result, result_id=None):
+    """Salvar resultado no backend configurado e retornar o ID (sobrescreve se result_id for informado)"""
+    result_id = result_id or str(uuid.uuid4())
     
     try:
-        with open(result_path, 'w', encoding='utf-8') as f:
-            f.write(result)
-        logger.info(f"Resultado salvo em arquivo: {result_path}")
+        get_result_backend().save(result_id, result)
+        logger.info(f"Resultado salvo: {result_id}")
         return result_id
     except Exception as e:
-        logger.error(f"Erro ao salvar resultado em arquivo: {str(e)}")
+        logger.error(f"Erro ao salvar resultado: {str(e)}")
         return None
 
 def get_result_from_file(result_id):
-    """Recuperar resultado do arquivo temporário"""
-    if not result_id:
+    """Recuperar resultado do backend configurado"""
+    if not result_id or not RESULT_ID_RE.match(result_id):
         return None
-        
-    result_path = os.path.join(app.config['RESULT_FOLDER'], f"{result_id}.txt")
     
     try:
-        if not os.path.exists(result_path):
-            logger.error(f"Arquivo de resultado não encontrado: {result_path}")
+        result, _ = get_result_backend().load(result_id)
+        if result is None:
+            logger.error(f"Resultado não encontrado: {result_id}")
             return None
-            
-        with open(result_path, 'r', encoding='utf-8') as f:
-            result = f.read()
-        logger.info(f"Resultado recuperado do arquivo: {result_path}")
+        logger.info(f"Resultado recuperado: {result_id}")
         return result
     except Exception as e:
-        logger.error(f"Erro ao ler resultado do arquivo: {str(e)}")
+        logger.error(f"Erro ao ler resultado: {str(e)}")
         return None
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF file using PyMuPDF"""
+# Deduplicação de submissões: duplicatas em andamento aguardam a mesma
+# computação; duplicatas posteriores recebem o resultado já guardado.
+_dedup_lock = threading.Lock()
+_inflight_requests = {}   # chave -> (Future com (result, result_id), conteúdo)
+_completed_requests = {}  # chave -> (result_id, timestamp, conteúdo)
+
+class IdempotencyKeyConflict(Exception):
+    """Idempotency-Key reutilizada com outros arquivos ou opções"""
+
+def upload_digest(file_storage):
+    """SHA-256 do conteúdo de um upload"""
+    stream = file_storage.stream
+    if isinstance(stream, HashingUploadFile):
+        # Hash calculado durante o recebimento do upload
+        return stream.hexdigest()
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def compute_request_key(peticao_file, modelo_file, *options):
+    """Chave de deduplicação e identificação do conteúdo da submissão: (chave, conteúdo).
+
+    O conteúdo é o hash SHA-256 do par petição/modelo mais options, que distinguem
+    submissões do mesmo par com opções diferentes (intervalo de páginas, modo de
+    geração, política de admissão).
+    A chave é o próprio conteúdo ou, com o header Idempotency-Key, essa chave no
+    escopo do cliente: clientes diferentes nunca compartilham resultados por ela.
+    """
+    variant = '|'.join(str(option or '') for option in options)
+    content = f"sha256:{upload_digest(peticao_file)}:{upload_digest(modelo_file)}:{variant}"
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        return f"key:{request_tenant()}:{idempotency_key}", content
+    return content, content
+
+def run_single_flight(key, compute, content=None):
+    """Executar compute() uma única vez por chave e retornar (result, result_id).
+
+    Uma duplicata que chega enquanto a chave está em processamento aguarda a mesma
+    computação; uma que chega depois recebe o resultado guardado, dentro da janela
+    IDEMPOTENCY_WINDOW. Falhas não são guardadas. A mesma chave com outro content
+    (Idempotency-Key reutilizada com outros arquivos) lança IdempotencyKeyConflict.
+    """
+    now = time.time()
+    window = app.config['IDEMPOTENCY_WINDOW']
+    with _dedup_lock:
+        expired = [k for k, (_, ts, _) in _completed_requests.items() if now - ts > window]
+        for k in expired:
+            del _completed_requests[k]
+
+        completed = _completed_requests.get(key)
+        inflight = _inflight_requests.get(key)
+        previous = completed or inflight
+        if previous and previous[-1] != content:
+            raise IdempotencyKeyConflict("Idempotency-Key já usada com outros arquivos ou opções")
+        if not completed:
+            is_owner = inflight is None
+            if is_owner:
+                future = Future()
+                _inflight_requests[key] = (future, content)
+            else:
+                future = inflight[0]
+
+    if completed:
+        # Leitura fora do lock: com backend remoto, uma ida ao Redis ou à pasta
+        # compartilhada não bloqueia as demais submissões
+        result = get_result_from_file(completed[0])
+        if result:
+            logger.info(f"Requisição duplicada: reaproveitando resultado {completed[0]}")
+            return result, completed[0]
+        with _dedup_lock:
+            if _completed_requests.get(key) is completed:
+                del _completed_requests[key]
+        return run_single_flight(key, compute, content)
+
+    if not is_owner:
+        logger.info("Requisição duplicada em andamento: aguardando a computação original")
+        while not wait([future], timeout=app.config['DEADLINE_POLL_INTERVAL']).done:
+            check_deadline('aguardando requisição duplicada')
+        try:
+            return future.result()
+        except DeadlineExceeded as e:
+            # O cliente da requisição original desconectou; esta duplicata segue ativa
+            own = _request_deadline.get()
+            if e.reason == 'disconnect' and (own is None or own.reason is None):
+                logger.info("Requisição original cancelada; reprocessando para a duplicata")
+                return run_single_flight(key, compute, content)
+            raise
+
+    try:
+        outcome = compute()
+    except Exception as e:
+        with _dedup_lock:
+            _inflight_requests.pop(key, None)
+        future.set_exception(e)
+        raise
+
+    with _dedup_lock:
+        _inflight_requests.pop(key, None)
+        if outcome[1]:
+            _completed_requests[key] = (outcome[1], time.time(), content)
+    future.set_result(outcome)
+    return outcome
+
+def get_result_version(result_id):
+    """Versão do resultado guardado, usada para invalidar caches derivados (None se não existir)"""
+    if not result_id or not RESULT_ID_RE.match(result_id):
+        return None
+    try:
+        return get_result_backend().version(result_id)
+    except Exception as e:
+        logger.error(f"Erro ao consultar versão do resultado: {str(e)}")
+        return None
+
+# Cache das páginas de resultado renderizadas, com as variantes comprimidas
+_page_cache = OrderedDict()  # (result_id, versão do resultado, versão do template, data) -> entrada
+_page_cache_lock = threading.Lock()
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript'}
+
+def template_version(template_name):
+    """Versão do template (mtime em ns), para invalidar páginas renderizadas com uma versão anterior"""
+    return os.stat(os.path.join(app.root_path, app.template_folder, template_name)).st_mtime_ns
+
+def negotiate_encoding():
+    """Escolher a codificação da resposta conforme o Accept-Encoding (br, gzip ou identity)"""
+    if request.accept_encodings['br'] and get_brotli():
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return 'identity'
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return get_brotli().compress(data, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+def get_cached_page(cache_key):
+    with _page_cache_lock:
+        entry = _page_cache.get(cache_key)
+        if entry is not None:
+            _page_cache.move_to_end(cache_key)
+        return entry
+
+def store_cached_page(cache_key, html, last_modified):
+    """Guardar uma página renderizada no cache (LRU) e retornar a entrada"""
+    body = html.encode('utf-8')
+    entry = {
+        'etag': hashlib.sha1(body).hexdigest(),
+        'last_modified': last_modified,
+        'variants': {'identity': body}
+    }
+    with _page_cache_lock:
+        # Descartar versões antigas do mesmo resultado
+        for key in [k for k in _page_cache if k[0] == cache_key[0]]:
+            del _page_cache[key]
+        _page_cache[cache_key] = entry
+        while len(_page_cache) > app.config['RESULT_PAGE_CACHE_SIZE']:
+            _page_cache.popitem(last=False)
+    return entry
+
+def cached_page_response(entry):
+    """Resposta de uma página em cache, comprimida e com ETag/Last-Modified (304 quando aplicável)"""
+    encoding = negotiate_encoding()
+    body = entry['variants'].get(encoding)
+    if body is None:
+        body = compress_body(entry['variants']['identity'], encoding)
+        entry['variants'][encoding] = body
+
+    response = app.response_class(body, mimetype='text/html')
+    response.set_etag(entry['etag'] if encoding == 'identity' else f"{entry['etag']}-{encoding}")
+    response.last_modified = entry['last_modified']
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    return response.make_conditional(request)
+
+# Extração local de identificadores estruturados (uma única passada sobre o texto)
+KNOWN_FACTS_RE = re.compile(
+    # Só as palavras-chave ignoram maiúsculas/minúsculas; UF, siglas de lei e nomes próprios não
+    r'(?P<cnj>(?P<cnj_rotulo>\b(?i:processo|autos)\s+(?i:n[úu]mero|n\.?\s*[º°o]?\.?)\s*:?\s*)?\b\d{7}-\d{2}\.\d{4}\.\d\.\d{2}\.\d{4}\b)'
+    r'|(?P<cnpj>\b\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\b)'
+    r'|(?P<cpf>\b\d{3}\.\d{3}\.\d{3}-\d{2}\b)'
+    r'|(?P<oab>\b(?i:OAB)\s*/?\s*(?P<oab_uf>[A-Z]{2})\s*,?\s*(?:(?i:sob\s+o\s+)?(?i:n[úu]mero|n\.?\s*[º°o]?\.?)\s*)?'
+    r'(?P<oab_num>\d{1,3}(?:\.\d{3})+|\d+)(?:-?[A-Z])?)'
+    r'|(?P<valor>R\$\s*\d{1,3}(?:\.\d{3})*(?:,\d{2})?)'
+    r'|(?P<artigo>\b(?i:art(?:igo)?s?)\.?\s*(?P<artigo_num>\d+(?:\.\d{3})*[º°]?(?:-[A-Z])?)'
+    r'(?:[^.;\n]{0,40}?\b(?i:d[oa]s?\s+)?(?P<artigo_lei>CPC|CDC|CLT|CF'
+    r'|(?i:c[óo]digo\s+(?:civil|de\s+processo\s+civil|de\s+defesa\s+do\s+consumidor))'
+    r'|(?i:constitui[çc][ãa]o\s+federal)|(?i:lei)\s+n?[º°.]*\s*\d{1,2}\.?\d{3}(?:/\d{2,4})?))?)'
+    # Nome da comarca: palavras iniciadas em maiúscula, ligadas só por da/de/do/das/dos;
+    # para em pontuação ou em qualquer outra palavra minúscula ("... de São Paulo que julgou")
+    r'|(?P<comarca>\b(?i:comarca\s+de)\s+(?P<comarca_nome>[A-ZÀ-Ú][A-ZÀ-Úa-zà-ú\']*'
+    r'(?:\s+(?:(?:D[AEO]S?|d[aeo]s?)\s+)?[A-ZÀ-Ú][A-ZÀ-Úa-zà-ú\']*)*))'
+)
+WHITESPACE_RE = re.compile(r'\s+')
+
+def _digits(value):
+    return [int(c) for c in value if c.isdigit()]
+
+def is_valid_cnj(numero):
+    """Validar o dígito verificador do número CNJ (módulo 97, Resolução CNJ 65/2008)"""
+    d = ''.join(str(c) for c in _digits(numero))
+    if len(d) != 20:
+        return False
+    # NNNNNNN DD AAAA J TR OOOO -> NNNNNNN AAAA J TR OOOO DD
+    return int(d[:7] + d[9:] + d[7:9]) % 97 == 1
+
+def is_valid_cpf(cpf):
+    """Validar os dígitos verificadores do CPF"""
+    d = _digits(cpf)
+    if len(d) != 11 or len(set(d)) == 1:
+        return False
+    for size in (9, 10):
+        check = sum(v * w for v, w in zip(d[:size], range(size + 1, 1, -1))) * 10 % 11 % 10
+        if check != d[size]:
+            return False
+    return True
+
+def is_valid_cnpj(cnpj):
+    """Validar os dígitos verificadores do CNPJ"""
+    d = _digits(cnpj)
+    if len(d) != 14 or len(set(d)) == 1:
+        return False
+    for size, weights in ((12, [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]), (13, [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])):
+        remainder = sum(v * w for v, w in zip(d[:size], weights)) % 11
+        if (0 if remainder < 2 else 11 - remainder) != d[size]:
+            return False
+    return True
+
+def extract_known_facts(text):
+    """Extrair localmente identificadores com formato rígido da petição, validando dígitos verificadores.
+
+    Retorna um dicionário com o número do processo, comarca, CPFs, CNPJs, OABs,
+    valores monetários e artigos citados (listas sem repetição, na ordem do texto).
+    O número do processo é o primeiro CNJ válido precedido de "Processo nº"/"autos nº"
+    ('numero_rotulado' verdadeiro) ou, na falta dele, o primeiro CNJ válido do texto.
+    """
+    facts = {'numero_processo': '', 'numero_rotulado': False, 'comarca': '', 'cpfs': [], 'cnpjs': [], 'oabs': [], 'valores': [], 'artigos': []}
+
+    def add(key, value):
+        if value not in facts[key]:
+            facts[key].append(value)
+
+    for match in KNOWN_FACTS_RE.finditer(text):
+        if match.group('cnj'):
+            numero = match.group('cnj')[len(match.group('cnj_rotulo') or ''):]
+            rotulado = bool(match.group('cnj_rotulo'))
+            if is_valid_cnj(numero) and (not facts['numero_processo'] or (rotulado and not facts['numero_rotulado'])):
+                facts['numero_processo'] = numero
+                facts['numero_rotulado'] = rotulado
+        elif match.group('cnpj'):
+            if is_valid_cnpj(match.group('cnpj')):
+                add('cnpjs', match.group('cnpj'))
+        elif match.group('cpf'):
+            if is_valid_cpf(match.group('cpf')):
+                add('cpfs', match.group('cpf'))
+        elif match.group('oab'):
+            add('oabs', f"OAB/{match.group('oab_uf').upper()} {match.group('oab_num')}")
+        elif match.group('valor'):
+            add('valores', WHITESPACE_RE.sub(' ', match.group('valor')))
+        elif match.group('artigo'):
+            lei = WHITESPACE_RE.sub(' ', match.group('artigo_lei') or '')
+            add('artigos', f"art. {match.group('artigo_num')} {lei}".strip())
+        elif match.group('comarca'):
+            if not facts['comarca']:
+                facts['comarca'] = match.group('comarca_nome').strip()
+
+    logger.info(
+        f"Extração local: processo={facts['numero_processo'] or '-'}, {len(facts['cpfs'])} CPF(s), "
+        f"{len(facts['cnpjs'])} CNPJ(s), {len(facts['oabs'])} OAB(s), {len(facts['valores'])} valor(es), "
+        f"{len(facts['artigos'])} artigo(s)"
+    )
+    return facts
+
+def format_known_facts(facts):
+    """Texto com os dados já identificados localmente, para enviar ao Gemini como fatos conhecidos"""
+    lines = []
+    if facts['numero_processo'] and facts['numero_rotulado']:
+        lines.append(f"- Número do processo (validado): {facts['numero_processo']}")
+    elif facts['numero_processo']:
+        lines.append(f"- Número CNJ válido citado no texto (pode ser jurisprudência): {facts['numero_processo']}")
+    if facts['comarca']:
+        lines.append(f"- Comarca: {facts['comarca']}")
+    labels = [('cpfs', 'CPFs válidos'), ('cnpjs', 'CNPJs válidos'), ('oabs', 'Inscrições OAB'),
+              ('valores', 'Valores citados'), ('artigos', 'Artigos citados')]
+    for key, label in labels:
+        if facts[key]:
+            lines.append(f"- {label}: {', '.join(facts[key])}")
+    if not lines:
+        return None
+    return ("### DADOS JÁ IDENTIFICADOS NA PETIÇÃO (validados localmente; use-os como estão no JSON e na contestação):\n"
+            + "\n".join(lines))
+
+def apply_known_facts(json_data, facts):
+    """Preencher no JSON extraído os campos identificados localmente"""
+    if not isinstance(json_data, dict) or 'error' in json_data:
+        return json_data
+
+    processo = json_data.setdefault('processo', {})
+    # Um CNJ solto pode ser jurisprudência citada: só substitui o número do modelo quando
+    # este está vazio/inválido ou quando o texto o rotula como "Processo nº"/"autos nº"
+    if facts['numero_processo'] and (facts['numero_rotulado'] or not is_valid_cnj(processo.get('numero') or '')):
+        processo['numero'] = facts['numero_processo']
+    if facts['comarca'] and not processo.get('comarca'):
+        processo['comarca'] = facts['comarca']
+
+    # CPF/CNPJ só quando não há ambiguidade: um único CPF para o autor, um único CNPJ para o réu
+    autor = json_data.get('autor')
+    if isinstance(autor, dict) and len(facts['cpfs']) == 1 and not is_valid_cpf(autor.get('cpf_cnpj', '')):
+        autor['cpf_cnpj'] = facts['cpfs'][0]
+    reu = json_data.get('reu')
+    if isinstance(reu, dict) and len(facts['cnpjs']) == 1 and not is_valid_cnpj(reu.get('cnpj', '')):
+        reu['cnpj'] = facts['cnpjs'][0]
+
+    json_data['identificadores'] = {key: facts[key] for key in ('cpfs', 'cnpjs', 'oabs', 'valores', 'artigos')}
+    return json_data
+
+# Prazos por requisição: o prazo (REQUEST_DEADLINE, ou menor via header X-Request-Timeout)
+# acompanha a extração, as chamadas ao Gemini e a montagem da resposta. Uma thread de
+# monitoramento cancela a requisição quando o prazo se esgota ou o cliente desconecta,
+# fechando a chamada em curso ao Gemini e liberando a vaga no agendador.
+class DeadlineExceeded(Exception):
+    """Requisição cancelada: prazo esgotado ('deadline') ou cliente desconectado ('disconnect')"""
+
+    def __init__(self, reason, stage):
+        super().__init__(f"Requisição cancelada ({'prazo esgotado' if reason == 'deadline' else 'cliente desconectado'}) durante: {stage}")
+        self.reason = reason
+        self.stage = stage
+
+class RequestDeadline:
+    """Prazo e estado de cancelamento de uma requisição, com as chamadas ao Gemini em curso"""
+
+    def __init__(self, seconds, client_socket=None):
+        self.expires_at = time.monotonic() + seconds
+        self.client_socket = client_socket
+        self.reason = None
+        self._lock = threading.Lock()
+        self._handles = set()
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self, reason):
+        """Cancelar a requisição e fechar as chamadas em curso (apenas a primeira vez conta)"""
+        with self._lock:
+            if self.reason:
+                return
+            self.reason = reason
+            handles = list(self._handles)
+        logger.warning(f"Requisição cancelada: {reason}; {len(handles)} chamada(s) ao Gemini interrompida(s)")
+        increment_counter(f'cancelled.requests.{reason}')
+        for handle in handles:
+            cancel_upstream(handle)
+
+    def check(self, stage):
+        """Lançar DeadlineExceeded se a requisição foi cancelada ou o prazo acabou"""
+        if self.reason is None and time.monotonic() >= self.expires_at:
+            self.cancel('deadline')
+        if self.reason:
+            raise DeadlineExceeded(self.reason, stage)
+
+    def register(self, handle):
+        """Acompanhar uma chamada em curso; se a requisição já foi cancelada, fechá-la na hora"""
+        with self._lock:
+            if not self.reason:
+                self._handles.add(handle)
+                return
+        cancel_upstream(handle)
+
+    def unregister(self, handle):
+        with self._lock:
+            self._handles.discard(handle)
+
+def cancel_upstream(handle):
+    """Fechar o fluxo de uma chamada ao Gemini (o provedor interrompe a geração)"""
+    try:
+        handle.cancel()
+    except Exception as e:
+        logger.warning(f"Erro ao cancelar chamada ao Gemini: {str(e)}")
+
+_request_deadline = contextvars.ContextVar('request_deadline', default=None)
+_active_deadlines = set()
+_deadline_lock = threading.Lock()
+_deadline_monitor = None
+
+def check_deadline(stage):
+    """Verificar o prazo da requisição atual (sem efeito fora de uma requisição com prazo)"""
+    deadline = _request_deadline.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+def client_disconnected(client_socket):
+    """O cliente fechou a conexão? (leitura sem consumir dados; EOF indica desconexão)"""
+    try:
+        readable, _, _ = select.select([client_socket], [], [], 0)
+        return bool(readable) and client_socket.recv(1, socket.MSG_PEEK) == b''
+    except ValueError:
+        return False  # socket já fechado pelo servidor ou TLS (sem MSG_PEEK)
+    except OSError:
+        return True
+
+def monitor_deadlines():
+    """Thread de monitoramento: cancela requisições com prazo esgotado ou cliente desconectado"""
+    while True:
+        time.sleep(app.config['DEADLINE_POLL_INTERVAL'])
+        with _deadline_lock:
+            deadlines = list(_active_deadlines)
+        for deadline in deadlines:
+            if deadline.reason:
+                continue
+            if deadline.remaining() == 0:
+                deadline.cancel('deadline')
+            elif deadline.client_socket is not None and client_disconnected(deadline.client_socket):
+                deadline.cancel('disconnect')
+
+def requested_deadline_seconds():
+    """Prazo da requisição atual: REQUEST_DEADLINE ou o menor pedido em X-Request-Timeout"""
+    seconds = app.config['REQUEST_DEADLINE']
+    try:
+        seconds = min(seconds, float(request.headers.get('X-Request-Timeout', seconds)))
+    except ValueError:
+        pass
+    return seconds
+
+@contextlib.contextmanager
+def request_deadline():
+    """Aplicar o prazo da requisição atual ao trabalho feito dentro do bloco"""
+    global _deadline_monitor
+    seconds = requested_deadline_seconds()
+    client_socket = request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+    deadline = RequestDeadline(seconds, client_socket)
+    token = _request_deadline.set(deadline)
+    with _deadline_lock:
+        _active_deadlines.add(deadline)
+        if _deadline_monitor is None:
+            _deadline_monitor = threading.Thread(target=monitor_deadlines, name='deadline-monitor', daemon=True)
+            _deadline_monitor.start()
+    try:
+        yield deadline
+    finally:
+        with _deadline_lock:
+            _active_deadlines.discard(deadline)
+        _request_deadline.reset(token)
+
+PETICAO_START_RE = re.compile(r'EXCELENT[ÍI]SSIM|AO\s+JU[ÍI]ZO|PETI[ÇC][ÃA]O\s+INICIAL', re.IGNORECASE)
+PETICAO_END_RE = re.compile(r'Termos\s+em\s+que|Nestes\s+termos|Pede[m]?\s+deferimento', re.IGNORECASE)
+PETICAO_OUTLINE_RE = re.compile(r'peti[çc][ãa]o\s+inicial|^inicial', re.IGNORECASE)
+PAGE_RANGE_RE = re.compile(r'^\s*(\d+)\s*(?:-\s*(\d+))?\s*$')
+
+def parse_page_range(value):
+    """Converter '10-45' ou '7' em (primeira, última), 1-based; None se vazio; ValueError se inválido"""
+    if not value:
+        return None
+    match = PAGE_RANGE_RE.match(value)
+    if not match:
+        raise ValueError(f"Intervalo de páginas inválido: {value}")
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    if first < 1 or last < first:
+        raise ValueError(f"Intervalo de páginas inválido: {value}")
+    return first, last
+
+def locate_peticao_pages(pdf_document):
+    """Localizar o intervalo (0-based, inclusivo) da petição inicial nos autos.
+
+    Usa o sumário (outline) do PDF quando existe; caso contrário, procura a primeira
+    página de endereçamento e a página de fechamento ("Termos em que", "Pede deferimento"),
+    lendo apenas as páginas necessárias.
+    """
+    num_pages = len(pdf_document)
+
+    toc = pdf_document.get_toc(simple=True)
+    for index, (level, title, page) in enumerate(toc):
+        if PETICAO_OUTLINE_RE.search(title.strip()) and page >= 1:
+            next_pages = [p for lvl, _, p in toc[index + 1:] if lvl <= level and p > page]
+            last = (next_pages[0] - 2) if next_pages else num_pages - 1
+            logger.info(f"Petição localizada pelo sumário: páginas {page}-{last + 1}")
+            return page - 1, max(page - 1, last)
+
+    scan_limit = min(num_pages, app.config['AUTOS_SCAN_PAGES'])
+    start = None
+    for page_num in range(scan_limit):
+        check_deadline('localização da petição nos autos')
+        page_text = pdf_document.load_page(page_num).get_text()
+        if start is None and PETICAO_START_RE.search(page_text):
+            start = page_num
+        if start is not None and PETICAO_END_RE.search(page_text):
+            logger.info(f"Petição localizada por heurística: páginas {start + 1}-{page_num + 1}")
+            return start, page_num
+
+    start = start or 0
+    logger.warning(f"Fim da petição não localizado; usando páginas {start + 1}-{scan_limit}")
+    return start, max(start, scan_limit - 1)
+
+def extract_text_from_pdf(pdf_path, pages=None):
+    """Extract text from a PDF file using PyMuPDF
+
+    pages: None extrai todas as páginas; (primeira, última) 1-based extrai só esse intervalo;
+    'auto' localiza a petição inicial dentro dos autos completos.
+    """
     text = ""
     try:
         # Verificar se o arquivo existe antes de tentar abri-lo
@@ -224,66 +1148,1218 @@ def extract_text_from_pdf(pdf_path):
             logger.error(f"Arquivo PDF não encontrado: {pdf_path}")
             return f"Error: O arquivo {pdf_path} não foi encontrado"
         
-        # Open the PDF file
-        pdf_document = fitz.open(pdf_path)
-        
-        # Get the number of pages
-        num_pages = len(pdf_document)
-        logger.info(f"Extraindo texto de PDF com {num_pages} páginas")
-        
-        # Extract text from each page
-        for page_num in range(num_pages):
-            page = pdf_document.load_page(page_num)
-            text += page.get_text()
-            
-        # Close the PDF file
-        pdf_document.close()
-        
+        import fitz  # PyMuPDF
+
+        # Open the PDF file (fechado também quando o prazo interrompe a extração)
+        with fitz.open(pdf_path) as pdf_document:
+            # Get the number of pages
+            num_pages = len(pdf_document)
+            if pages == 'auto':
+                first, last = locate_peticao_pages(pdf_document)
+            elif pages:
+                first, last = pages[0] - 1, min(pages[1], num_pages) - 1
+            else:
+                first, last = 0, num_pages - 1
+            logger.info(f"Extraindo texto das páginas {first + 1}-{last + 1} de PDF com {num_pages} páginas")
+
+            # Extract text from each selected page
+            page_texts = []
+            for page_num in range(first, last + 1):
+                check_deadline('extração do texto do PDF')
+                page = pdf_document.load_page(page_num)
+                page_texts.append(page.get_text())
+            text = "".join(page_texts)
+
         logger.info(f"Texto extraído com sucesso: {len(text)} caracteres")
         return text
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Erro ao extrair texto do PDF: {str(e)}")
         return f"Error extracting text from PDF: {str(e)}"
 
-def process_pdfs_with_gemini(peticao_pdf_path, modelo_pdf_path):
+# Textos extraídos por conteúdo do PDF e intervalo de páginas: /api/estimate e o
+# processamento (ou uma nova submissão do mesmo arquivo) não extraem o texto de novo.
+_text_cache = OrderedDict()  # (SHA-256 do PDF, páginas) -> texto
+_text_cache_lock = threading.Lock()
+
+def extract_text_cached(pdf_path, digest, pages=None):
+    """extract_text_from_pdf com cache pelo hash do arquivo"""
+    key = (digest, str(pages or ''))
+    with _text_cache_lock:
+        text = _text_cache.get(key)
+        if text is not None:
+            _text_cache.move_to_end(key)
+            increment_counter('text_cache.hits')
+            return text
+    text = extract_text_from_pdf(pdf_path, pages)
+    if text and not text.startswith("Error"):
+        with _text_cache_lock:
+            _text_cache[key] = text
+            while len(_text_cache) > app.config['TEXT_CACHE_SIZE']:
+                _text_cache.popitem(last=False)
+    return text
+
+# Agendador das chamadas ao Gemini: o tráfego interativo (formulário web, regeneração
+# de seções) tem prioridade sobre o tráfego em lote (/api/process), que nunca ocupa as
+# vagas reservadas. Dentro de cada classe, os clientes (X-API-Key ou IP) dividem as
+# vagas por fila justa ponderada (LLM_TENANT_WEIGHTS).
+LLM_PRIORITY_CLASSES = ('interactive', 'bulk')
+BULK_ENDPOINTS = {'api_process'}
+_llm_request = contextvars.ContextVar('llm_request', default=('interactive', 'local'))
+
+def parse_tenant_weights(value):
+    """Converter "a=3,b=1" em {'a': 3.0, 'b': 1.0}"""
+    weights = {}
+    for item in value.split(','):
+        tenant, _, weight = item.partition('=')
+        if tenant.strip() and weight.strip():
+            weights[tenant.strip()] = max(float(weight), 0.01)
+    return weights
+
+class LLMScheduler:
+    """Limita as chamadas simultâneas ao Gemini e decide quem é atendido quando uma vaga abre.
+
+    Prioridade estrita entre classes; entre clientes da mesma classe, fila justa
+    ponderada por tempo virtual (cada atendimento avança o cliente em 1/peso).
+    """
+
+    def __init__(self, max_concurrency, interactive_reserved, weights):
+        self.max_concurrency = max(1, max_concurrency)
+        self.bulk_limit = max(1, self.max_concurrency - interactive_reserved)
+        self.weights = weights
+        self._cond = threading.Condition()
+        self._running = {cls: 0 for cls in LLM_PRIORITY_CLASSES}
+        self._queues = {cls: OrderedDict() for cls in LLM_PRIORITY_CLASSES}  # cliente -> deque de pedidos
+        self._finish = {cls: {} for cls in LLM_PRIORITY_CLASSES}            # cliente -> tempo virtual
+        self._clock = {cls: 0.0 for cls in LLM_PRIORITY_CLASSES}
+
+    def _has_room(self, cls):
+        if sum(self._running.values()) >= self.max_concurrency:
+            return False
+        return cls == 'interactive' or self._running['bulk'] < self.bulk_limit
+
+    def _dispatch(self):
+        """Conceder as vagas livres aos próximos pedidos (chamado com o lock)"""
+        granted = False
+        for cls in LLM_PRIORITY_CLASSES:
+            queues, finish = self._queues[cls], self._finish[cls]
+            while queues and self._has_room(cls):
+                tenant = min(queues, key=lambda t: finish[t])
+                ticket = queues[tenant].popleft()
+                if not queues[tenant]:
+                    del queues[tenant]
+                self._clock[cls] = finish[tenant]
+                finish[tenant] += 1.0 / self.weights.get(tenant, 1.0)
+                self._running[cls] += 1
+                ticket['granted'] = True
+                granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def acquire(self, cls, tenant, deadline=None):
+        """Aguardar uma vaga e retornar o tempo de espera na fila (segundos).
+
+        Com deadline, desiste da fila (DeadlineExceeded) se a requisição for cancelada.
+        """
+        start = time.perf_counter()
+        ticket = {'granted': False}
+        with self._cond:
+            queues, finish = self._queues[cls], self._finish[cls]
+            if tenant not in queues:
+                # Cliente que volta a ter pedidos não acumula crédito do tempo ocioso
+                finish[tenant] = max(finish.get(tenant, 0.0), self._clock[cls])
+                queues[tenant] = deque()
+            queues[tenant].append(ticket)
+            self._dispatch()
+            while not ticket['granted']:
+                if deadline is not None and (deadline.reason or deadline.remaining() == 0):
+                    remaining = deque(t for t in queues[tenant] if t is not ticket)
+                    if remaining:
+                        queues[tenant] = remaining
+                    else:
+                        del queues[tenant]
+                    increment_counter('cancelled.llm_calls.queued')
+                    deadline.check('fila de chamadas ao Gemini')
+                self._cond.wait(app.config['DEADLINE_POLL_INTERVAL'] if deadline is not None else None)
+        waited = time.perf_counter() - start
+        record_latency(f'scheduler.wait.{cls}', waited)
+        increment_counter(f'scheduler.granted.{cls}')
+        return waited
+
+    def try_acquire(self, cls):
+        """Ocupar uma vaga sem esperar, apenas se ninguém estiver na fila (usado pelo hedging)"""
+        with self._cond:
+            if any(self._queues[c] for c in LLM_PRIORITY_CLASSES) or not self._has_room(cls):
+                return False
+            self._running[cls] += 1
+            return True
+
+    def release(self, cls):
+        with self._cond:
+            self._running[cls] -= 1
+            self._dispatch()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'running': dict(self._running),
+                'queued': {cls: sum(len(q) for q in self._queues[cls].values()) for cls in LLM_PRIORITY_CLASSES},
+                'max_concurrency': self.max_concurrency,
+                'bulk_limit': self.bulk_limit
+            }
+
+_llm_scheduler = None
+
+def get_llm_scheduler():
+    """Criar (uma vez) o agendador com os limites configurados"""
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        # A capacidade cresce com o número de chaves do pool
+        max_concurrency = app.config['LLM_MAX_CONCURRENCY'] * len(get_gemini_key_pool().keys or [None])
+        _llm_scheduler = LLMScheduler(max_concurrency, app.config['LLM_INTERACTIVE_RESERVED'],
+                                      parse_tenant_weights(app.config['LLM_TENANT_WEIGHTS']))
+    return _llm_scheduler
+
+def request_tenant():
+    """Cliente da requisição atual, para a divisão justa e o escopo da Idempotency-Key.
+
+    O header X-API-Key não é autenticado: ele só identifica o cliente quando a chave está
+    cadastrada em LLM_TENANT_WEIGHTS (e não é um IP). Qualquer outro valor é ignorado e vale
+    o IP de origem, para que ninguém ganhe filas extras ou entre no escopo de outro cliente
+    inventando chaves.
+    """
+    api_key = request.headers.get('X-API-Key', '').strip()
+    if api_key:
+        if api_key in get_llm_scheduler().weights and not is_ip_address(api_key):
+            return api_key
+        increment_counter('tenants.unknown_api_key')
+    return request.remote_addr or 'local'
+
+def is_ip_address(value):
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+@app.before_request
+def assign_llm_priority():
+    """Classificar a requisição (interativa ou em lote) para o agendador das chamadas ao Gemini"""
+    _llm_request.set(('bulk' if request.endpoint in BULK_ENDPOINTS else 'interactive', request_tenant()))
+
+# Pool de chaves e modelos: cada chamada vai para a chave com mais cota livre na
+# janela de um minuto (GEMINI_KEY_RPM / GEMINI_KEY_TPM), entre as saudáveis, e para
+# o menor modelo de GEMINI_MODEL_TIERS que comporta o tamanho estimado da entrada.
+CHARS_PER_TOKEN = 4  # Estimativa usual de caracteres por token
+
+def estimate_tokens(contents):
+    """Estimativa de tokens de uma lista de textos"""
+    return sum(len(part) for part in contents if isinstance(part, str)) // CHARS_PER_TOKEN
+
+def parse_model_tiers(value):
+    """Converter "modelo-a:20000,modelo-b" em [(modelo, máximo de tokens de entrada ou None)]"""
+    tiers = []
+    for item in value.split(','):
+        model, _, limit = item.strip().partition(':')
+        if model:
+            tiers.append((model, int(limit) if limit.strip() else None))
+    return tiers or [(GEMINI_MODEL, None)]
+
+def select_model(input_tokens):
+    """Primeiro modelo cuja faixa comporta a entrada (o último recebe o que sobrar)"""
+    tiers = parse_model_tiers(app.config['GEMINI_MODEL_TIERS'])
+    for model, limit in tiers:
+        if limit is None or input_tokens <= limit:
+            return model
+    return tiers[-1][0]
+
+class GeminiKey:
+    """Uma chave do pool: uso na janela de um minuto, saúde e totais acumulados"""
+
+    def __init__(self, index, api_key):
+        self.label = f"chave-{index + 1}"
+        self.api_key = api_key
+        self.primary = index == 0  # configurada no SDK (genai.configure), que cria os caches de contexto
+        self.window = deque()      # [instante, tokens] das chamadas do último minuto
+        self.in_flight = 0
+        self.failures = 0          # falhas seguidas
+        self.unhealthy_until = 0.0
+        self.last_error = None
+        self.calls = 0
+        self.errors = 0
+        self.tokens = 0
+        self._client = None
+
+    def client(self):
+        """Cliente REST/gRPC (GenerativeServiceClient) próprio da chave"""
+        if self._client is None:
+            from google.ai import generativelanguage as glm
+            options = gemini_client_options(self.api_key)
+            config = {'client_options': dict(options.get('client_options', {}), api_key=self.api_key)}
+            if 'transport' in options:
+                config['transport'] = options['transport']
+            self._client = glm.GenerativeServiceClient(**config)
+        return self._client
+
+class GeminiConfigError(Exception):
+    """Pool do Gemini sem chave utilizável (GEMINI_API_KEY / GEMINI_API_KEYS)"""
+
+class GeminiKeyPool:
+    """Escolhe a chave de cada chamada e acompanha uso e saúde de cada uma"""
+
+    WINDOW = 60.0
+
+    def __init__(self, api_keys, rpm, tpm, cooldown):
+        self.keys = [GeminiKey(index, api_key) for index, api_key in enumerate(api_keys)]
+        self.rpm = max(1, rpm)
+        self.tpm = max(1, tpm)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+    def _remaining(self, key, now):
+        """Fração da cota do minuto ainda livre (requisições ou tokens, o que estiver mais perto do fim)"""
+        while key.window and key.window[0][0] < now - self.WINDOW:
+            key.window.popleft()
+        tokens = sum(usage[1] for usage in key.window)
+        return min(1 - len(key.window) / self.rpm, 1 - tokens / self.tpm)
+
+    def acquire(self, estimated_tokens, exclude=()):
+        """Reservar a chave com mais cota livre; retorna (chave, reserva) para o release"""
+        if not self.keys:
+            raise GeminiConfigError("Nenhuma chave do Gemini configurada: defina GEMINI_API_KEY ou GEMINI_API_KEYS")
+        with self._lock:
+            now = time.monotonic()
+            candidates = [key for key in self.keys if key not in exclude]
+            if not candidates:
+                raise GeminiConfigError(f"Nenhuma chave do Gemini disponível: as {len(self.keys)} chave(s) do pool foram excluídas")
+            healthy = [key for key in candidates if key.unhealthy_until <= now]
+            if not healthy:
+                # Nenhuma saudável: tentar a que volta primeiro em vez de recusar a chamada
+                increment_counter('gemini_keys.none_healthy')
+                healthy = [min(candidates, key=lambda k: k.unhealthy_until)]
+            key = max(healthy, key=lambda k: (self._remaining(k, now), -k.in_flight))
+            usage = [now, estimated_tokens]
+            key.window.append(usage)
+            key.in_flight += 1
+            return key, usage
+
+    def release(self, key, usage, tokens=None, error=None, detail=None):
+        """Registrar o fim de uma chamada.
+
+        error: None (sucesso), 'cancelled' (sem efeito na saúde), 'quota' (429),
+        'auth' (chave recusada) ou 'error' (falha transitória); detail é a mensagem do erro.
+        """
+        with self._lock:
+            key.in_flight -= 1
+            if tokens is not None:
+                usage[1] = tokens
+            if error == 'cancelled':
+                return
+            if error is None:
+                key.calls += 1
+                key.tokens += usage[1]
+                key.failures = 0
+                return
+            key.errors += 1
+            key.failures += 1
+            key.last_error = detail
+            if error == 'quota':
+                cooldown = self.cooldown
+            elif error == 'auth':
+                cooldown = self.cooldown * 10
+            elif key.failures >= 3:
+                cooldown = min(self.cooldown * 2 ** (key.failures - 3), self.cooldown * 10)
+            else:
+                cooldown = 0
+            if cooldown:
+                key.unhealthy_until = time.monotonic() + cooldown
+                logger.warning(f"Gemini: {key.label} fora do pool por {cooldown:.0f}s ({error})")
+        increment_counter(f'gemini_keys.errors.{error}')
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            return [{
+                'key': key.label,
+                'suffix': key.api_key[-4:],
+                'healthy': key.unhealthy_until <= now,
+                'quota_remaining': round(max(0.0, self._remaining(key, now)), 4),
+                'window_requests': len(key.window),
+                'window_tokens': sum(usage[1] for usage in key.window),
+                'in_flight': key.in_flight,
+                'calls': key.calls,
+                'errors': key.errors,
+                'tokens': key.tokens,
+                'last_error': key.last_error
+            } for key in self.keys]
+
+_gemini_key_pool = None
+
+def get_gemini_key_pool():
+    """Criar (uma vez) o pool com GEMINI_API_KEY seguida das chaves de GEMINI_API_KEYS"""
+    global _gemini_key_pool
+    if _gemini_key_pool is None or not _gemini_key_pool.keys:
+        api_keys = list(dict.fromkeys(k for k in [GEMINI_API_KEY] + GEMINI_API_KEYS if k))
+        _gemini_key_pool = GeminiKeyPool(api_keys, app.config['GEMINI_KEY_RPM'], app.config['GEMINI_KEY_TPM'],
+                                         app.config['GEMINI_KEY_COOLDOWN'])
+        if len(api_keys) > 1:
+            logger.info(f"Pool do Gemini com {len(api_keys)} chaves")
+    return _gemini_key_pool
+
+def response_usage(response, input_tokens):
+    """(tokens de entrada, tokens de saída) informados pelo Gemini, ou estimados quando ausentes"""
+    try:
+        prompt_tokens = response.usage_metadata.prompt_token_count
+        output_tokens = response.usage_metadata.candidates_token_count
+    except Exception:
+        prompt_tokens = output_tokens = 0
+    if not output_tokens:
+        try:
+            output_tokens = len(response.text) // CHARS_PER_TOKEN
+        except Exception:
+            output_tokens = 0
+    return prompt_tokens or input_tokens, output_tokens
+
+def call_outcome(response, error, input_tokens, cancelled=False):
+    """(tokens, erro, detalhe) do fim de uma chamada, no formato de GeminiKeyPool.release"""
+    from google.api_core import exceptions as google_exceptions
+    if error is None:
+        prompt_tokens, output_tokens = response_usage(response, input_tokens)
+        return prompt_tokens + output_tokens, None, None
+    if cancelled or isinstance(error, DeadlineExceeded):
+        return None, 'cancelled', None
+    detail = f"{type(error).__name__}: {str(error)[:200]}"
+    if isinstance(error, google_exceptions.TooManyRequests):
+        return None, 'quota', detail
+    if isinstance(error, (google_exceptions.Forbidden, google_exceptions.Unauthorized)):
+        return None, 'auth', detail
+    return None, 'error', detail
+
+class GeminiCall:
+    """Uma chamada ao Gemini por uma chave do pool (a principal ou um hedge).
+
+    A reserva da chave é devolvida com o resultado da tentativa em streaming, e só quando
+    a thread dela termina de fato, mesmo que a requisição já a tenha abandonado.
+    """
+
+    def __init__(self, pool, model_name, contents, exclude=()):
+        self.pool = pool
+        self.model_name = model_name
+        self.contents = contents
+        self.input_tokens = estimate_tokens(contents)
+        self.key, self.usage = pool.acquire(self.input_tokens, exclude=exclude)
+        self.attempt = None  # UpstreamAttempt em curso (None na chamada direta, sem streaming)
+
+    def when_finished(self, callback):
+        """Executar callback quando a tentativa terminar (na hora, se não há tentativa em curso)"""
+        if self.attempt is None:
+            callback()
+        else:
+            self.attempt.future.add_done_callback(lambda _: callback())
+
+    def release(self, response=None, error=None):
+        def release():
+            attempt = self.attempt
+            if attempt is not None:
+                error_ = attempt.future.exception()
+                outcome = call_outcome(None if error_ else attempt.future.result(), error_,
+                                       self.input_tokens, attempt.cancelled)
+            else:
+                outcome = call_outcome(response, error, self.input_tokens)
+            self.pool.release(self.key, self.usage, *outcome)
+        self.when_finished(release)
+
+# Cache de contexto do Gemini: o prefixo fixo das chamadas (PROMPT + texto do modelo)
+# é enviado uma vez e reutilizado pelo handle até expirar.
+_context_caches = OrderedDict()  # hash do prefixo -> {'cache': CachedContent ou None, 'expires': instante}
+_context_cache_lock = threading.Lock()
+_context_cache_key_locks = {}
+
+def forget_context_cache(key):
+    """Remover a entrada e o lock de um prefixo (chamada com _context_cache_lock)"""
+    _context_caches.pop(key, None)
+    key_lock = _context_cache_key_locks.get(key)
+    if key_lock is not None and not key_lock.locked():
+        del _context_cache_key_locks[key]
+
+def get_context_cache(prefix):
+    """Retornar o cache de contexto do prefixo, criando ou renovando quando preciso.
+
+    Retorna None quando o cache não está disponível (por exemplo, conteúdo abaixo do
+    mínimo de tokens do provedor); nesse caso a indisponibilidade é lembrada por um
+    tempo, para não tentar criar o cache a cada chamada.
+    """
+    key = hashlib.sha256("\x00".join([GEMINI_CACHED_MODEL] + list(prefix)).encode('utf-8')).hexdigest()
+    with _context_cache_lock:
+        entry = _context_caches.get(key)
+        if entry and entry['expires'] > time.time():
+            _context_caches.move_to_end(key)
+            return entry['cache']
+        key_lock = _context_cache_key_locks.setdefault(key, threading.Lock())
+
+    # Uma única criação por prefixo, mesmo com chamadas concorrentes
+    with key_lock:
+        with _context_cache_lock:
+            entry = _context_caches.get(key)
+            if entry and entry['expires'] > time.time():
+                return entry['cache']
+
+        genai = get_genai()
+        ttl = app.config['CONTEXT_CACHE_TTL']
+        cache = None
+        if entry and entry['cache'] is not None:
+            # Renovar o TTL do cache existente, sem reenviar o conteúdo
+            try:
+                entry['cache'].update(ttl=datetime.timedelta(seconds=ttl))
+                cache = entry['cache']
+                increment_counter('context_cache.refreshed')
+            except Exception as e:
+                logger.info(f"Cache de contexto expirado; criando outro: {str(e)}")
+
+        if cache is None:
+            try:
+                cache = genai.caching.CachedContent.create(
+                    model=GEMINI_CACHED_MODEL,
+                    display_name=f"minhahonrajus-{key[:16]}",
+                    contents=list(prefix),
+                    ttl=datetime.timedelta(seconds=ttl)
+                )
+                increment_counter('context_cache.created')
+                logger.info(f"Cache de contexto criado: {cache.name}")
+            except Exception as e:
+                logger.warning(f"Cache de contexto indisponível; usando conteúdo inline: {str(e)}")
+                increment_counter('context_cache.unavailable')
+
+        # Renovar um pouco antes de o provedor expirar o cache
+        expires = time.time() + (ttl * 0.9 if cache is not None else min(ttl, 600))
+        with _context_cache_lock:
+            _context_caches[key] = {'cache': cache, 'expires': expires}
+            _context_caches.move_to_end(key)
+            # Descartar prefixos expirados e, acima do limite, os menos usados
+            now = time.time()
+            for stale in [k for k, e in _context_caches.items() if e['expires'] <= now]:
+                forget_context_cache(stale)
+            while len(_context_caches) > app.config['CONTEXT_CACHE_SIZE']:
+                forget_context_cache(next(iter(_context_caches)))
+        return cache
+
+def invalidate_context_cache(cache):
+    """Esquecer um cache de contexto que o provedor não reconhece mais"""
+    with _context_cache_lock:
+        for key in [k for k, e in _context_caches.items() if e['cache'] is not None and e['cache'].name == cache.name]:
+            forget_context_cache(key)
+
+class GeminiResponse:
+    """Resposta do Gemini montada a partir das partes recebidas: texto e uso de tokens"""
+
+    def __init__(self, chunks):
+        self.text = ''.join(part.text for chunk in chunks for candidate in chunk.candidates[:1]
+                            for part in candidate.content.parts)
+        self.usage_metadata = chunks[-1].usage_metadata if chunks else None
+
+def gemini_request(model_name, contents, cached_content=None):
+    """GenerateContentRequest com os textos como partes de uma única mensagem do usuário"""
+    from google.ai import generativelanguage as glm
+    request = glm.GenerateContentRequest(
+        model=model_name if model_name.startswith('models/') else f"models/{model_name}",
+        contents=[glm.Content(role='user', parts=[glm.Part(text=text) for text in contents])]
+    )
+    if cached_content is not None:
+        request.cached_content = cached_content.name
+    return request
+
+def response_text(response):
+    if response and hasattr(response, 'text') and response.text:
+        logger.info(f"Resposta recebida do Gemini: {len(response.text)} caracteres")
+        return response.text
+    return None
+
+def call_gemini(contents, cached_prefix=0, kind='default'):
+    """Enviar o conteúdo ao Gemini e retornar o texto da resposta (None se vazia)
+
+    cached_prefix: quantos itens iniciais de contents são fixos entre requisições
+    (PROMPT, texto do modelo) e podem ser enviados pelo cache de contexto.
+    kind: tipo da chamada (ex.: 'secao'); as latências de cada tipo definem o limiar do hedging.
+    A chamada aguarda uma vaga no agendador, conforme a classe da requisição atual.
+    """
+    priority, tenant = _llm_request.get()
+    deadline = _request_deadline.get()
+    if deadline is not None and (deadline.reason or deadline.remaining() == 0):
+        increment_counter('cancelled.llm_calls.not_started')
+        deadline.check('chamada ao Gemini')
+    scheduler = get_llm_scheduler()
+    waited = scheduler.acquire(priority, tenant, deadline)
+    if waited > 1:
+        logger.info(f"Chamada ao Gemini ({priority}) aguardou {waited:.1f}s na fila")
+    calls = []
+    try:
+        return _call_gemini(contents, cached_prefix, kind, calls)
+    finally:
+        # A vaga só volta ao agendador quando a chamada ao provedor de fato termina: uma
+        # tentativa abandonada (prazo, hedge vencedor) ainda ocupa a conexão até ser fechada
+        release = lambda: scheduler.release(priority)
+        if calls:
+            calls[-1].when_finished(release)
+        else:
+            release()
+
+def _call_gemini(contents, cached_prefix, kind, calls):
+    from google.api_core import exceptions as google_exceptions
+    pool = get_gemini_key_pool()
+    model_name = select_model(estimate_tokens(contents))
+    increment_counter(f'gemini_models.{model_name}')
+    tried = []
+    while True:
+        call = GeminiCall(pool, model_name, contents, exclude=tried)
+        calls.append(call)
+        start = time.perf_counter()
+        try:
+            response = _generate_with_key(call, cached_prefix, kind)
+        except Exception as e:
+            call.release(error=e)
+            # Cota esgotada (429) ou chave recusada: a mesma chamada pode seguir por outra chave
+            if not isinstance(e, (google_exceptions.TooManyRequests, google_exceptions.Forbidden,
+                                  google_exceptions.Unauthorized)):
+                raise
+            tried.append(call.key)
+            if len(tried) >= len(pool.keys):
+                raise
+            logger.warning(f"Gemini recusou a {call.key.label} ({type(e).__name__}); tentando outra chave")
+            increment_counter('gemini_keys.failover')
+            continue
+        call.release(response=response)
+        prompt_tokens, output_tokens = response_usage(response, call.input_tokens)
+        record_llm_usage(kind, prompt_tokens, output_tokens, time.perf_counter() - start)
+        return response_text(response)
+
+def _generate_with_key(call, cached_prefix, kind):
+    key, model_name, contents = call.key, call.model_name, call.contents
+    # Caches de contexto pertencem ao projeto da chave que os criou (a principal) e ao modelo padrão
+    if cached_prefix and app.config['CONTEXT_CACHE_ENABLED'] and key.primary and model_name == GEMINI_MODEL:
+        cache = get_context_cache(contents[:cached_prefix])
+        if cache is not None:
+            from google.api_core import exceptions as google_exceptions
+            try:
+                request = gemini_request(cache.model, contents[cached_prefix:], cached_content=cache)
+                logger.info(f"Enviando conteúdo ao Gemini com cache de contexto {cache.name}...")
+                response = generate_content(key.client(), request, kind, call)
+                increment_counter('context_cache.hits')
+                return response
+            except (google_exceptions.NotFound, google_exceptions.Forbidden) as e:
+                # Cache removido ou expirado no provedor: seguir com o conteúdo inline
+                logger.warning(f"Cache de contexto {cache.name} não encontrado; reenviando inline: {str(e)}")
+                invalidate_context_cache(cache)
+
+    logger.info(f"Modelo Gemini {model_name} ({key.label}) inicializado. Enviando conteúdo para processamento...")
+    return generate_content(key.client(), gemini_request(model_name, contents), kind, call)
+
+_upstream_executor = None
+
+class UpstreamAttempt:
+    """Uma chamada em streaming ao Gemini numa thread auxiliar, cancelável de outra thread"""
+
+    def __init__(self):
+        self.cancelled = False
+        self.future = None
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def attach(self, handle):
+        """Associar o fluxo devolvido pelo cliente; se a tentativa já foi cancelada, fechá-lo na hora"""
+        with self._lock:
+            if not self.cancelled:
+                self._handle = handle
+                return
+        self._close(handle)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            handle, self._handle = self._handle, None
+        if handle is not None:
+            self._close(handle)
+
+    @staticmethod
+    def _close(handle):
+        """Fechar o fluxo numa thread à parte: no gRPC o cancel() é imediato, mas no REST ele
+        espera a leitura em curso (a primeira parte, ou o timeout igual ao prazo restante),
+        e quem cancela (monitor de prazos, hedge vencedor) não deve esperar por isso"""
+        threading.Thread(target=cancel_upstream, args=(handle,), name='gemini-cancel', daemon=True).start()
+
+def start_attempt(client, request, deadline):
+    """Iniciar uma chamada em streaming; o fluxo é fechado se a tentativa ou a requisição for cancelada"""
+    global _upstream_executor
+    attempt = UpstreamAttempt()
+    if deadline is not None:
+        deadline.register(attempt)
+
+    def stream():
+        try:
+            options = {'timeout': max(deadline.remaining(), 1.0)} if deadline is not None else {}
+            # O cliente devolve o fluxo (com cancel()) assim que chegam os cabeçalhos; associado à
+            # tentativa, o cancelamento alcança a chamada ainda durante o processamento da entrada
+            stream = client.stream_generate_content(request, **options)
+            attempt.attach(stream)
+            return GeminiResponse(list(stream))
+        except Exception:
+            # Fluxo fechado pelo cancelamento ou pelo timeout igual ao prazo restante
+            if deadline is not None and (deadline.reason or deadline.remaining() == 0):
+                attempt.cancelled = True
+                increment_counter('cancelled.llm_calls.in_flight')
+            raise
+        finally:
+            if deadline is not None:
+                deadline.unregister(attempt)
+
+    if _upstream_executor is None:
+        _upstream_executor = ThreadPoolExecutor(max_workers=get_llm_scheduler().max_concurrency * 3,
+                                                thread_name_prefix='gemini')
+    attempt.future = _upstream_executor.submit(stream)
+    return attempt
+
+# Hedging: se a chamada passa do percentil HEDGE_PERCENTILE das latências recentes do
+# mesmo tipo, uma segunda chamada idêntica é feita e vale a que terminar primeiro; a
+# outra é cancelada. Cada chamada acumula HEDGE_MAX_RATE de crédito, e cada hedge
+# consome 1, o que limita a fração de chamadas extras.
+HEDGE_BURST = 5.0
+_hedge_lock = threading.Lock()
+_hedge_credit = HEDGE_BURST
+
+def hedge_threshold(kind):
+    """Segundos até o hedge de uma chamada do tipo informado (None enquanto há poucas amostras)"""
+    if not app.config['HEDGE_ENABLED']:
+        return None
+    with _metrics_lock:
+        samples = len(_latency_samples.get(f'llm.call.{kind}', ()))
+    if samples < app.config['HEDGE_MIN_SAMPLES']:
+        return None
+    return latency_percentile(f'llm.call.{kind}', app.config['HEDGE_PERCENTILE'])
+
+def take_hedge_credit():
+    global _hedge_credit
+    with _hedge_lock:
+        if _hedge_credit >= 1:
+            _hedge_credit -= 1
+            return True
+        return False
+
+def add_hedge_credit():
+    global _hedge_credit
+    with _hedge_lock:
+        _hedge_credit = min(HEDGE_BURST, _hedge_credit + app.config['HEDGE_MAX_RATE'])
+
+def generate_content(client, request, kind='default', call=None):
+    """Enviar request pelo client respeitando o prazo da requisição atual e, se ativo, com hedging.
+
+    Com prazo ou hedging, a chamada roda em streaming numa thread auxiliar: a requisição
+    deixa de esperar assim que é cancelada, e o fluxo é fechado (interrompendo a
+    geração no provedor) pelo cancel() do próprio fluxo: no gRPC na hora, mesmo antes da
+    primeira parte; no REST quando a leitura em curso termina (primeira parte ou prazo).
+    call (GeminiCall) recebe a tentativa principal; o hedge vai por outra chave do pool,
+    com o conteúdo completo de call (sem o cache de contexto, que é da chave principal).
+    """
+    deadline = _request_deadline.get()
+    threshold = hedge_threshold(kind) if call is not None else None
+    if app.config['HEDGE_ENABLED']:
+        add_hedge_credit()
+        increment_counter('hedge.calls')
+    start = time.perf_counter()
+    if deadline is None and threshold is None:
+        try:
+            response = GeminiResponse([client.generate_content(request)])
+        finally:
+            record_latency(f'llm.call.{kind}', time.perf_counter() - start)
+        record_latency(f'llm.served.{kind}', time.perf_counter() - start)
+        return response
+
+    priority = _llm_request.get()[0]
+    attempts = [start_attempt(client, request, deadline)]
+    # llm.call.<tipo> (base do limiar do hedge) só recebe a duração de tentativas principais
+    # que terminaram; uma principal cancelada porque o hedge venceu entra com o limiar, pois
+    # sua duração real é desconhecida e o tempo até o cancelamento é o do vencedor.
+    # llm.served.<tipo> é a latência entregue ao chamador, vença quem vencer.
+    attempts[0].future.add_done_callback(
+        lambda _: None if attempts[0].cancelled else record_latency(f'llm.call.{kind}', time.perf_counter() - start))
+    hedged_at = None
+    if call is not None:
+        call.attempt = attempts[0]
+    poll = app.config['DEADLINE_POLL_INTERVAL']
+    while True:
+        elapsed = time.perf_counter() - start
+        timeout = poll
+        if threshold is not None and len(attempts) == 1:
+            timeout = min(poll, max(0.0, threshold - elapsed))
+        wait([attempt.future for attempt in attempts], timeout=timeout, return_when=FIRST_COMPLETED)
+
+        winner = next((a for a in attempts if a.future.done() and a.future.exception() is None), None)
+        if winner is not None:
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+            if len(attempts) > 1:
+                increment_counter('hedge.won' if winner is attempts[1] else 'hedge.lost')
+                if winner is attempts[1]:
+                    record_latency(f'llm.call.{kind}', hedged_at)
+            record_latency(f'llm.served.{kind}', time.perf_counter() - start)
+            return winner.future.result()
+
+        if all(attempt.future.done() for attempt in attempts):
+            if deadline is not None and deadline.reason:
+                raise DeadlineExceeded(deadline.reason, 'chamada ao Gemini')
+            return attempts[0].future.result()  # lança o erro da chamada primária
+
+        if deadline is not None:
+            deadline.check('chamada ao Gemini')
+
+        if threshold is not None and len(attempts) == 1 and time.perf_counter() - start >= threshold:
+            if not take_hedge_credit():
+                increment_counter('hedge.budget_denied')
+                threshold = None
+            elif not get_llm_scheduler().try_acquire(priority):
+                increment_counter('hedge.no_capacity')
+                threshold = None
+            else:
+                logger.info(f"Chamada ao Gemini ({kind}) passou de {threshold:.1f}s; enviando hedge")
+                increment_counter('hedge.issued')
+                hedged_at = threshold
+                attempts.append(start_hedge(call, priority, deadline))
+
+def start_hedge(call, priority, deadline):
+    """Enviar o hedge de call por outra chave do pool (a mesma, se só houver uma).
+
+    A reserva da chave conta na cota do minuto como qualquer chamada; ela e a vaga já
+    ocupada no agendador são devolvidas quando a thread do hedge termina.
+    """
+    pool = call.pool
+    hedge = GeminiCall(pool, call.model_name, call.contents, exclude=(call.key,) if len(pool.keys) > 1 else ())
+    try:
+        hedge.attempt = start_attempt(hedge.key.client(), gemini_request(call.model_name, call.contents), deadline)
+    except Exception as e:
+        hedge.release(error=e)
+        get_llm_scheduler().release(priority)
+        raise
+    hedge.release()
+    hedge.when_finished(lambda: get_llm_scheduler().release(priority))
+    return hedge.attempt
+
+def process_pdfs_with_gemini(peticao_pdf_path, modelo_pdf_path, mode=None, peticao_pages=None, texts=None):
+    """Gerar o resultado a partir dos PDFs; texts (petição, modelo) evita extrair de novo textos já extraídos"""
+    mode = mode or app.config['GENERATION_MODE']
+    try:
+        # Extract text from PDFs using PyMuPDF
+        if texts:
+            peticao_text, modelo_text = texts
+        else:
+            peticao_text = extract_text_from_pdf(peticao_pdf_path, peticao_pages)
+            modelo_text = extract_text_from_pdf(modelo_pdf_path)
+        
+        # Verificar se o texto foi extraído corretamente
+        if not peticao_text or peticao_text.startswith("Error"):
+            logger.error(f"Erro na extração do texto da petição: {peticao_text}")
+            return f"Erro ao extrair texto da petição inicial: {peticao_text}"
+            
+        if not modelo_text or modelo_text.startswith("Error"):
+            logger.error(f"Erro na extração do texto do modelo: {modelo_text}")
+            return f"Erro ao extrair texto do modelo de contestação: {modelo_text}"
+        
+        # Identificadores com formato rígido são extraídos localmente e enviados como fatos conhecidos
+        facts = extract_known_facts(peticao_text)
+        known_facts = format_known_facts(facts)
+        
+        if mode == 'parallel':
+            return generate_contestacao_parallel(peticao_text, modelo_text, facts)
+        
+        start = time.perf_counter()
+        
+        # Prepare content for Gemini (PROMPT e modelo primeiro: prefixo fixo, elegível ao cache de contexto)
+        contents = [
+            PROMPT,
+            f"### MODELO DE CONTESTAÇÃO:\n{modelo_text}",
+            f"### PETIÇÃO INICIAL:\n{peticao_text}"
+        ]
+        if known_facts:
+            contents.append(known_facts)
+        
+        # Generate response
+        generated_text = call_gemini(contents, cached_prefix=2, kind='completa')
+        
+        # Verificar resposta
+        if generated_text:
+            record_latency('generation.single', time.perf_counter() - start)
+            json_data, contestacao = extract_json_and_contestacao(generated_text)
+            if 'error' in json_data:
+                return generated_text
+            return build_result_text(apply_known_facts(json_data, facts), contestacao)
+        else:
+            logger.error("Resposta vazia ou inválida do Gemini")
+            return "Erro: Resposta vazia ou inválida do Gemini. Verifique se sua API key está correta e tente novamente."
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao processar PDFs com Gemini: {str(e)}")
+        return f"Erro ao processar PDFs: {str(e)}"
+
+def save_upload(file_storage, path):
+    """Gravar o upload no caminho final; uploads já em disco são apenas movidos"""
+    stream = file_storage.stream
+    if isinstance(stream, HashingUploadFile):
+        stream.flush()
+        os.replace(stream.name, path)
+    else:
+        file_storage.save(path)
+
+@contextlib.contextmanager
+def saved_uploads(peticao_file, modelo_file):
+    """Gravar os uploads com nomes únicos e removê-los ao sair do bloco; fornece (petição, modelo)"""
+    # Save files with unique filenames to avoid conflicts
+    secure_peticao_filename = secure_filename(f"{uuid.uuid4()}_{peticao_file.filename}")
+    secure_modelo_filename = secure_filename(f"{uuid.uuid4()}_{modelo_file.filename}")
+
+    logger.info(f"Salvando arquivos: {secure_peticao_filename} e {secure_modelo_filename}")
+    peticao_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_peticao_filename)
+    modelo_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_modelo_filename)
+
+    try:
+        save_upload(peticao_file, peticao_path)
+        save_upload(modelo_file, modelo_path)
+        yield peticao_path, modelo_path
+    finally:
+        # Clean up uploaded files
+        logger.info("Removendo arquivos temporários")
+        for path in (peticao_path, modelo_path):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                logger.warning(f"Erro ao remover arquivo temporário {path}: {str(e)}")
+
+def process_uploaded_pdfs(peticao_file, modelo_file, mode=None, peticao_pages=None, policy=None):
+    """Salvar os uploads, passar pela admissão, processar com o Gemini e guardar o resultado.
+
+    Retorna (result, result_id); result_id é None quando o processamento falha.
+    Lança AdmissionRejected ou JobQueued conforme a decisão da admissão.
+    """
+    digests = (upload_digest(peticao_file), upload_digest(modelo_file))
+    with saved_uploads(peticao_file, modelo_file) as (peticao_path, modelo_path):
+        # Verificar se os arquivos foram salvos corretamente
+        if not os.path.exists(peticao_path):
+            logger.error(f"Falha ao salvar o arquivo da petição: {peticao_path}")
+            return "Erro: Falha ao salvar o arquivo da petição. Tente novamente.", None
+
+        if not os.path.exists(modelo_path):
+            logger.error(f"Falha ao salvar o arquivo do modelo: {modelo_path}")
+            return "Erro: Falha ao salvar o arquivo do modelo. Tente novamente.", None
+
+        # Pré-processamento: texto extraído (ou do cache) e admissão antes de ocupar o agendador
+        texts = (extract_text_cached(peticao_path, digests[0], peticao_pages),
+                 extract_text_cached(modelo_path, digests[1]))
+        mode = admit_job(texts, mode, policy)
+
+        # Process with Gemini
+        logger.info("Processando PDFs com Gemini")
+        result = process_pdfs_with_gemini(peticao_path, modelo_path, mode, peticao_pages, texts)
+
+    # Verificar resultado
+    if not result or result.startswith("Erro"):
+        logger.error(f"Erro no processamento: {result}")
+        return result or "Erro: Resposta vazia do processamento", None
+
+    # Salvar resultado em arquivo em vez de usar sessão
+    result_id = save_result_to_file(result)
+    if not result_id:
+        logger.error("Falha ao salvar resultado em arquivo")
+        return "Erro: Falha ao salvar resultado em arquivo", None
+
+    return result, result_id
+
+# Admissão: antes de ocupar o agendador, cada trabalho tem tokens e duração estimados
+# a partir do texto extraído e das taxas observadas nas chamadas recentes. O que não
+# cabe no contexto do modelo é recusado; o que não termina no prazo é recusado, passa
+# para a geração por seções (modo parallel: entradas e saídas menores por chamada, com
+# as seções em paralelo) ou vai para a fila em segundo plano, conforme ADMISSION_POLICY.
+ADMISSION_POLICIES = ('reject', 'chunked', 'queue')
+DEFAULT_OUTPUT_TOKENS = {'completa': 3000, 'extracao': 600, 'secao': 800}  # Até haver chamadas observadas
+
+class AdmissionRejected(Exception):
+    """Trabalho recusado na admissão"""
+
+    def __init__(self, decision, estimate):
+        super().__init__(decision['motivo'])
+        self.decision = decision
+        self.estimate = estimate
+
+class JobQueued(Exception):
+    """Trabalho aceito para processamento em segundo plano (política 'queue')"""
+
+    def __init__(self, job_id, decision, estimate):
+        super().__init__(f"Trabalho {job_id} na fila")
+        self.job_id = job_id
+        self.decision = decision
+        self.estimate = estimate
+
+def expected_output_tokens(kind):
+    """Mediana dos tokens gerados nas chamadas recentes do tipo"""
+    samples = sorted(output for _, output, _ in observed_llm_usage(kind))
+    return _percentile(samples, 50) if samples else DEFAULT_OUTPUT_TOKENS[kind]
+
+def output_tokens_per_second():
+    """Velocidade de geração observada (mediana), descontada a leitura estimada da entrada"""
+    input_rate = app.config['ESTIMATE_INPUT_TOKENS_PER_S']
+    rates = sorted(output / max(seconds - tokens / input_rate, seconds * 0.1)
+                   for tokens, output, seconds in observed_llm_usage() if output and seconds > 0)
+    return _percentile(rates, 50) if rates else app.config['ESTIMATE_OUTPUT_TOKENS_PER_S']
+
+def estimate_call_seconds(input_tokens, output_tokens, output_rate):
+    return input_tokens / app.config['ESTIMATE_INPUT_TOKENS_PER_S'] + output_tokens / output_rate
+
+def estimate_queue_wait(priority, call_seconds):
+    """Espera estimada por uma vaga no agendador, pelas chamadas em curso e na fila agora"""
+    snapshot = get_llm_scheduler().snapshot()
+    ahead = sum(snapshot['running'].values()) + snapshot['queued']['interactive']
+    capacity = snapshot['max_concurrency']
+    if priority == 'bulk':
+        ahead += snapshot['queued']['bulk']
+        capacity = snapshot['bulk_limit']
+    if ahead < capacity:
+        return 0.0
+    return (ahead - capacity + 1) / capacity * call_seconds
+
+def estimate_job(peticao_text, modelo_text, priority):
+    """Tokens e duração esperados da geração única e da geração por seções"""
+    output_rate = output_tokens_per_second()
+    sections = len(PARALLEL_SECTIONS)
+    single_in = estimate_tokens([PROMPT, modelo_text, peticao_text])
+    single_out = expected_output_tokens('completa')
+    extraction_in = estimate_tokens([EXTRACTION_PROMPT, peticao_text])
+    extraction_out = expected_output_tokens('extracao')
+    section_in = estimate_tokens([modelo_text, SECTION_GENERATION_PROMPT]) + extraction_out
+    section_out = expected_output_tokens('secao')
+    modes = {
+        'single': {
+            'chamadas': 1,
+            'tokens_entrada': single_in,
+            'tokens_saida': single_out,
+            'maior_entrada': single_in,
+            'segundos': round(estimate_call_seconds(single_in, single_out, output_rate), 1)
+        },
+        'parallel': {
+            'chamadas': 1 + sections,
+            'tokens_entrada': extraction_in + section_in * sections,
+            'tokens_saida': extraction_out + section_out * sections,
+            'maior_entrada': max(extraction_in, section_in),
+            # Extração seguida das seções, que rodam ao mesmo tempo
+            'segundos': round(estimate_call_seconds(extraction_in, extraction_out, output_rate)
+                              + estimate_call_seconds(section_in, section_out, output_rate), 1)
+        }
+    }
+    return {
+        'modos': modes,
+        'espera_fila_s': round(estimate_queue_wait(priority, modes['single']['segundos']), 1),
+        'tokens_por_s': round(output_rate, 1)
+    }
+
+def admission_decision(estimate, mode, policy, budget):
+    """Decidir o destino do trabalho: aceitar, reduzir (modo parallel), fila ou recusar"""
+    limit = app.config['ADMISSION_MAX_INPUT_TOKENS']
+    modes = estimate['modos']
+    candidates = [mode]
+    if policy in ('chunked', 'queue') and mode != 'parallel':
+        candidates.append('parallel')
+
+    fitting = [m for m in candidates if modes[m]['maior_entrada'] <= limit]
+    if not fitting:
+        return {'acao': 'recusar', 'modo': mode, 'status': 413,
+                'motivo': f"A entrada estimada ({modes[candidates[-1]]['maior_entrada']} tokens) excede o limite de "
+                          f"{limit} tokens por chamada. Informe o intervalo de páginas da petição."}
+
+    wait_s = estimate['espera_fila_s']
+    for m in fitting:
+        if wait_s + modes[m]['segundos'] <= budget:
+            return {'acao': 'aceitar' if m == mode else 'reduzir', 'modo': m,
+                    'motivo': 'Estimativa dentro do prazo' if m == mode else
+                              'Geração única excede o prazo; usando a geração por seções'}
+
+    best = min(fitting, key=lambda m: modes[m]['segundos'])
+    total = wait_s + modes[best]['segundos']
+    if policy == 'queue':
+        return {'acao': 'fila', 'modo': best,
+                'motivo': f"Duração estimada de {total:.0f}s excede o prazo de {budget:.0f}s; processando em segundo plano"}
+    decision = {'acao': 'recusar', 'modo': best, 'status': 413,
+                'motivo': f"Duração estimada de {total:.0f}s excede o prazo de {budget:.0f}s"}
+    if modes[best]['segundos'] <= budget:
+        # Cabe no prazo quando a fila esvaziar: vale tentar de novo mais tarde
+        decision.update(status=503, retry_after=max(1, int(wait_s)))
+    return decision
+
+def admission_policy(value=None):
+    """Política informada na requisição (campo admissao) ou ADMISSION_POLICY"""
+    policy = value or app.config['ADMISSION_POLICY']
+    if policy not in ADMISSION_POLICIES:
+        raise ValueError(f"Política de admissão inválida: {policy} (use {', '.join(ADMISSION_POLICIES)})")
+    return policy
+
+def generation_mode(value=None):
+    """Modo de geração pedido (campo modo) ou GENERATION_MODE: 'single' ou 'parallel'"""
+    return 'parallel' if (value or app.config['GENERATION_MODE']) == 'parallel' else 'single'
+
+def admit_job(texts, mode, policy):
+    """Aplicar a admissão ao par de textos extraídos e retornar o modo de geração a usar"""
+    peticao_text, modelo_text = texts
+    if any(not text or text.startswith("Error") for text in texts):
+        return mode  # o erro de extração é informado pelo processamento
+    mode = generation_mode(mode)
+    priority, tenant = _llm_request.get()
+    deadline = _request_deadline.get()
+    budget = deadline.remaining() if deadline is not None else app.config['REQUEST_DEADLINE']
+    estimate = estimate_job(peticao_text, modelo_text, priority)
+    decision = admission_decision(estimate, mode, policy or app.config['ADMISSION_POLICY'], budget)
+    increment_counter(f"admission.{decision['acao']}")
+    logger.info(f"Admissão: {decision['acao']} (modo {decision['modo']}): {decision['motivo']}")
+
+    if decision['acao'] == 'fila':
+        job_id = enqueue_job(texts, decision['modo'], tenant)
+        if job_id is None:
+            decision = dict(decision, acao='recusar', status=503, retry_after=60,
+                            motivo='Fila de processamento em segundo plano cheia')
+        else:
+            raise JobQueued(job_id, decision, estimate)
+    if decision['acao'] == 'recusar':
+        raise AdmissionRejected(decision, estimate)
+    return decision['modo']
+
+# Fila em segundo plano da política 'queue': poucos workers, classe bulk do agendador
+# e prazo próprio (ADMISSION_QUEUE_DEADLINE); o estado fica em /api/jobs/<job_id>.
+_jobs = OrderedDict()  # job_id -> {'status', 'modo', 'result_id', 'error', 'updated'}
+_jobs_lock = threading.Lock()
+_job_executor = None
+JOB_RETENTION = 3600  # Segundos que um trabalho concluído continua consultável
+
+def enqueue_job(texts, mode, tenant):
+    """Colocar o trabalho na fila; retorna o job_id, ou None se a fila estiver cheia"""
+    global _job_executor
+    now = time.time()
+    with _jobs_lock:
+        for job_id in [j for j, job in _jobs.items()
+                       if job['status'] in ('done', 'error') and now - job['updated'] > JOB_RETENTION]:
+            del _jobs[job_id]
+        if sum(1 for job in _jobs.values() if job['status'] in ('queued', 'running')) >= app.config['ADMISSION_QUEUE_SIZE']:
+            return None
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {'status': 'queued', 'modo': mode, 'result_id': None, 'error': None, 'updated': now}
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=app.config['ADMISSION_QUEUE_WORKERS'], thread_name_prefix='job')
+    # Contexto vazio: o trabalho não herda prazo nem classe da requisição que o criou
+    _job_executor.submit(contextvars.Context().run, run_job, job_id, texts, mode, tenant)
+    return job_id
+
+def update_job(job_id, **fields):
+    with _jobs_lock:
+        _jobs[job_id].update(fields, updated=time.time())
+
+def run_job(job_id, texts, mode, tenant):
+    _llm_request.set(('bulk', tenant))
+    _request_deadline.set(RequestDeadline(app.config['ADMISSION_QUEUE_DEADLINE']))
+    update_job(job_id, status='running')
     try:
-        # Extract text from PDFs using PyMuPDF
-        peticao_text = extract_text_from_pdf(peticao_pdf_path)
-        modelo_text = extract_text_from_pdf(modelo_pdf_path)
-        
-        # Verificar se o texto foi extraído corretamente
-        if not peticao_text or peticao_text.startswith("Error"):
-            logger.error(f"Erro na extração do texto da petição: {peticao_text}")
-            return f"Erro ao extrair texto da petição inicial: {peticao_text}"
-            
-        if not modelo_text or modelo_text.startswith("Error"):
-            logger.error(f"Erro na extração do texto do modelo: {modelo_text}")
-            return f"Erro ao extrair texto do modelo de contestação: {modelo_text}"
-        
-        # Initialize Gemini model
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        logger.info("Modelo Gemini inicializado. Enviando conteúdo para processamento...")
-        
-        # Prepare content for Gemini
-        contents = [
-            PROMPT,
-            f"### PETIÇÃO INICIAL:\n{peticao_text}",
-            f"### MODELO DE CONTESTAÇÃO:\n{modelo_text}"
-        ]
-        
-        # Generate response
-        response = model.generate_content(contents)
-        
-        # Verificar resposta
-        if response and hasattr(response, 'text') and response.text:
-            logger.info(f"Resposta recebida do Gemini: {len(response.text)} caracteres")
-            return response.text
+        result = process_pdfs_with_gemini(None, None, mode, texts=texts)
+        if not result or result.startswith("Erro"):
+            update_job(job_id, status='error', error=result or "Erro: Resposta vazia do processamento")
+            return
+        result_id = save_result_to_file(result)
+        if result_id:
+            update_job(job_id, status='done', result_id=result_id)
         else:
-            logger.error("Resposta vazia ou inválida do Gemini")
-            return "Erro: Resposta vazia ou inválida do Gemini. Verifique se sua API key está correta e tente novamente."
+            update_job(job_id, status='error', error="Erro: Falha ao salvar resultado em arquivo")
     except Exception as e:
-        logger.error(f"Erro ao processar PDFs com Gemini: {str(e)}")
-        return f"Erro ao processar PDFs: {str(e)}"
+        logger.exception(f"Erro no trabalho {job_id}: {str(e)}")
+        update_job(job_id, status='error', error=f"Erro ao processar: {str(e)}")
+
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+def ensure_section_heading(text, title):
+    """Garantir que o texto gerado para uma seção comece pela linha de título.
+
+    Uma primeira linha que já é o título com numeração ou pontuação ("II - DO MÉRITO:")
+    é trocada pelo título canônico, em vez de receber um segundo título antes dela.
+    """
+    first_line, _, rest = text.strip().partition('\n')
+    heading = HEADING_PREFIX_RE.sub('', first_line).strip(' \t*#:.-–—').upper()
+    if heading == title:
+        return f"{title}\n{rest}" if rest else title
+    return f"{title}\n\n{text.strip()}"
+
+def build_result_text(json_data, contestacao):
+    """Montar o texto do resultado no formato da resposta do Gemini (bloco JSON + contestação)"""
+    return f"```json\n{json.dumps(json_data, indent=2, ensure_ascii=False)}\n```\n\n{contestacao}"
+
+def generate_contestacao_parallel(peticao_text, modelo_text, facts=None):
+    """Gerar a contestação por seções em paralelo.
+
+    A extração do JSON (ETAPA 1) roda primeiro; em seguida cada parte de
+    PARALLEL_SECTIONS é gerada em uma chamada própria com o mesmo contexto, e o
+    resultado é montado no formato da geração única (bloco JSON + contestação).
+    """
+    start = time.perf_counter()
+
+    facts = facts or extract_known_facts(peticao_text)
+    known_facts = format_known_facts(facts)
+    extraction_contents = [EXTRACTION_PROMPT, f"### PETIÇÃO INICIAL:\n{peticao_text}"]
+    if known_facts:
+        extraction_contents.append(known_facts)
+
+    extraction = call_gemini(extraction_contents, kind='extracao')
+    if not extraction:
+        logger.error("Resposta vazia do Gemini na extração do JSON")
+        return "Erro: Resposta vazia ou inválida do Gemini na extração dos dados da petição."
+
+    json_data, _ = extract_json_and_contestacao(extraction)
+    if 'error' in json_data:
+        logger.error(f"JSON inválido na extração: {json_data['error']}")
+        return f"Erro ao extrair dados da petição: {json_data['error']}"
+    json_data = apply_known_facts(json_data, facts)
+    json_text = json.dumps(json_data, indent=2, ensure_ascii=False)
+    extraction_time = time.perf_counter() - start
+
+    def generate_part(section):
+        title, instrucoes, has_heading = section
+        # O modelo vem primeiro: prefixo comum a todas as seções, elegível ao cache de contexto
+        contents = [
+            f"### MODELO DE CONTESTAÇÃO:\n{modelo_text}",
+            SECTION_GENERATION_PROMPT.format(
+                titulo=title,
+                instrucoes=instrucoes,
+                inicio=f'começando pela linha de título "{title}"' if has_heading else "sem linha de título"
+            ),
+            f"### DADOS EXTRAÍDOS DA PETIÇÃO INICIAL (JSON):\n{json_text}"
+        ]
+        text = call_gemini(contents, cached_prefix=1, kind='secao')
+        if not text:
+            return None
+        return ensure_section_heading(text, title) if has_heading else text.strip()
+
+    # Cada seção roda com uma cópia do contexto, para herdar a classe de prioridade da requisição
+    with ThreadPoolExecutor(max_workers=len(PARALLEL_SECTIONS)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, generate_part, section)
+                   for section in PARALLEL_SECTIONS]
+        parts = [future.result() for future in futures]
+
+    for (title, _, _), part in zip(PARALLEL_SECTIONS, parts):
+        if not part:
+            logger.error(f"Resposta vazia do Gemini ao gerar a seção {title}")
+            return f"Erro: Resposta vazia ou inválida do Gemini ao gerar a seção {title}."
+
+    elapsed = time.perf_counter() - start
+    record_latency('generation.parallel', elapsed)
+    single = latency_percentile('generation.single', 50)
+    logger.info(
+        f"Geração paralela concluída em {elapsed:.1f}s (extração {extraction_time:.1f}s)"
+        + (f"; mediana da geração única: {single:.1f}s" if single is not None else "")
+    )
+    return build_result_text(json_data, "\n\n".join(parts))
 
 def extract_json_and_contestacao(response_text):
     """Extract JSON and contestação from Gemini response"""
@@ -291,11 +2367,11 @@ def extract_json_and_contestacao(response_text):
         logger.info(f"Extraindo JSON e contestação do texto ({len(response_text)} caracteres)")
         
         # Try to find JSON using regex
-        json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
+        json_match = JSON_BLOCK_RE.search(response_text)
         
         if not json_match:
             # Try alternative pattern without code block markers
-            json_match = re.search(r'({[\s\S]*?"pedidos"\s*:\s*\[[\s\S]*?\]\s*})', response_text)
+            json_match = JSON_FALLBACK_RE.search(response_text)
         
         json_data = None
         if json_match:
@@ -324,21 +2400,6 @@ def parse_contestacao_sections(text):
     try:
         logger.info(f"Dividindo contestação em seções hierárquicas ({len(text)} caracteres)")
         
-        # Padrões de seções principais
-        main_sections = [
-            r'PRELIMINARMENTE|PRELIMINAR',
-            r'DO MÉRITO|MÉRITO',
-            r'DOS PEDIDOS|DOS REQUERIMENTOS',
-            r'DOCUMENTOS ANEXOS'
-        ]
-        
-        # Padrões de subseções
-        subsections = [
-            r'(\d+)[\.\)]\s*([A-Z][^\.]+)',
-            r'([a-z]\))\s*([A-Z][^\.]+)',
-            r'(\d+)[\.\)]\s*([A-Z][^\.]+)'
-        ]
-        
         sections = []
         current_section = None
         current_subsection = None
@@ -346,27 +2407,31 @@ def parse_contestacao_sections(text):
         # Dividir o texto em linhas e remover duplicações
         lines = [line.strip() for line in text.split('\n') if line.strip()]
         unique_lines = []
+        seen_lines = set()
         for line in lines:
-            if line not in unique_lines:
+            if line not in seen_lines:
+                seen_lines.add(line)
                 unique_lines.append(line)
         
         for line in unique_lines:
             # Verificar se é uma seção principal
-            for pattern in main_sections:
-                if re.match(pattern, line, re.IGNORECASE):
-                    if current_section:
-                        sections.append(current_section)
-                    current_section = {
-                        "title": line.upper(),
-                        "content": "",
-                        "subsections": []
-                    }
-                    break
+            if any(pattern.match(line) for pattern in MAIN_SECTION_PATTERNS):
+                if current_subsection:
+                    current_section["subsections"].append(current_subsection)
+                    current_subsection = None
+                if current_section:
+                    sections.append(current_section)
+                current_section = {
+                    "title": line.upper(),
+                    "content": "",
+                    "subsections": []
+                }
+                continue
             
             # Verificar se é uma subseção
             if current_section:
-                for pattern in subsections:
-                    match = re.match(pattern, line)
+                for pattern in SUBSECTION_PATTERNS:
+                    match = pattern.match(line)
                     if match:
                         if current_subsection:
                             current_section["subsections"].append(current_subsection)
@@ -376,11 +2441,11 @@ def parse_contestacao_sections(text):
                             "content": ""
                         }
                         break
+                else:
+                    if current_subsection:
+                        current_subsection["content"] += line + "<br>"
                     else:
-                        if current_subsection:
-                            current_subsection["content"] += line + "<br>"
-                        else:
-                            current_section["content"] += line + "<br>"
+                        current_section["content"] += line + "<br>"
         
         # Adicionar última subseção e seção
         if current_subsection:
@@ -406,8 +2471,86 @@ def parse_contestacao_sections(text):
             "subsections": []
         }]
 
+def find_section_spans(text):
+    """Localizar as seções principais no texto bruto, com as posições de início e fim.
+
+    Usa os mesmos padrões e títulos de parse_contestacao_sections(), para que uma
+    seção escolhida na página de resultado possa ser substituída no texto guardado.
+    A última seção termina no fechamento (PETICAO_END_RE), para que "Termos em que",
+    local/data e assinatura não sejam substituídos ao regenerá-la.
+    """
+    spans = []
+    seen_titles = set()
+    offset = 0
+    for raw_line in text.splitlines(keepends=True):
+        line = raw_line.strip()
+        if line and line not in seen_titles and any(p.match(line) for p in MAIN_SECTION_PATTERNS):
+            seen_titles.add(line)
+            if spans:
+                spans[-1]['end'] = offset
+            spans.append({'title': line.upper(), 'start': offset, 'end': len(text)})
+        elif spans and spans[-1]['end'] == len(text) and PETICAO_END_RE.match(line):
+            spans[-1]['end'] = offset
+        offset += len(raw_line)
+    return spans
+
+def regenerate_section(result, section_title, instrucoes=''):
+    """Gerar novamente o texto de uma seção a partir do JSON extraído e das seções vizinhas.
+
+    Retorna o novo texto da seção, ou None se a seção não existir ou a geração falhar.
+    """
+    spans = find_section_spans(result)
+    index = next((i for i, span in enumerate(spans) if span['title'] == section_title.strip().upper()), None)
+    if index is None:
+        logger.error(f"Seção não encontrada para regeneração: {section_title}")
+        return None
+
+    json_data, _ = extract_json_and_contestacao(result)
+    span = spans[index]
+    contents = [
+        SECTION_PROMPT.format(
+            titulo=span['title'],
+            instrucoes=f"4. Instruções adicionais do advogado: {instrucoes}\n" if instrucoes else ""
+        ),
+        f"### DADOS EXTRAÍDOS DA PETIÇÃO INICIAL (JSON):\n{json.dumps(json_data, ensure_ascii=False)}"
+    ]
+    if index > 0:
+        previous = spans[index - 1]
+        contents.append(f"### SEÇÃO ANTERIOR:\n{result[previous['start']:previous['end']].strip()}")
+    contents.append(f"### SEÇÃO ATUAL (A SER REESCRITA):\n{result[span['start']:span['end']].strip()}")
+    if index + 1 < len(spans):
+        following = spans[index + 1]
+        contents.append(f"### SEÇÃO SEGUINTE:\n{result[following['start']:following['end']].strip()}")
+
+    new_text = call_gemini(contents, kind='regeneracao')
+    if not new_text:
+        logger.error("Resposta vazia do Gemini ao regenerar seção")
+        return None
+
+    return ensure_section_heading(new_text, span['title'])
+
+def splice_section(result, section_title, new_text):
+    """Substituir o texto de uma seção no resultado bruto (None se a seção não existir)"""
+    for span in find_section_spans(result):
+        if span['title'] == section_title.strip().upper():
+            return result[:span['start']] + new_text + "\n\n" + result[span['end']:].lstrip('\n')
+    return None
+
+# Documentos anexos listados ao final da contestação (DOCX e TXT)
+DOCUMENTOS_ANEXOS = [
+    "Procuração com poderes especiais",
+    "Documentos constitutivos da empresa ré",
+    "Termos e Condições da plataforma Brazino777",
+    "Registros de apostas do Autor",
+    "Laudo pericial (quando disponível)"
+]
+
 def create_word_document(contestacao_data):
     try:
+        import docx
+        from docx.shared import Pt, Cm
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+
         doc = docx.Document()
         
         # Configurar margens (em centímetros)
@@ -473,15 +2616,7 @@ def create_word_document(contestacao_data):
         docs_title_run.bold = True
         docs_title_run.font.size = Pt(12)
         
-        docs_list = [
-            "Procuração com poderes especiais",
-            "Documentos constitutivos da empresa ré",
-            "Termos e Condições da plataforma Brazino777",
-            "Registros de apostas do Autor",
-            "Laudo pericial (quando disponível)"
-        ]
-        
-        for doc_item in docs_list:
+        for doc_item in DOCUMENTOS_ANEXOS:
             p = doc.add_paragraph()
             p.paragraph_format.left_indent = Cm(2)
             p.add_run(f"• {doc_item}")
@@ -538,15 +2673,7 @@ def create_txt_document(contestacao_data):
         lines.append("DOCUMENTOS ANEXOS")
         lines.append("")
         
-        docs_list = [
-            "Procuração com poderes especiais",
-            "Documentos constitutivos da empresa ré",
-            "Termos e Condições da plataforma Brazino777",
-            "Registros de apostas do Autor",
-            "Laudo pericial (quando disponível)"
-        ]
-        
-        for doc_item in docs_list:
+        for doc_item in DOCUMENTOS_ANEXOS:
             lines.append(f"• {doc_item}")
         
         lines.append("")
@@ -564,6 +2691,343 @@ def create_txt_document(contestacao_data):
         logger.error(f"Erro ao criar documento TXT: {str(e)}")
         raise
 
+# Motor rápido de DOCX: os parts fixos (estilos, tema, configurações) vêm de um
+# documento base montado uma vez com python-docx e já comprimido; a cada documento
+# só o word/document.xml é gerado, como texto, com estilos de parágrafo nomeados em
+# vez de formatação por parágrafo, e gravado em fluxo no ZIP.
+DOCX_STYLES = {
+    # nome do estilo: (id, alinhamento, negrito, tamanho em pt, recuo da 1ª linha em cm, recuo à esquerda em cm)
+    'Contestação Título': ('ContestacaoTitulo', 'CENTER', True, 14, None, None),
+    'Contestação Centro': ('ContestacaoCentro', 'CENTER', None, None, None, None),
+    'Contestação Seção': ('ContestacaoSecao', 'CENTER', True, 12, None, None),
+    'Contestação Parágrafo': ('ContestacaoParagrafo', 'JUSTIFY', None, None, 2, None),
+    'Contestação Anexo': ('ContestacaoAnexo', None, None, None, None, 2),
+}
+INVALID_XML_CHARS_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+DOCX_CHUNK_SIZE = 64 * 1024
+
+_docx_base = None
+_docx_base_lock = threading.Lock()
+
+def get_docx_base():
+    """Montar (uma vez) o documento base: parts fixos já comprimidos e o envelope do document.xml"""
+    global _docx_base
+    with _docx_base_lock:
+        if _docx_base is not None:
+            return _docx_base
+        import docx
+        from docx.shared import Pt, Cm
+        from docx.enum.style import WD_STYLE_TYPE
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+        doc = docx.Document()
+        for section in doc.sections:
+            section.top_margin = Cm(3)
+            section.bottom_margin = Cm(2)
+            section.left_margin = Cm(3)
+            section.right_margin = Cm(3)
+        for name, (style_id, alignment, bold, size, first_line_indent, left_indent) in DOCX_STYLES.items():
+            style = doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+            style.style_id = style_id
+            style.base_style = doc.styles['Normal']
+            if alignment:
+                style.paragraph_format.alignment = getattr(WD_ALIGN_PARAGRAPH, alignment)
+            if bold:
+                style.font.bold = True
+            if size:
+                style.font.size = Pt(size)
+            if first_line_indent:
+                style.paragraph_format.first_line_indent = Cm(first_line_indent)
+            if left_indent:
+                style.paragraph_format.left_indent = Cm(left_indent)
+
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        parts = []
+        with zipfile.ZipFile(buffer) as base:
+            for name in base.namelist():
+                data = base.read(name)
+                if name == 'word/document.xml':
+                    xml = data.decode('utf-8')
+                    body = xml.index('<w:body>') + len('<w:body>')
+                    envelope = (xml[:body].encode('utf-8'), xml[xml.index('<w:sectPr'):].encode('utf-8'))
+                    parts.append((name, None))
+                else:
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+                    parts.append((name, (zlib.crc32(data), len(data), compressor.compress(data) + compressor.flush())))
+        _docx_base = {'parts': parts, 'envelope': envelope}
+        return _docx_base
+
+def docx_run(text, bold=False):
+    """Run do OOXML; quebras de linha e tabulações viram <w:br/> e <w:tab/>, como no python-docx"""
+    text = xml_escape(INVALID_XML_CHARS_RE.sub('', str(text)))
+    pieces = []
+    for index, line in enumerate(text.split('\n')):
+        if index:
+            pieces.append('<w:br/>')
+        if line:
+            pieces.append('<w:t xml:space="preserve">' + line.replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">') + '</w:t>')
+    return f'<w:r>{"<w:rPr><w:b/></w:rPr>" if bold else ""}{"".join(pieces)}</w:r>'
+
+def docx_paragraph(style_name, *runs):
+    return f'<w:p><w:pPr><w:pStyle w:val="{DOCX_STYLES[style_name][0]}"/></w:pPr>{"".join(runs)}</w:p>'
+
+def iter_document_paragraphs(contestacao_data):
+    """Parágrafos do document.xml, na mesma ordem e disposição de create_word_document()"""
+    empty = '<w:p/>'
+    yield docx_paragraph('Contestação Título', docx_run("MINHA HONRA JUS\nExcelência em Documentos Jurídicos"))
+    yield empty
+    yield docx_paragraph('Contestação Centro',
+                         docx_run("EXCELENTÍSSIMO(A) SENHOR(A) DOUTOR(A) JUIZ(A) DE DIREITO", bold=True),
+                         docx_run(f"\nDA VARA CÍVEL DO FORO {contestacao_data['foro']} DA COMARCA DE {contestacao_data['comarca']}"))
+    yield empty
+    yield docx_paragraph('Contestação Centro',
+                         docx_run(f"Processo n.º: {contestacao_data['numero_processo']}\n"),
+                         docx_run(f"Autor: {contestacao_data['autor_nome']}\n"),
+                         docx_run(f"Réu: {contestacao_data['reu_nome']}"))
+    yield empty
+    yield docx_paragraph('Contestação Título', docx_run("CONTESTAÇÃO"))
+    for section in contestacao_data['secoes']:
+        yield empty
+        yield docx_paragraph('Contestação Seção', docx_run(section['titulo']))
+        for paragraph in section['paragrafos']:
+            yield docx_paragraph('Contestação Parágrafo', docx_run(paragraph))
+    yield empty
+    yield docx_paragraph('Contestação Seção', docx_run("DOCUMENTOS ANEXOS"))
+    for doc_item in DOCUMENTOS_ANEXOS:
+        yield docx_paragraph('Contestação Anexo', docx_run(f"• {doc_item}"))
+    yield empty
+    yield docx_paragraph('Contestação Centro',
+                         docx_run("Termos em que,\nPede deferimento.\n\n"),
+                         docx_run(f"{datetime.datetime.now().strftime('%d/%m/%Y')}\n\n"),
+                         docx_run("_____________________________\n"),
+                         docx_run(f"{contestacao_data['advogado_nome']}\n"),
+                         docx_run(f"OAB/{contestacao_data['advogado_estado']} {contestacao_data['advogado_numero']}"))
+
+def write_fast_docx(contestacao_data, target):
+    """Gravar o DOCX em target (arquivo binário, sem necessidade de seek) a partir do documento base.
+
+    O ZIP é escrito diretamente: parts fixos com os bytes já comprimidos e o
+    document.xml comprimido em fluxo, com data descriptor no final.
+    """
+    base = get_docx_base()
+    dos_time, dos_date = zip_dos_datetime(datetime.datetime.now())
+    offset = 0
+    central = []
+
+    def write(data):
+        nonlocal offset
+        target.write(data)
+        offset += len(data)
+
+    for name, stored in base['parts']:
+        encoded_name = name.encode('utf-8')
+        header_offset = offset
+        if stored is not None:
+            crc, size, compressed = stored
+            write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0, 8, dos_time, dos_date,
+                              crc, len(compressed), size, len(encoded_name), 0) + encoded_name)
+            write(compressed)
+            central.append((encoded_name, 0, crc, len(compressed), size, header_offset))
+            continue
+
+        # document.xml: tamanho e CRC só são conhecidos no fim (flag 0x08 + data descriptor)
+        write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x08, 8, dos_time, dos_date,
+                          0, 0, 0, len(encoded_name), 0) + encoded_name)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        crc = size = compressed_size = 0
+        pending = []
+        pending_size = 0
+
+        def feed(data):
+            nonlocal crc, size, compressed_size
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            chunk = compressor.compress(data)
+            compressed_size += len(chunk)
+            if chunk:
+                write(chunk)
+
+        feed(base['envelope'][0])
+        for paragraph in iter_document_paragraphs(contestacao_data):
+            pending.append(paragraph)
+            pending_size += len(paragraph)
+            if pending_size >= DOCX_CHUNK_SIZE:
+                feed(''.join(pending).encode('utf-8'))
+                pending, pending_size = [], 0
+        feed(''.join(pending).encode('utf-8') + base['envelope'][1])
+        chunk = compressor.flush()
+        compressed_size += len(chunk)
+        write(chunk)
+        write(struct.pack('<IIII', 0x08074b50, crc, compressed_size, size))
+        central.append((encoded_name, 0x08, crc, compressed_size, size, header_offset))
+
+    central_offset = offset
+    for encoded_name, flags, crc, compressed_size, size, header_offset in central:
+        write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, flags, 8, dos_time, dos_date,
+                          crc, compressed_size, size, len(encoded_name), 0, 0, 0, 0, 0, header_offset) + encoded_name)
+    write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(central), len(central),
+                      offset - central_offset, central_offset, 0))
+
+def zip_dos_datetime(moment):
+    """Data e hora no formato MS-DOS usado nos cabeçalhos do ZIP"""
+    return ((moment.hour << 11) | (moment.minute << 5) | (moment.second // 2),
+            ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day)
+
+def write_word_document(contestacao_data, target):
+    """Gravar o DOCX em target (caminho ou arquivo binário) com o motor configurado em DOCX_ENGINE"""
+    if app.config['DOCX_ENGINE'] == 'python-docx':
+        create_word_document(contestacao_data).save(target)
+    elif isinstance(target, (str, os.PathLike)):
+        with open(target, 'wb') as f:
+            write_fast_docx(contestacao_data, f)
+    else:
+        write_fast_docx(contestacao_data, target)
+
+# Exportação em lote: os documentos são renderizados num pool de processos e
+# o ZIP é enviado em partes à medida que cada resultado fica pronto.
+ADVOGADO = {'advogado_nome': 'GUILHERME KASCHNY BASTIAN', 'advogado_estado': 'SP', 'advogado_numero': '266.795'}
+EXPORT_FORMATS = ('docx', 'txt')
+BR_TAG_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+
+def build_document_data(result):
+    """Montar, a partir de um resultado guardado, os dados usados por create_word_document/create_txt_document"""
+    json_data, contestacao = extract_json_and_contestacao(result)
+    processo = json_data.get('processo') or {}
+    secoes = []
+    for section in parse_contestacao_sections(contestacao):
+        paragrafos = [p for p in BR_TAG_RE.split(section['content']) if p.strip()]
+        for subsection in section['subsections']:
+            paragrafos.append(f"{subsection['number']}. {subsection['title']}")
+            paragrafos.extend(p for p in BR_TAG_RE.split(subsection['content']) if p.strip())
+        secoes.append({'titulo': section['title'], 'paragrafos': paragrafos})
+    return dict(ADVOGADO,
+                foro=processo.get('foro') or '[FORO]',
+                comarca=processo.get('comarca') or 'SÃO PAULO',
+                numero_processo=processo.get('numero') or '[NÚMERO DO PROCESSO]',
+                autor_nome=(json_data.get('autor') or {}).get('nome') or '[AUTOR]',
+                reu_nome=(json_data.get('reu') or {}).get('nome') or '[RÉU]',
+                secoes=secoes)
+
+def render_export_entry(result_id, result, formats):
+    """Renderizar os documentos de um resultado (executado nos processos do pool de exportação)"""
+    contestacao_data = build_document_data(result)
+    entries = []
+    if 'docx' in formats:
+        buffer = io.BytesIO()
+        write_word_document(contestacao_data, buffer)
+        entries.append((f"contestacao_{result_id}.docx", buffer.getvalue()))
+    if 'txt' in formats:
+        entries.append((f"contestacao_{result_id}.txt", create_txt_document(contestacao_data).encode('utf-8')))
+    return entries
+
+_export_pool = None
+_export_pool_lock = threading.Lock()
+
+def get_export_pool():
+    """Criar (uma vez) o pool de processos da exportação.
+
+    Usa 'spawn': um fork do worker web copiaria locks seguros por outras threads.
+    """
+    global _export_pool
+    with _export_pool_lock:
+        if _export_pool is None:
+            _export_pool = ProcessPoolExecutor(max_workers=app.config['EXPORT_WORKERS'],
+                                               mp_context=multiprocessing.get_context('spawn'))
+        return _export_pool
+
+def reset_export_pool():
+    """Descartar um pool quebrado (processo filho morto), para que a próxima exportação crie outro"""
+    global _export_pool
+    with _export_pool_lock:
+        pool, _export_pool = _export_pool, None
+    if pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+class ZipStream:
+    """Destino de escrita do zipfile que acumula só os bytes ainda não enviados ao cliente"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_export_entries(result_ids, formats, failures):
+    """Renderizar os resultados no pool e produzir (result_id, entradas) na ordem em que terminam.
+
+    No máximo 2 resultados por processo ficam pendentes, para não carregar o lote inteiro em memória.
+    Falhas são anotadas em failures como (result_id, motivo).
+    """
+    pool = get_export_pool()
+    window = app.config['EXPORT_WORKERS'] * 2
+    pending = {}
+    queue = iter(result_ids)
+    exhausted = False
+    while pending or not exhausted:
+        while not exhausted and len(pending) < window:
+            result_id = next(queue, None)
+            if result_id is None:
+                exhausted = True
+                break
+            result = get_result_from_file(result_id)
+            if not result:
+                failures.append((result_id, 'resultado não encontrado'))
+                continue
+            pending[pool.submit(render_export_entry, result_id, result, formats)] = result_id
+        if not pending:
+            break
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result_id = pending.pop(future)
+            try:
+                yield result_id, future.result()
+            except BrokenProcessPool:
+                reset_export_pool()
+                raise
+            except Exception as e:
+                logger.error(f"Erro ao renderizar {result_id} para exportação: {str(e)}")
+                failures.append((result_id, str(e)))
+
+def generate_export_zip(result_ids, formats):
+    """Gerar o ZIP da exportação em partes, uma por resultado concluído"""
+    start = time.perf_counter()
+    stream = ZipStream()
+    failures = []
+    exported = 0
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for result_id, entries in iter_export_entries(result_ids, formats, failures):
+            for name, data in entries:
+                # DOCX já é um ZIP comprimido; recomprimir só gastaria CPU
+                archive.writestr(name, data, compress_type=zipfile.ZIP_STORED if name.endswith('.docx') else zipfile.ZIP_DEFLATED)
+            exported += 1
+            yield stream.drain()
+        if failures:
+            archive.writestr('erros.txt', "\n".join(f"{result_id}: {reason}" for result_id, reason in failures) + "\n")
+    yield stream.drain()
+    increment_counter('export.documents', exported)
+    increment_counter('export.failures', len(failures))
+    record_latency('export.total', time.perf_counter() - start)
+    logger.info(f"Exportação concluída: {exported} resultados, {len(failures)} falhas")
+
+def parse_export_dates(de, ate):
+    """Converter as datas 'de' e 'ate' (AAAA-MM-DD, inclusivas, horário local) em um intervalo em ns"""
+    try:
+        since = datetime.datetime.combine(datetime.date.fromisoformat(de), datetime.time())
+        until = datetime.datetime.combine(datetime.date.fromisoformat(ate or de), datetime.time()) + datetime.timedelta(days=1)
+    except ValueError:
+        raise ValueError("Datas inválidas: use o formato AAAA-MM-DD")
+    return int(since.timestamp() * 1e9), int(until.timestamp() * 1e9)
+
 @app.route('/')
 def index():
     logger.info("Página inicial acessada")
@@ -596,53 +3060,28 @@ def process():
             logger.error("Arquivos não são PDFs")
             return render_template('index.html', error='Os arquivos devem ser PDFs'), 400
         
-        # Save files with unique filenames to avoid conflicts
-        secure_peticao_filename = secure_filename(f"{uuid.uuid4()}_{peticao_file.filename}")
-        secure_modelo_filename = secure_filename(f"{uuid.uuid4()}_{modelo_file.filename}")
-        
-        logger.info(f"Salvando arquivos: {secure_peticao_filename} e {secure_modelo_filename}")
-        peticao_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_peticao_filename)
-        modelo_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_modelo_filename)
-        
-        peticao_file.save(peticao_path)
-        modelo_file.save(modelo_path)
-        
-        # Verificar se os arquivos foram salvos corretamente
-        if not os.path.exists(peticao_path):
-            logger.error(f"Falha ao salvar o arquivo da petição: {peticao_path}")
-            return render_template('index.html', error='Falha ao salvar o arquivo da petição. Tente novamente.'), 500
-        
-        if not os.path.exists(modelo_path):
-            logger.error(f"Falha ao salvar o arquivo do modelo: {modelo_path}")
-            return render_template('index.html', error='Falha ao salvar o arquivo do modelo. Tente novamente.'), 500
-        
-        # Process with Gemini
-        logger.info("Processando PDFs com Gemini")
-        result = process_pdfs_with_gemini(peticao_path, modelo_path)
-        
-        # Verificar resultado
-        if not result or result.startswith("Erro"):
-            logger.error(f"Erro no processamento: {result}")
-            # Clean up uploaded files
-            if os.path.exists(peticao_path):
-                os.remove(peticao_path)
-            if os.path.exists(modelo_path):
-                os.remove(modelo_path)
-            return render_template('index.html', error=result), 500
-        
-        # Clean up uploaded files
-        logger.info("Removendo arquivos temporários")
+        # Intervalo de páginas da petição: informado pelo usuário ou localizado nos autos (?autos=1)
+        # e política de admissão (o formulário aguarda o resultado, então 'queue' vira 'chunked')
         try:
-            os.remove(peticao_path)
-            os.remove(modelo_path)
-        except Exception as e:
-            logger.warning(f"Erro ao remover arquivos temporários: {str(e)}")
-        
-        # Salvar resultado em arquivo em vez de usar sessão
-        result_id = save_result_to_file(result)
+            peticao_pages = parse_page_range(request.form.get('paginas')) or ('auto' if request.args.get('autos') else None)
+            policy = admission_policy(request.form.get('admissao'))
+        except ValueError as e:
+            logger.error(str(e))
+            return render_template('index.html', error=str(e)), 400
+        if policy == 'queue':
+            policy = 'chunked'
+        
+        # Duplicatas (Idempotency-Key ou mesmo par de arquivos) compartilham a computação
+        mode = generation_mode(request.form.get('modo'))
+        request_key, content = compute_request_key(peticao_file, modelo_file, peticao_pages, mode, policy)
+        with request_deadline():
+            result, result_id = run_single_flight(
+                request_key,
+                lambda: process_uploaded_pdfs(peticao_file, modelo_file, mode, peticao_pages, policy),
+                content)
+
         if not result_id:
-            logger.error("Falha ao salvar resultado em arquivo")
-            return render_template('index.html', error="Falha ao salvar resultado em arquivo"), 500
+            return render_template('index.html', error=result), 500
         
         # Guarda o ID do resultado na sessão como backup
         session['result_id'] = result_id
@@ -651,6 +3090,21 @@ def process():
         logger.info(f"Redirecionando para página de resultado com ID: {result_id}")
         return redirect(url_for('resultado', id=result_id))
     
+    except HTTPException:
+        # Erros HTTP (por exemplo, 413) seguem para os handlers registrados
+        raise
+    except IdempotencyKeyConflict as e:
+        logger.warning(str(e))
+        return render_template('index.html', error=str(e)), 422
+    except AdmissionRejected as e:
+        logger.warning(f"Trabalho recusado na admissão: {str(e)}")
+        response = make_response(render_template('index.html', error=str(e)), e.decision['status'])
+        if e.decision.get('retry_after'):
+            response.headers['Retry-After'] = str(e.decision['retry_after'])
+        return response
+    except DeadlineExceeded as e:
+        logger.warning(str(e))
+        return render_template('index.html', error='O processamento excedeu o tempo limite. Por favor, tente novamente.'), 504
     except Exception as e:
         logger.exception(f"Exceção não tratada: {str(e)}")
         # Tratar qualquer exceção não prevista
@@ -672,6 +3126,15 @@ def resultado():
         logger.error("ID do resultado não encontrado")
         return render_template('index.html', error='Nenhum resultado encontrado. Por favor, envie os documentos novamente.'), 400
         
+    # Página já renderizada para esta versão do resultado e do template
+    data_atual = datetime.datetime.now().strftime("%d/%m/%Y")
+    result_version = get_result_version(result_id)
+    cache_key = (result_id, result_version, template_version('resultado.html'), data_atual)
+    cached = get_cached_page(cache_key) if result_version else None
+    if cached:
+        logger.info(f"Página de resultado servida do cache: {result_id}")
+        return cached_page_response(cached)
+    
     # Recuperar o resultado do arquivo
     result = get_result_from_file(result_id)
     
@@ -693,31 +3156,36 @@ def resultado():
         logger.info("Dividindo contestação em seções")
         contestacao_sections = parse_contestacao_sections(contestacao_text)
         
-        # Get current date
-        data_atual = datetime.datetime.now().strftime("%d/%m/%Y")
-        
         # Extrair informações específicas do JSON
         autor_nome = json_data.get('autor', {}).get('nome', '')
         reu_nome = json_data.get('reu', {}).get('nome', '')
+        processo = json_data.get('processo') or {}
         
-        # Return the rendered template
+        # Render the template and keep it in the page cache
         logger.info("Renderizando template de resultado")
-        return render_template('resultado.html', 
+        html = render_template('resultado.html', 
                               json_data=json.dumps(json_data, indent=2, ensure_ascii=False),
                               contestacao_sections=contestacao_sections,
                               data_atual=data_atual,
                               result_id=result_id,
                               autor_nome=autor_nome,
                               reu_nome=reu_nome,
-                              comarca='São Paulo',  # Pode ser extraído do JSON se disponível
-                              numero_processo='',   # Pode ser extraído do JSON se disponível
-                              advogado_nome='GUILHERME KASCHNY BASTIAN',
-                              advogado_estado='SP',
-                              advogado_numero='266.795')
+                              foro=processo.get('foro') or '[FORO]',
+                              comarca=processo.get('comarca') or 'São Paulo',
+                              numero_processo=processo.get('numero', ''),
+                              **ADVOGADO)
+        last_modified = datetime.datetime.fromtimestamp(result_version / 1e9, datetime.timezone.utc) if result_version else None
+        return cached_page_response(store_cached_page(cache_key, html, last_modified))
     except Exception as e:
         logger.exception(f"Erro ao renderizar página de resultado: {str(e)}")
         return render_template('index.html', error=f'Erro ao renderizar resultado: {str(e)}'), 500
 
+def private_download(response):
+    """Documentos gerados são de um único usuário: nunca guardados por proxies ou pelo navegador"""
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
 @app.route('/download/docx')
 def download_docx():
     try:
@@ -734,20 +3202,18 @@ def download_docx():
             'secoes': json.loads(request.args.get('secoes', '[]'))
         }
         
-        # Criar documento Word
-        doc = create_word_document(contestacao_data)
-        
-        # Salvar documento temporariamente
+        # Criar documento Word num arquivo temporário
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
-        doc.save(temp_file.name)
+        with temp_file:
+            write_word_document(contestacao_data, temp_file)
         
         # Enviar arquivo para download
-        return send_file(
+        return private_download(send_file(
             temp_file.name,
             as_attachment=True,
             download_name=f'contestacao_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.docx',
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
+        ))
     except Exception as e:
         logger.error(f"Erro ao gerar DOCX: {str(e)}")
         return jsonify({'error': 'Erro ao gerar documento Word'}), 500
@@ -777,16 +3243,139 @@ def download_txt():
             f.write(content)
         
         # Enviar arquivo para download
-        return send_file(
+        return private_download(send_file(
             temp_file.name,
             as_attachment=True,
             download_name=f'contestacao_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.txt',
             mimetype='text/plain'
-        )
+        ))
     except Exception as e:
         logger.error(f"Erro ao gerar TXT: {str(e)}")
         return jsonify({'error': 'Erro ao gerar arquivo de texto'}), 500
 
+# Campos da resposta de /api/process, escolhidos com ?fields=a,b ou ?compact=1.
+# O padrão mantém a resposta completa da versão anterior; no modo compacto o
+# documento não vem inline, apenas o result_id e as posições das seções no texto
+# guardado (legível em /api/results/<result_id>, com suporte a Range).
+API_RESPONSE_FIELDS = ('result_id', 'result', 'json_data', 'contestacao', 'referencias')
+API_DEFAULT_FIELDS = ('result', 'json_data', 'contestacao', 'result_id')
+API_COMPACT_FIELDS = ('result_id', 'json_data', 'referencias')
+
+def parse_response_fields():
+    """Campos pedidos pelo cliente (fields= ou compact=1); ValueError se algum for desconhecido"""
+    fields = request.args.get('fields') or request.form.get('fields')
+    if request.args.get('compact') == '1' or fields == 'compact':
+        return API_COMPACT_FIELDS
+    if not fields:
+        return API_DEFAULT_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in API_RESPONSE_FIELDS]
+    if unknown:
+        raise ValueError(f"Campos desconhecidos: {', '.join(unknown)}. Válidos: {', '.join(API_RESPONSE_FIELDS)}")
+    return fields
+
+def build_result_references(result):
+    """Posições (em bytes UTF-8) da contestação e de cada seção principal no resultado guardado"""
+    def byte_offset(index):
+        return len(result[:index].encode('utf-8'))
+
+    _, contestacao = extract_json_and_contestacao(result)
+    contestacao_start = result.find(contestacao) if contestacao else len(result)
+    total = byte_offset(len(result))
+    return {
+        'tamanho': total,
+        'contestacao': {'inicio': byte_offset(max(contestacao_start, 0)), 'fim': total},
+        'secoes': [{'titulo': span['title'], 'inicio': byte_offset(span['start']), 'fim': byte_offset(span['end'])}
+                   for span in find_section_spans(result)]
+    }
+
+def build_api_payload(result, result_id, fields):
+    """Montar a resposta só com os campos pedidos, sem extrair o que não será enviado"""
+    payload = {}
+    if 'json_data' in fields or 'contestacao' in fields:
+        json_data, contestacao = extract_json_and_contestacao(result)
+    for field in fields:
+        if field == 'result_id':
+            payload['result_id'] = result_id
+        elif field == 'result':
+            payload['result'] = result
+        elif field == 'json_data':
+            payload['json_data'] = json_data
+        elif field == 'contestacao':
+            payload['contestacao'] = contestacao
+        elif field == 'referencias':
+            payload['referencias'] = build_result_references(result)
+    return payload
+
+def iter_json_chunks(payload, chunk_size=64 * 1024):
+    """Serializar o JSON em partes de ~chunk_size bytes, sem montar a string inteira"""
+    buffer = []
+    buffered = 0
+    for piece in json.JSONEncoder(ensure_ascii=False).iterencode(payload):
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= chunk_size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+def iter_compressed(chunks, encoding):
+    """Comprimir uma sequência de partes em fluxo (gzip ou br)"""
+    if encoding == 'br':
+        compressor = get_brotli().Compressor(quality=5)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+def api_json_response(payload, estimated_size):
+    """Resposta JSON: jsonify para respostas pequenas; serializada e comprimida em fluxo para as grandes"""
+    if estimated_size < app.config['API_STREAM_MIN_SIZE']:
+        return jsonify(payload)
+    encoding = negotiate_encoding()
+    chunks = iter_json_chunks(payload)
+    response = Response(chunks if encoding == 'identity' else iter_compressed(chunks, encoding),
+                        mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/api/results/<result_id>')
+def api_result_text(result_id):
+    """Texto bruto de um resultado guardado, com ETag e suporte a Range (posições de 'referencias').
+
+    A codificação é escolhida aqui, com uma ETag por variante como em cached_page_response();
+    pedidos com Range recebem sempre o texto sem compressão, onde valem as posições.
+    """
+    result_version = get_result_version(result_id)
+    result = get_result_from_file(result_id) if result_version else None
+    if not result:
+        return jsonify({
+            'error': 'Resultado não encontrado'
+        }), 404
+    body = result.encode('utf-8')
+    encoding = 'identity'
+    if not request.range and len(body) >= app.config['COMPRESSION_MIN_SIZE']:
+        encoding = negotiate_encoding()
+    body = compress_body(body, encoding)
+    response = app.response_class(body, mimetype='text/plain')
+    etag = f"{result_id}-{result_version}"
+    response.set_etag(etag if encoding == 'identity' else f"{etag}-{encoding}")
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
 @app.route('/api/process', methods=['POST'])
 def api_process():
     """API endpoint for compatibility with previous implementation"""
@@ -816,62 +3405,283 @@ def api_process():
                 'error': 'Nenhum arquivo selecionado'
             }), 400
         
-        # Save files with unique filenames to avoid conflicts
-        secure_peticao_filename = secure_filename(f"{uuid.uuid4()}_{peticao_file.filename}")
-        secure_modelo_filename = secure_filename(f"{uuid.uuid4()}_{modelo_file.filename}")
-        
-        logger.info(f"Salvando arquivos para API: {secure_peticao_filename} e {secure_modelo_filename}")
-        peticao_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_peticao_filename)
-        modelo_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_modelo_filename)
-        
-        peticao_file.save(peticao_path)
-        modelo_file.save(modelo_path)
-        
-        # Verificar se os arquivos foram salvos corretamente
-        if not os.path.exists(peticao_path):
-            logger.error(f"Falha ao salvar o arquivo da petição para API: {peticao_path}")
+        # Intervalo de páginas da petição: informado pelo usuário ou localizado nos autos (?autos=1)
+        # e campos da resposta (fields= ou compact=1)
+        try:
+            peticao_pages = parse_page_range(request.form.get('paginas')) or ('auto' if request.args.get('autos') else None)
+            fields = parse_response_fields()
+            policy = admission_policy(request.form.get('admissao'))
+        except ValueError as e:
+            logger.error(str(e))
             return jsonify({
-                'error': 'Falha ao salvar o arquivo da petição. Tente novamente.'
-            }), 500
+                'error': str(e)
+            }), 400
         
-        if not os.path.exists(modelo_path):
-            logger.error(f"Falha ao salvar o arquivo do modelo para API: {modelo_path}")
+        # Duplicatas (Idempotency-Key ou mesmo par de arquivos) compartilham a computação
+        mode = generation_mode(request.form.get('modo'))
+        request_key, content = compute_request_key(peticao_file, modelo_file, peticao_pages, mode, policy)
+        with request_deadline():
+            result, result_id = run_single_flight(
+                request_key,
+                lambda: process_uploaded_pdfs(peticao_file, modelo_file, mode, peticao_pages, policy),
+                content)
+
+            if not result_id:
+                return jsonify({
+                    'error': result
+                }), 500
+            
+            # Para API, retornar JSON apenas com os campos pedidos; se o prazo acabou, o
+            # resultado já guardado continua disponível em /api/results/<result_id>
+            try:
+                check_deadline('montagem da resposta')
+            except DeadlineExceeded as e:
+                logger.warning(str(e))
+                return jsonify({
+                    'error': str(e),
+                    'result_id': result_id
+                }), 504
+            logger.info(f"Montando resposta da API com os campos: {', '.join(fields)}")
+            estimated_size = len(result) * sum(1 for f in fields if f in ('result', 'contestacao'))
+            return api_json_response(build_api_payload(result, result_id, fields), estimated_size)
+    
+    except HTTPException:
+        raise
+    except IdempotencyKeyConflict as e:
+        logger.warning(str(e))
+        return jsonify({
+            'error': str(e)
+        }), 422
+    except AdmissionRejected as e:
+        logger.warning(f"Trabalho recusado na admissão: {str(e)}")
+        return admission_rejected_response(e)
+    except JobQueued as e:
+        return jsonify({
+            'job_id': e.job_id,
+            'status_url': url_for('api_job', job_id=e.job_id),
+            'decisao': e.decision,
+            'estimativa': e.estimate
+        }), 202
+    except DeadlineExceeded as e:
+        logger.warning(str(e))
+        return jsonify({
+            'error': str(e)
+        }), 504
+    except Exception as e:
+        logger.exception(f"Erro na API: {str(e)}")
+        return jsonify({
+            'error': f'Erro ao processar: {str(e)}'
+        }), 500
+
+def admission_rejected_response(error):
+    response = jsonify({
+        'error': str(error),
+        'decisao': error.decision,
+        'estimativa': error.estimate
+    })
+    response.status_code = error.decision['status']
+    if error.decision.get('retry_after'):
+        response.headers['Retry-After'] = str(error.decision['retry_after'])
+    return response
+
+@app.route('/api/estimate', methods=['POST'])
+def api_estimate():
+    """Estimar tokens e duração do processamento de um par de PDFs e antecipar a decisão da admissão"""
+    if 'peticao' not in request.files or 'modelo' not in request.files:
+        return jsonify({
+            'error': 'Ambos os arquivos (petição e modelo) são necessários'
+        }), 400
+
+    peticao_file = request.files['peticao']
+    modelo_file = request.files['modelo']
+    if peticao_file.filename == '' or modelo_file.filename == '':
+        return jsonify({
+            'error': 'Nenhum arquivo selecionado'
+        }), 400
+
+    try:
+        peticao_pages = parse_page_range(request.form.get('paginas')) or ('auto' if request.args.get('autos') else None)
+        policy = admission_policy(request.form.get('admissao'))
+    except ValueError as e:
+        return jsonify({
+            'error': str(e)
+        }), 400
+
+    # Os textos ficam no cache: o processamento em seguida dos mesmos arquivos não extrai de novo
+    try:
+        digests = (upload_digest(peticao_file), upload_digest(modelo_file))
+        with request_deadline(), saved_uploads(peticao_file, modelo_file) as (peticao_path, modelo_path):
+            texts = (extract_text_cached(peticao_path, digests[0], peticao_pages),
+                     extract_text_cached(modelo_path, digests[1]))
+    except DeadlineExceeded as e:
+        logger.warning(str(e))
+        return jsonify({
+            'error': str(e)
+        }), 504
+
+    for name, text in zip(('petição', 'modelo'), texts):
+        if not text or text.startswith("Error"):
+            return jsonify({
+                'error': f"Erro ao extrair texto do arquivo da {name}: {text}"
+            }), 422
+
+    # Estimativa para /api/process (classe bulk do agendador)
+    estimate = estimate_job(*texts, 'bulk')
+    budget = requested_deadline_seconds()
+    decision = admission_decision(estimate, generation_mode(request.form.get('modo')), policy, budget)
+    return jsonify({
+        'estimativa': estimate,
+        'decisao': decision,
+        'politica': policy,
+        'prazo_s': budget
+    })
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """Estado de um trabalho da fila em segundo plano"""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({
+            'error': 'Trabalho não encontrado'
+        }), 404
+    payload = {'job_id': job_id, 'status': job['status'], 'modo': job['modo']}
+    if job['result_id']:
+        payload['result_id'] = job['result_id']
+        payload['result_url'] = url_for('api_result_text', result_id=job['result_id'])
+    if job['error']:
+        payload['error'] = job['error']
+    return jsonify(payload)
+
+# Evita que duas regenerações simultâneas do mesmo resultado sobrescrevam uma à outra
+_result_update_lock = threading.Lock()
+
+@app.route('/api/regenerate_section', methods=['POST'])
+def api_regenerate_section():
+    """Regenerar uma única seção de um resultado existente, reaproveitando o JSON extraído"""
+    logger.info("Requisição de regeneração de seção recebida")
+    if not GEMINI_API_KEY:
+        logger.error("API key não configurada")
+        return jsonify({
+            'error': 'API key not configured. Set GEMINI_API_KEY environment variable.'
+        }), 500
+
+    params = request.get_json(silent=True) or request.form
+    result_id = params.get('result_id')
+    section_title = params.get('section', '')
+    instrucoes = params.get('instrucoes', '')
+
+    if not result_id or not section_title:
+        return jsonify({
+            'error': 'Os campos result_id e section são obrigatórios'
+        }), 400
+
+    try:
+        result = get_result_from_file(result_id)
+        if not result:
+            return jsonify({
+                'error': 'Resultado não encontrado'
+            }), 404
+
+        if not any(span['title'] == section_title.strip().upper() for span in find_section_spans(result)):
+            return jsonify({
+                'error': f'Seção não encontrada: {section_title}'
+            }), 404
+
+        with request_deadline():
+            new_text = regenerate_section(result, section_title, instrucoes)
+        if not new_text:
             return jsonify({
-                'error': 'Falha ao salvar o arquivo do modelo. Tente novamente.'
+                'error': 'Falha ao regenerar a seção'
             }), 500
-        
-        # Process with Gemini
-        logger.info("Processando PDFs com Gemini para API")
-        result = process_pdfs_with_gemini(peticao_path, modelo_path)
-        
-        # Clean up uploaded files
-        logger.info("Removendo arquivos temporários para API")
-        try:
-            os.remove(peticao_path)
-            os.remove(modelo_path)
-        except Exception as e:
-            logger.warning(f"Erro ao remover arquivos temporários para API: {str(e)}")
-        
-        # Para API, retornar JSON
-        logger.info("Extraindo JSON e contestação para API")
-        json_data, contestacao = extract_json_and_contestacao(result)
-        
-        # Salvar resultado em arquivo também para compatibilidade
-        result_id = save_result_to_file(result)
-        
+
+        # Reler o resultado sob o lock para não perder outra regeneração concluída nesse meio tempo
+        with _result_update_lock:
+            current = get_result_from_file(result_id) or result
+            updated = splice_section(current, section_title, new_text)
+            if updated is None or not save_result_to_file(updated, result_id):
+                return jsonify({
+                    'error': 'Falha ao salvar o resultado atualizado'
+                }), 500
+
+        _, contestacao = extract_json_and_contestacao(updated)
         return jsonify({
-            'result': result,
-            'json_data': json_data,
-            'contestacao': contestacao,
-            'result_id': result_id
+            'result_id': result_id,
+            'section': section_title.strip().upper(),
+            'text': new_text,
+            'contestacao_sections': parse_contestacao_sections(contestacao)
         })
-    
+    except DeadlineExceeded as e:
+        logger.warning(str(e))
+        return jsonify({
+            'error': str(e)
+        }), 504
     except Exception as e:
-        logger.exception(f"Erro na API: {str(e)}")
+        logger.exception(f"Erro ao regenerar seção: {str(e)}")
         return jsonify({
-            'error': f'Erro ao processar: {str(e)}'
+            'error': f'Erro ao regenerar seção: {str(e)}'
+        }), 500
+
+@app.route('/api/export', methods=['POST'])
+def api_export():
+    """Exportar vários resultados num ZIP de DOCX/TXT, por lista de IDs ou intervalo de datas"""
+    logger.info("Requisição de exportação em lote recebida")
+    params = request.get_json(silent=True) or request.form
+    ids = params.get('ids') or []
+    if isinstance(ids, str):
+        ids = [i.strip() for i in ids.split(',') if i.strip()]
+    formats = params.get('formatos') or list(EXPORT_FORMATS)
+    if isinstance(formats, str):
+        formats = [f.strip().lower() for f in formats.split(',') if f.strip()]
+
+    if not ids and not params.get('de'):
+        return jsonify({
+            'error': 'Informe os IDs (ids) ou o intervalo de datas (de, ate)'
+        }), 400
+    if not formats or any(f not in EXPORT_FORMATS for f in formats):
+        return jsonify({
+            'error': f'Formatos válidos: {", ".join(EXPORT_FORMATS)}'
+        }), 400
+
+    try:
+        if not ids:
+            since_ns, until_ns = parse_export_dates(params.get('de'), params.get('ate'))
+            ids = get_result_backend().list_ids(since_ns, until_ns)
+    except ValueError as e:
+        return jsonify({
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.exception(f"Erro ao listar resultados: {str(e)}")
+        return jsonify({
+            'error': f'Erro ao listar resultados: {str(e)}'
         }), 500
 
+    ids = list(dict.fromkeys(str(result_id) for result_id in ids))
+    if any(not RESULT_ID_RE.match(result_id) for result_id in ids):
+        return jsonify({
+            'error': 'ID de resultado inválido'
+        }), 400
+    if not ids:
+        return jsonify({
+            'error': 'Nenhum resultado encontrado'
+        }), 404
+    if len(ids) > app.config['EXPORT_MAX_RESULTS']:
+        return jsonify({
+            'error': f'Exportação limitada a {app.config["EXPORT_MAX_RESULTS"]} resultados por vez'
+        }), 400
+
+    logger.info(f"Exportando {len(ids)} resultados ({', '.join(formats)})")
+    response = Response(generate_export_zip(ids, formats), mimetype='application/zip')
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename=contestacoes_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.zip')
+    return response
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Métricas de latência e contadores do processo atual"""
+    return jsonify(dict(metrics_snapshot(), scheduler=get_llm_scheduler().snapshot(),
+                        gemini_keys=get_gemini_key_pool().snapshot()))
+
 @app.route('/debug/session_test')
 def debug_session_test():
     """Rota para testar se a sessão está funcionando corretamente"""
@@ -967,10 +3777,45 @@ def debug_view_session():
         'session_data': session_data
     })
 
+@app.after_request
+def cache_static_files(response):
+    """Cache longo e público só para /static; as demais respostas definem o próprio cache"""
+    if request.endpoint == 'static' and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['STATIC_MAX_AGE']
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Comprimir respostas textuais conforme o Accept-Encoding do cliente.
+
+    Respostas que já variam por Accept-Encoding escolheram a sua codificação (e a ETag
+    correspondente) na própria rota e não são comprimidas de novo.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or 'Accept-Encoding' in response.vary
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or response.status_code < 200 or response.status_code in (204, 206, 304)):
+        return response
+
+    data = response.get_data()
+    if len(data) < app.config['COMPRESSION_MIN_SIZE']:
+        return response
+
+    encoding = negotiate_encoding()
+    if encoding == 'identity':
+        return response
+
+    response.set_data(compress_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.errorhandler(413)
 def request_entity_too_large(error):
     logger.error("Arquivo muito grande enviado")
-    return render_template('index.html', error='O arquivo enviado é muito grande. O limite é de 16MB.'), 413
+    limit = request.max_content_length // (1024 * 1024)
+    return render_template('index.html', error=f'O arquivo enviado é muito grande. O limite é de {limit}MB.'), 413
 
 @app.errorhandler(500)
 def internal_server_error(error):
@@ -0,0 +1,80 @@
+import io
+import os
+import json
+import time
+import argparse
+import statistics
+import tracemalloc
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+import app as app_module
+
+# Compara a geração de DOCX pelo python-docx (create_word_document) com o motor
+# rápido (write_fast_docx), para contestações de tamanhos crescentes.
+# Uso: python bench_docx.py --paragraphs 50,500,2000 --runs 5
+
+PARAGRAPH = ("Os fatos narrados na inicial não correspondem à realidade, uma vez que a ré cumpriu "
+             "integralmente as obrigações contratuais, conforme os documentos anexos e o artigo 373 do CPC. ")
+
+def make_contestacao_data(paragraphs):
+    titles = ["PRELIMINARMENTE", "DO MÉRITO", "DOS PEDIDOS"]
+    per_section = max(1, paragraphs // len(titles))
+    return dict(app_module.ADVOGADO,
+                foro='Central', comarca='São Paulo', numero_processo='1001234-54.2024.8.26.0100',
+                autor_nome='João da Silva', reu_nome='Empresa ABC Ltda',
+                secoes=[{'titulo': title, 'paragrafos': [f"{i + 1}. {PARAGRAPH * 3}" for i in range(per_section)]}
+                        for title in titles])
+
+def render_python_docx(data):
+    buffer = io.BytesIO()
+    app_module.create_word_document(data).save(buffer)
+    return buffer.getvalue()
+
+def render_fast(data):
+    buffer = io.BytesIO()
+    app_module.write_fast_docx(data, buffer)
+    return buffer.getvalue()
+
+def measure(render, data, runs):
+    """Mediana do tempo (ms), pico de memória alocada (MB) e tamanho do arquivo (KB).
+
+    O pico considera só alocações do Python (tracemalloc); as do lxml, usado pelo
+    python-docx, não entram, então a economia real de memória é maior.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = render(data)
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    render(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'median_ms': statistics.median(times), 'peak_mb': peak / 1024 / 1024, 'size_kb': len(output) / 1024}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark: python-docx x motor rápido de DOCX')
+    parser.add_argument('--paragraphs', default='50,500,2000', help='Quantidades de parágrafos, separadas por vírgula')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    # Aquecimento: importação do python-docx e montagem do documento base
+    warmup = make_contestacao_data(1)
+    render_python_docx(warmup)
+    render_fast(warmup)
+
+    report = []
+    print(f"{'parágrafos':>10} {'python-docx ms':>15} {'rápido ms':>10} {'speedup':>8} {'pico MB':>15}")
+    for paragraphs in [int(p) for p in args.paragraphs.split(',')]:
+        data = make_contestacao_data(paragraphs)
+        baseline = measure(render_python_docx, data, args.runs)
+        fast = measure(render_fast, data, args.runs)
+        speedup = baseline['median_ms'] / fast['median_ms']
+        report.append({'paragraphs': paragraphs, 'python_docx': baseline, 'fast': fast, 'speedup': speedup})
+        print(f"{paragraphs:>10} {baseline['median_ms']:>15.1f} {fast['median_ms']:>10.1f} {speedup:>7.1f}x "
+              f"{baseline['peak_mb']:>6.1f} -> {fast['peak_mb']:<6.1f}")
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+import app as app_module
+
+# Compara a latência da geração única com a geração paralela por seções,
+# usando um Gemini simulado cuja latência cresce com o tamanho da saída.
+# Uso: python bench_generation.py --chars-per-second 400 --runs 3
+
+FAKE_JSON = """```json
+{"processo": {"numero": "", "comarca": "São Paulo"}, "autor": {"nome": "Autor"}, "reu": {"nome": "Ré"}, "pedidos": []}
+```"""
+
+# Tamanho aproximado (caracteres) de cada parte de uma contestação típica
+SECTION_SIZES = {
+    "CABEÇALHO": 900,
+    "PRELIMINARMENTE": 3000,
+    "DO MÉRITO": 9000,
+    "DOS PEDIDOS": 2000,
+    "DOCUMENTOS ANEXOS": 600,
+}
+
+def make_fake_call_gemini(chars_per_second, base_latency):
+    def fake_call_gemini(contents, **kwargs):
+        prompt = next(part for part in contents if 'Você é um assistente' in part)
+        if prompt is app_module.EXTRACTION_PROMPT:
+            output = FAKE_JSON
+        elif prompt is app_module.PROMPT:
+            output = FAKE_JSON + "\n\n" + "\n\n".join(
+                f"{title}\n\n" + "x" * size for title, size in SECTION_SIZES.items())
+        else:
+            title = next(t for t in SECTION_SIZES if f'"{t}"' in prompt)
+            output = f"{title}\n\n" + "x" * SECTION_SIZES[title]
+        time.sleep(base_latency + len(output) / chars_per_second)
+        return output
+    return fake_call_gemini
+
+def write_fake_pdf(path):
+    import fitz  # PyMuPDF
+    document = fitz.open()
+    page = document.new_page()
+    page.insert_text((72, 72), "Petição inicial de teste")
+    document.save(path)
+    document.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark: geração única x geração paralela por seções')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--chars-per-second', type=float, default=400.0,
+                        help='Velocidade de saída simulada do modelo')
+    parser.add_argument('--base-latency', type=float, default=0.5,
+                        help='Latência fixa simulada por chamada (segundos)')
+    args = parser.parse_args()
+
+    app_module.call_gemini = make_fake_call_gemini(args.chars_per_second, args.base_latency)
+    pdf_path = os.path.join(tempfile.mkdtemp(), 'peticao.pdf')
+    write_fake_pdf(pdf_path)
+
+    for _ in range(args.runs):
+        for mode in ('single', 'parallel'):
+            result = app_module.process_pdfs_with_gemini(pdf_path, pdf_path, mode)
+            if result.startswith('Erro'):
+                print(result)
+                sys.exit(1)
+
+    latencies = app_module.metrics_snapshot()['latencies']
+    single = latencies['generation.single']['p50_s']
+    parallel = latencies['generation.parallel']['p50_s']
+    print(json.dumps({
+        'single_p50_s': single,
+        'parallel_p50_s': parallel,
+        'speedup': single / parallel,
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Mede o cold start da aplicação em processos novos:
+#  - tempo de importação de app.py
+#  - tempo até a primeira resposta (GET /) desde o início do processo
+# Uso: python bench_startup.py --runs 10 --budget-ms 800
+
+HEAVY_MODULES = ['google.generativeai', 'fitz', 'docx']
+
+CHILD_SCRIPT = """
+import sys, time, json
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+response = client.get('/')
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'first_response_ms': (t2 - t1) * 1000,
+    'status': response.status_code,
+    'heavy_loaded': [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+def run_once():
+    """Executar um processo novo e retornar as medições"""
+    env = dict(os.environ)
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD_SCRIPT],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    total_ms = (time.perf_counter() - start) * 1000
+    data = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    data['process_to_first_response_ms'] = total_ms
+    return data
+
+def summarize(values):
+    return {
+        'min': min(values),
+        'median': statistics.median(values),
+        'max': max(values),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de cold start da aplicação')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', 0)),
+                        help='Falhar se a mediana do tempo até a primeira resposta exceder este valor')
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+
+    report = {
+        'runs': args.runs,
+        'import_ms': summarize([r['import_ms'] for r in runs]),
+        'first_response_ms': summarize([r['first_response_ms'] for r in runs]),
+        'process_to_first_response_ms': summarize([r['process_to_first_response_ms'] for r in runs]),
+        'heavy_loaded': sorted(set(m for r in runs for m in r['heavy_loaded'])),
+    }
+    print(json.dumps(report, indent=2))
+
+    if report['heavy_loaded']:
+        print(f"AVISO: módulos pesados carregados no cold start: {report['heavy_loaded']}")
+        sys.exit(1)
+
+    if args.budget_ms and report['process_to_first_response_ms']['median'] > args.budget_ms:
+        print(f"FALHA: cold start acima do orçamento de {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import datetime
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Servidor HTTP local que imita a API REST do Gemini (generateContent,
+# streamGenerateContent e cachedContents), para testes de carga e desenvolvimento offline.
+# Uso: python fake_gemini_server.py --port 8089 --latency 2.0 --error-rate 0.05
+# e inicie a aplicação com GEMINI_API_ENDPOINT=http://127.0.0.1:8089
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+MODEL_PATH_RE = re.compile(r'^/v1(?:beta)?/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)')
+CACHE_PATH_RE = re.compile(r'^/v1(?:beta)?/cachedContents(?:/(?P<id>[^/?]+))?')
+
+RESPONSE_TEMPLATE = """```json
+{{
+  "processo": {{"numero": "", "comarca": "São Paulo", "vara": "", "foro": "Central"}},
+  "autor": {{"nome": "Autor de Teste", "cpf_cnpj": ""}},
+  "reu": {{"nome": "Ré de Teste Ltda", "cnpj": ""}},
+  "objeto": "Ação de cobrança",
+  "fatos": [],
+  "fundamentos": [],
+  "pedidos": [{{"numero": "1", "descricao": "Pagamento", "valor": ""}}],
+  "documentos": []
+}}
+```
+
+AO JUÍZO DA 1ª VARA CÍVEL DO FORO CENTRAL DA COMARCA DE SÃO PAULO (SP)
+
+CONTESTAÇÃO
+
+PRELIMINARMENTE
+
+1. Falta de interesse de agir, nos termos do artigo 485, inciso VI, do CPC.
+
+DO MÉRITO
+
+{merito}
+
+DOS PEDIDOS
+
+Requer-se a improcedência total dos pedidos.
+
+DOCUMENTOS ANEXOS
+
+1. Procuração
+
+Termos em que,
+Pede deferimento.
+"""
+
+class FakeGeminiConfig:
+    def __init__(self, latency=1.0, jitter=0.2, error_rate=0.0, output_chars=6000,
+                 stream_chunks=8, slow_rate=0.0, slow_factor=5.0, seed=None, min_cache_tokens=0,
+                 exhausted_keys=()):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.output_chars = output_chars
+        self.stream_chunks = stream_chunks
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.min_cache_tokens = min_cache_tokens
+        self.exhausted_keys = set(exhausted_keys)  # chaves que recebem 429 (cota esgotada)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.caches = {}  # nome -> (recurso, expira em, tokens)
+        self.stats = {'requests': 0, 'errors': 0, 'cache_creates': 0, 'cache_hits': 0, 'cache_misses': 0, 'disconnects': 0,
+                      'keys': {}, 'models': {}}
+
+    def draw(self):
+        """Sortear (latência, falhar?) de uma chamada"""
+        with self.lock:
+            self.stats['requests'] += 1
+            latency = max(0.0, self.random.gauss(self.latency, self.jitter))
+            if self.random.random() < self.slow_rate:
+                latency *= self.slow_factor
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.stats['errors'] += 1
+        return latency, fail
+
+def build_response_text(config):
+    merito = ("Os fatos narrados não correspondem à realidade, conforme o artigo 373 do CPC. "
+              * (config.output_chars // 80 + 1))[:config.output_chars]
+    return RESPONSE_TEMPLATE.format(merito=merito)
+
+def make_chunk(text, prompt_chars, final=True):
+    chunk = {
+        'candidates': [{
+            'content': {'parts': [{'text': text}], 'role': 'model'},
+            'index': 0
+        }]
+    }
+    if final:
+        chunk['candidates'][0]['finishReason'] = 'STOP'
+        chunk['usageMetadata'] = {
+            'promptTokenCount': prompt_chars // 4,
+            'candidatesTokenCount': len(text) // 4,
+            'totalTokenCount': (prompt_chars + len(text)) // 4
+        }
+    return chunk
+
+def iso_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def parse_ttl(value):
+    """Converter o TTL da API ('3600s') em segundos"""
+    return float(str(value).rstrip('s')) if value else 3600.0
+
+def make_handler(config):
+    class FakeGeminiHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_not_found(self, message='Not found'):
+            self.send_json(404, {'error': {'code': 404, 'message': message, 'status': 'NOT_FOUND'}})
+
+        def live_cache(self, name):
+            with config.lock:
+                entry = config.caches.get(name)
+                if entry and entry[1] < time.time():
+                    del config.caches[name]
+                    entry = None
+                return entry
+
+        def do_GET(self):
+            if self.path.startswith('/stats'):
+                with config.lock:
+                    return self.send_json(200, json.loads(json.dumps(config.stats)))
+            match = CACHE_PATH_RE.match(self.path)
+            if match and match.group('id'):
+                entry = self.live_cache(f"cachedContents/{match.group('id')}")
+                return self.send_json(200, entry[0]) if entry else self.send_not_found('CachedContent not found')
+            self.send_not_found()
+
+        def do_DELETE(self):
+            match = CACHE_PATH_RE.match(self.path)
+            if match and match.group('id'):
+                with config.lock:
+                    config.caches.pop(f"cachedContents/{match.group('id')}", None)
+                return self.send_json(200, {})
+            self.send_not_found()
+
+        def do_PATCH(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            match = CACHE_PATH_RE.match(self.path)
+            entry = self.live_cache(f"cachedContents/{match.group('id')}") if match and match.group('id') else None
+            if not entry:
+                return self.send_not_found('CachedContent not found')
+            expires = time.time() + parse_ttl(payload.get('ttl'))
+            with config.lock:
+                entry[0]['expireTime'] = iso_time(expires)
+                config.caches[entry[0]['name']] = (entry[0], expires, entry[2])
+            self.send_json(200, entry[0])
+
+        def create_cache(self, payload):
+            """Criar um cachedContent, recusando conteúdos menores que o mínimo configurado"""
+            tokens = len(json.dumps(payload.get('contents', [])) + json.dumps(payload.get('systemInstruction', ''))) // 4
+            if tokens < config.min_cache_tokens:
+                return self.send_json(400, {'error': {
+                    'code': 400, 'status': 'INVALID_ARGUMENT',
+                    'message': f'Cached content is too small. total_token_count={tokens}, min_total_token_count={config.min_cache_tokens}'
+                }})
+            now = time.time()
+            expires = now + parse_ttl(payload.get('ttl'))
+            resource = {
+                'name': f"cachedContents/{uuid.uuid4().hex[:12]}",
+                'model': payload.get('model', ''),
+                'displayName': payload.get('displayName', ''),
+                'createTime': iso_time(now),
+                'updateTime': iso_time(now),
+                'expireTime': iso_time(expires),
+                'usageMetadata': {'totalTokenCount': tokens}
+            }
+            with config.lock:
+                config.caches[resource['name']] = (resource, expires, tokens)
+                config.stats['cache_creates'] += 1
+            self.send_json(200, resource)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length) if length else b''
+            if CACHE_PATH_RE.match(self.path):
+                return self.create_cache(json.loads(body or b'{}'))
+
+            match = MODEL_PATH_RE.match(self.path)
+            if not match:
+                return self.send_not_found()
+
+            api_key = self.headers.get('x-goog-api-key') or parse_qs(urlsplit(self.path).query).get('key', [''])[0]
+            with config.lock:
+                for counter, name in (('keys', api_key), ('models', match.group('model'))):
+                    config.stats[counter][name] = config.stats[counter].get(name, 0) + 1
+            if api_key in config.exhausted_keys:
+                return self.send_json(429, {'error': {
+                    'code': 429, 'status': 'RESOURCE_EXHAUSTED',
+                    'message': 'Resource has been exhausted (e.g. check quota).'
+                }})
+
+            cached_name = json.loads(body or b'{}').get('cachedContent')
+            if cached_name:
+                entry = self.live_cache(cached_name)
+                with config.lock:
+                    config.stats['cache_hits' if entry else 'cache_misses'] += 1
+                if not entry:
+                    return self.send_json(403, {'error': {
+                        'code': 403, 'status': 'PERMISSION_DENIED',
+                        'message': f'CachedContent not found (or permission denied): {cached_name}'
+                    }})
+
+            latency, fail = config.draw()
+            streaming = match.group('method') != 'generateContent'
+            if fail or not streaming:
+                time.sleep(latency)
+            if fail:
+                return self.send_json(500, {'error': {'code': 500, 'message': 'Erro simulado', 'status': 'INTERNAL'}})
+
+            text = build_response_text(config)
+            if not streaming:
+                return self.send_json(200, make_chunk(text, len(body)))
+            self.stream(text, len(body), sse='alt=sse' in self.path, prefill=latency)
+
+        def stream(self, text, prompt_chars, sse, prefill=0.0):
+            """Resposta em partes: SSE (alt=sse) ou array JSON, como a API REST.
+
+            Como na API real, os cabeçalhos saem logo e a primeira parte só depois do
+            tempo de processamento da entrada (prefill).
+            """
+            size = max(1, len(text) // max(1, config.stream_chunks))
+            pieces = [text[i:i + size] for i in range(0, len(text), size)]
+            def write(data):
+                data = data.encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream' if sse else 'application/json; charset=UTF-8')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                self.wfile.flush()
+                time.sleep(prefill)
+                if not sse:
+                    write('[')
+                for index, piece in enumerate(pieces):
+                    chunk = json.dumps(make_chunk(piece, prompt_chars, final=index == len(pieces) - 1))
+                    if sse:
+                        write(f"data: {chunk}\r\n\r\n")
+                    else:
+                        write(('' if index == 0 else ',\n') + chunk)
+                    time.sleep(config.latency / 10 / len(pieces))
+                if not sse:
+                    write(']')
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Cliente cancelou a geração no meio do fluxo
+                with config.lock:
+                    config.stats['disconnects'] += 1
+                self.close_connection = True
+
+    return FakeGeminiHandler
+
+def start_server(port=0, config=None):
+    """Iniciar o servidor em uma thread e retornar (server, url)"""
+    config = config or FakeGeminiConfig()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local que imita a API do Gemini')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=1.0, help='Latência média por chamada (segundos)')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Desvio padrão da latência (segundos)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fração de chamadas que retornam HTTP 500')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Fração de chamadas lentas (cauda)')
+    parser.add_argument('--slow-factor', type=float, default=5.0, help='Multiplicador de latência das chamadas lentas')
+    parser.add_argument('--output-chars', type=int, default=6000, help='Tamanho aproximado da seção de mérito gerada')
+    parser.add_argument('--stream-chunks', type=int, default=8, help='Número de partes em streamGenerateContent')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--min-cache-tokens', type=int, default=0,
+                        help='Tamanho mínimo (tokens estimados) aceito em cachedContents')
+    parser.add_argument('--exhausted-keys', default='', help='Chaves de API que recebem 429, separadas por vírgula')
+    args = parser.parse_args()
+
+    config = FakeGeminiConfig(args.latency, args.jitter, args.error_rate, args.output_chars,
+                              args.stream_chunks, args.slow_rate, args.slow_factor, args.seed,
+                              args.min_cache_tokens, [k for k in args.exhausted_keys.split(',') if k])
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(config))
+    server.daemon_threads = True
+    logger.info(f"Fake Gemini ouvindo em http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import sys
+import time
+import fnmatch
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+
+# Servidor local mínimo compatível com o protocolo do Redis (RESP2), com os
+# comandos usados pelo backend de resultados. Serve para testar vários nós da
+# aplicação compartilhando resultados sem instalar o Redis.
+# Uso: python fake_redis_server.py --port 6390
+# e inicie a aplicação com RESULT_BACKEND=redis RESULT_REDIS_URL=redis://127.0.0.1:6390/0
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+class FakeRedisStore:
+    def __init__(self):
+        self.data = {}     # chave -> bytes ou dict
+        self.expires = {}  # chave -> instante de expiração
+        self.lock = threading.RLock()
+
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and time.time() > expires:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def execute(self, command, args):
+        with self.lock:
+            if command == b'PING':
+                return b'PONG'
+            if command == b'HELLO':
+                # Clientes recentes negociam RESP3; a resposta é um mapa com a versão do protocolo
+                return {b'server': b'redis', b'version': b'7.0.0', b'proto': int(args[0]) if args else 2}
+            if command in (b'CLIENT', b'SELECT'):
+                return b'OK'
+            if command == b'SET':
+                self.data[args[0]] = args[1]
+                self.expires.pop(args[0], None)
+                if len(args) >= 4 and args[2].upper() == b'EX':
+                    self.expires[args[0]] = time.time() + int(args[3])
+                return b'OK'
+            if command == b'GET':
+                return self.data.get(args[0]) if self._alive(args[0]) else None
+            if command == b'HSET':
+                self._alive(args[0])
+                mapping = self.data.setdefault(args[0], {})
+                added = 0
+                for field, value in zip(args[1::2], args[2::2]):
+                    added += field not in mapping
+                    mapping[field] = value
+                return added
+            if command == b'HGET':
+                return self.data[args[0]].get(args[1]) if self._alive(args[0]) else None
+            if command == b'HMGET':
+                mapping = self.data[args[0]] if self._alive(args[0]) else {}
+                return [mapping.get(field) for field in args[1:]]
+            if command == b'EXPIRE':
+                if not self._alive(args[0]):
+                    return 0
+                self.expires[args[0]] = time.time() + int(args[1])
+                return 1
+            if command == b'EXISTS':
+                return sum(1 for key in args if self._alive(key))
+            if command == b'DEL':
+                removed = 0
+                for key in args:
+                    if self._alive(key):
+                        del self.data[key]
+                        self.expires.pop(key, None)
+                        removed += 1
+                return removed
+            if command == b'SCAN':
+                # Uma única página: cursor 0 e todas as chaves que casam com MATCH
+                options = {args[i].upper(): args[i + 1] for i in range(1, len(args) - 1, 2)}
+                pattern = options.get(b'MATCH', b'*').decode('utf-8')
+                keys = [key for key in list(self.data) if self._alive(key) and fnmatch.fnmatchcase(key.decode('utf-8'), pattern)]
+                return [b'0', keys]
+            if command == b'FLUSHDB':
+                self.data.clear()
+                self.expires.clear()
+                return b'OK'
+        raise ValueError(f"unknown command '{command.decode()}'")
+
+def encode(value, proto=2):
+    if value is None:
+        return b'_\r\n' if proto == 3 else b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, dict):
+        return b'%%%d\r\n' % len(value) + b''.join(encode(k, proto) + encode(v, proto) for k, v in value.items())
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode(v, proto) for v in value)
+    if value in (b'OK', b'PONG'):
+        return b'+' + value + b'\r\n'
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+def make_handler(store):
+    class FakeRedisHandler(socketserver.StreamRequestHandler):
+        def read_command(self):
+            line = self.rfile.readline()
+            if not line:
+                return None
+            if not line.startswith(b'*'):
+                return line.split()
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            return args
+
+        def handle(self):
+            self.proto = 2
+            queued = None  # comandos entre MULTI e EXEC
+            while True:
+                args = self.read_command()
+                if not args:
+                    return
+                command = args[0].upper()
+                if command == b'MULTI':
+                    queued = []
+                    reply = encode(b'OK')
+                elif command == b'EXEC' and queued is not None:
+                    with store.lock:
+                        replies = [self.run(c, a) for c, a in queued]
+                    reply = b'*%d\r\n' % len(replies) + b''.join(replies)
+                    queued = None
+                elif command == b'DISCARD' and queued is not None:
+                    queued = None
+                    reply = encode(b'OK')
+                elif queued is not None:
+                    queued.append((command, args[1:]))
+                    reply = b'+QUEUED\r\n'
+                else:
+                    reply = self.run(command, args[1:])
+                self.wfile.write(reply)
+                self.wfile.flush()
+
+        def run(self, command, args):
+            try:
+                value = store.execute(command, args)
+                if command == b'HELLO':
+                    self.proto = value[b'proto']
+                return encode(value, self.proto)
+            except Exception as e:
+                return f"-ERR {e}\r\n".encode('utf-8')
+
+    return FakeRedisHandler
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_server(port=0):
+    """Iniciar o servidor em uma thread e retornar (server, url)"""
+    server = FakeRedisServer(('127.0.0.1', port), make_handler(FakeRedisStore()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"redis://127.0.0.1:{server.server_address[1]}/0"
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local compatível com Redis para testes')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+
+    server = FakeRedisServer(('127.0.0.1', args.port), make_handler(FakeRedisStore()))
+    logger.info(f"Fake Redis ouvindo em redis://127.0.0.1:{args.port}/0")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Teste de carga de ponta a ponta, reproduzível offline:
+#  - inicia o fake_gemini_server.py (latência, streaming e taxa de erro configuráveis)
+#  - inicia N workers da aplicação apontando para ele (GEMINI_API_ENDPOINT)
+#  - envia uploads multipart de PDFs sintéticos com concorrência crescente
+#  - reporta vazão, latências p50/p95/p99, taxa de erro e memória por worker
+# Uso: python loadtest.py --concurrency 1,2,4,8,16 --latency 2.0 --workers 1
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.1)
+    raise RuntimeError(f"Servidor não respondeu em {timeout}s: {url}")
+
+def rss_mb(pid):
+    """Memória residente (MB) de um processo, lida de /proc"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def make_synthetic_pdf(pages):
+    import fitz  # PyMuPDF
+    document = fitz.open()
+    paragraph = ("O autor alega cobrança indevida, requerendo a restituição em dobro dos valores pagos, "
+                 "nos termos do artigo 42 do Código de Defesa do Consumidor. ")
+    for page_num in range(pages):
+        page = document.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), f"Página {page_num + 1}\n" + paragraph * 12, fontsize=9)
+    data = document.tobytes()
+    document.close()
+    return data
+
+def encode_multipart(fields):
+    """Codificar {nome: (arquivo, bytes)} como multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, (filename, data) in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+OPENER = urllib.request.build_opener(NoRedirect)
+
+def send_request(url, peticao, modelo, timeout):
+    """Enviar um par de PDFs (únicos, para não serem deduplicados) e retornar (sucesso, latência)"""
+    nonce = f"\n% {uuid.uuid4().hex}\n".encode('ascii')
+    body, content_type = encode_multipart({
+        'peticao': ('peticao.pdf', peticao + nonce),
+        'modelo': ('modelo.pdf', modelo + nonce),
+    })
+    http_request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    start = time.perf_counter()
+    try:
+        with OPENER.open(http_request, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except urllib.error.HTTPError as e:
+        ok = e.code == 302  # /process redireciona para /resultado em caso de sucesso
+    except Exception:
+        ok = False
+    return ok, time.perf_counter() - start
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+def run_level(urls, concurrency, total, peticao, modelo, timeout, worker_pids):
+    """Executar uma rodada com a concorrência informada"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(send_request, urls[i % len(urls)], peticao, modelo, timeout)
+                   for i in range(total)]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    errors = sum(1 for ok, _ in results if not ok)
+    memory = [m for m in (rss_mb(pid) for pid in worker_pids) if m is not None]
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'throughput_rps': total / elapsed,
+        'p50_s': percentile(latencies, 50),
+        'p95_s': percentile(latencies, 95),
+        'p99_s': percentile(latencies, 99),
+        'mean_s': statistics.mean(latencies) if latencies else None,
+        'error_rate': errors / total,
+        'rss_mb_per_worker': max(memory) if memory else None,
+    }
+
+def fmt(value, spec):
+    return format(value, spec) if value is not None else '-'
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga da aplicação com um Gemini simulado')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='Níveis de concorrência, separados por vírgula')
+    parser.add_argument('--requests-per-level', type=int, default=0, help='Requisições por nível (padrão: 10 x concorrência)')
+    parser.add_argument('--endpoint', default='/api/process', choices=['/api/process', '/process'])
+    parser.add_argument('--workers', type=int, default=1, help='Processos da aplicação (um servidor por processo)')
+    parser.add_argument('--pages', type=int, default=5, help='Páginas da petição sintética')
+    parser.add_argument('--latency', type=float, default=1.0, help='Latência média do Gemini simulado (s)')
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-factor', type=float, default=5.0, help='Multiplicador de latência das chamadas lentas')
+    parser.add_argument('--hedge', action='store_true', help='Ativar o hedging de chamadas lentas (HEDGE_ENABLED=1)')
+    parser.add_argument('--output-chars', type=int, default=6000)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='Gravar o relatório em JSON neste arquivo')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    processes = []
+    try:
+        gemini_port = free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, 'fake_gemini_server.py'), '--port', str(gemini_port),
+             '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+             '--slow-rate', str(args.slow_rate), '--slow-factor', str(args.slow_factor), '--output-chars', str(args.output_chars), '--seed', str(args.seed)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        gemini_url = f"http://127.0.0.1:{gemini_port}"
+        wait_until_ready(f"{gemini_url}/stats")
+
+        env = dict(os.environ, GEMINI_API_KEY='loadtest', GEMINI_API_ENDPOINT=gemini_url,
+                   LOG_LEVEL='WARNING', PYTHONPATH=REPO_DIR)
+        if args.hedge:
+            env['HEDGE_ENABLED'] = '1'
+        urls, worker_pids = [], []
+        for _ in range(args.workers):
+            port = free_port()
+            serve = ("import app; from werkzeug.serving import make_server; "
+                     f"make_server('127.0.0.1', {port}, app.app, threaded=True).serve_forever()")
+            worker = subprocess.Popen([sys.executable, '-c', serve], cwd=workdir, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            processes.append(worker)
+            worker_pids.append(worker.pid)
+            wait_until_ready(f"http://127.0.0.1:{port}/")
+            urls.append(f"http://127.0.0.1:{port}{args.endpoint}")
+
+        peticao = make_synthetic_pdf(args.pages)
+        modelo = make_synthetic_pdf(2)
+
+        report = []
+        print(f"{'conc':>5} {'req':>5} {'rps':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'erro%':>6} {'rss MB':>7}")
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            total = args.requests_per_level or concurrency * 10
+            level = run_level(urls, concurrency, total, peticao, modelo, args.timeout, worker_pids)
+            report.append(level)
+            print(f"{concurrency:>5} {total:>5} {level['throughput_rps']:>8.2f} {fmt(level['p50_s'], '7.2f')} "
+                  f"{fmt(level['p95_s'], '7.2f')} {fmt(level['p99_s'], '7.2f')} {level['error_rate'] * 100:>6.1f} "
+                  f"{fmt(level['rss_mb_per_worker'], '7.1f')}")
+
+        # Custo do hedging (chamadas extras ao Gemini) e efeito na cauda da latência entregue
+        hedge = {}
+        served = {}
+        for url in urls:
+            with urllib.request.urlopen(url.replace(args.endpoint, '/api/metrics'), timeout=10) as response:
+                metrics = json.loads(response.read())
+            for name, value in metrics['counters'].items():
+                if name.startswith('hedge.'):
+                    hedge[name] = hedge.get(name, 0) + value
+            for name, latency in metrics['latencies'].items():
+                if name.startswith('llm.served.'):
+                    served[name] = max(served.get(name, 0.0), latency['p99_s'])
+        if hedge:
+            print('hedging: ' + ', '.join(f"{name.split('.', 1)[1]}={value}" for name, value in sorted(hedge.items())))
+        if served:
+            print('p99 entregue: ' + ', '.join(f"{name.split('.', 2)[2]}={value:.2f}s" for name, value in sorted(served.items())))
+
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'config': vars(args), 'levels': report, 'hedge': hedge, 'served_p99_s': served}, f, indent=2)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1061 @@
+import io
+import os
+import sys
+import gzip
+import time
+import json
+import zipfile
+import datetime
+import logging
+import tempfile
+import threading
+
+import app as app_module
+
+# Configure logging to console
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+FAKE_RESPONSE = """```json
+{
+  "processo": {"numero": "", "comarca": "São Paulo", "vara": "", "foro": "Central"},
+  "autor": {"nome": "João da Silva"},
+  "reu": {"nome": "Empresa ABC Ltda"},
+  "pedidos": [{"numero": "1", "descricao": "Pagamento", "valor": "R$ 10.000,00"}]
+}
+```
+
+EXCELENTÍSSIMO SENHOR DOUTOR JUIZ DE DIREITO DA VARA CÍVEL DA COMARCA DE SÃO PAULO
+
+PRELIMINARMENTE
+
+Não há interesse de agir, pois o pagamento foi realizado antes da propositura da ação.
+
+DO MÉRITO
+
+Os valores cobrados já foram integralmente pagos, conforme comprovantes anexos.
+
+DOS PEDIDOS
+
+Requer-se a improcedência total dos pedidos do autor.
+
+DOCUMENTOS ANEXOS
+
+Procuração
+"""
+
+def setup_app():
+    """Configurar a aplicação com pastas temporárias e chave de teste"""
+    app_module.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    app_module.app.config['RESULT_FOLDER'] = tempfile.mkdtemp()
+    app_module.app.config['TESTING'] = True
+    app_module.GEMINI_API_KEY = 'test-key'
+    app_module._inflight_requests.clear()
+    app_module._completed_requests.clear()
+    app_module._page_cache.clear()
+    app_module.app.config['RESULT_BACKEND'] = 'local'
+    app_module._result_backend = None
+    return app_module.app.test_client()
+
+def upload_data(peticao=b'%PDF-peticao', modelo=b'%PDF-modelo'):
+    return {
+        'peticao': (io.BytesIO(peticao), 'peticao.pdf'),
+        'modelo': (io.BytesIO(modelo), 'modelo.pdf'),
+    }
+
+def test_duplicate_submissions_share_computation():
+    client = setup_app()
+    calls = []
+
+    def slow_process(peticao_path, modelo_path, *args):
+        calls.append(peticao_path)
+        time.sleep(0.3)
+        return FAKE_RESPONSE
+
+    original = app_module.process_pdfs_with_gemini
+    app_module.process_pdfs_with_gemini = slow_process
+    try:
+        responses = []
+
+        def submit():
+            with app_module.app.test_client() as c:
+                responses.append(c.post('/api/process', data=upload_data(),
+                                        content_type='multipart/form-data'))
+
+        threads = [threading.Thread(target=submit) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        result_ids = {r.get_json()['result_id'] for r in responses}
+        assert len(calls) == 1
+        assert len(result_ids) == 1
+
+        # Duplicata após a conclusão recebe o resultado guardado
+        late = client.post('/api/process', data=upload_data(), content_type='multipart/form-data')
+        assert late.get_json()['result_id'] in result_ids
+        assert len(calls) == 1
+    finally:
+        app_module.process_pdfs_with_gemini = original
+
+def test_idempotency_key_reuses_result():
+    client = setup_app()
+    calls = []
+
+    def fake_process(peticao_path, modelo_path, *args):
+        calls.append(peticao_path)
+        return FAKE_RESPONSE
+
+    original = app_module.process_pdfs_with_gemini
+    app_module.process_pdfs_with_gemini = fake_process
+    try:
+        headers = {'Idempotency-Key': 'abc-123'}
+        first = client.post('/api/process', data=upload_data(b'%PDF-a'), headers=headers,
+                            content_type='multipart/form-data')
+        repeated = client.post('/api/process', data=upload_data(b'%PDF-a'), headers=headers,
+                               content_type='multipart/form-data')
+        assert first.get_json()['result_id'] == repeated.get_json()['result_id']
+        assert len(calls) == 1
+
+        # Mesma chave com outros arquivos: conflito, sem devolver o resultado anterior
+        conflict = client.post('/api/process', data=upload_data(b'%PDF-b'), headers=headers,
+                               content_type='multipart/form-data')
+        assert conflict.status_code == 422
+        assert 'result_id' not in conflict.get_json()
+
+        # A chave vale só para o cliente que a enviou
+        other = client.post('/api/process', data=upload_data(b'%PDF-a'), headers=headers,
+                            content_type='multipart/form-data', environ_base={'REMOTE_ADDR': '10.0.0.9'})
+        assert other.get_json()['result_id'] != first.get_json()['result_id']
+        assert len(calls) == 2
+    finally:
+        app_module.process_pdfs_with_gemini = original
+
+def test_duplicate_with_other_mode_or_policy_is_processed_again():
+    client = setup_app()
+    modes = []
+
+    def fake_process(peticao_path, modelo_path, mode, *args):
+        modes.append(mode)
+        return FAKE_RESPONSE
+
+    original = app_module.process_pdfs_with_gemini
+    app_module.process_pdfs_with_gemini = fake_process
+    try:
+        post = lambda **form: client.post('/api/process', data=dict(upload_data(b'%PDF-modos'), **form),
+                                          content_type='multipart/form-data').get_json()['result_id']
+        single = post(modo='single')
+        assert post(modo='single') == single and modes == ['single']
+        parallel = post(modo='parallel')
+        assert parallel != single and modes == ['single', 'parallel']
+        assert post(modo='parallel', admissao='reject') not in (single, parallel)
+        assert len(modes) == 3
+    finally:
+        app_module.process_pdfs_with_gemini = original
+
+def test_completed_duplicate_is_loaded_outside_dedup_lock():
+    setup_app()
+    result_id = app_module.save_result_to_file(FAKE_RESPONSE)
+    app_module._completed_requests['k'] = (result_id, time.time(), 'conteudo')
+    original = app_module.get_result_from_file
+    locked = []
+
+    def load(result_id):
+        locked.append(app_module._dedup_lock.locked())
+        return original(result_id)
+
+    app_module.get_result_from_file = load
+    try:
+        assert app_module.run_single_flight('k', lambda: None, 'conteudo') == (FAKE_RESPONSE, result_id)
+        assert locked == [False]
+    finally:
+        app_module.get_result_from_file = original
+
+def test_regenerate_section_splices_only_that_section():
+    client = setup_app()
+    result_id = app_module.save_result_to_file(FAKE_RESPONSE)
+    prompts = []
+
+    def fake_call_gemini(contents, **kwargs):
+        prompts.append(contents)
+        return "DO MÉRITO\n\nO autor não comprovou o alegado dano."
+
+    original = app_module.call_gemini
+    app_module.call_gemini = fake_call_gemini
+    try:
+        response = client.post('/api/regenerate_section',
+                               json={'result_id': result_id, 'section': 'Do Mérito'})
+        assert response.status_code == 200
+        updated = app_module.get_result_from_file(result_id)
+        assert "O autor não comprovou o alegado dano." in updated
+        assert "Os valores cobrados já foram integralmente pagos" not in updated
+        assert "Não há interesse de agir" in updated
+        assert "Requer-se a improcedência total" in updated
+        # Só o JSON e as seções vizinhas são enviados, não a petição inteira
+        assert any("SEÇÃO ANTERIOR" in part for part in prompts[0])
+        assert [s['title'] for s in response.get_json()['contestacao_sections']] == \
+            ['PRELIMINARMENTE', 'DO MÉRITO', 'DOS PEDIDOS', 'DOCUMENTOS ANEXOS']
+
+        missing = client.post('/api/regenerate_section',
+                              json={'result_id': result_id, 'section': 'DA CONCLUSÃO'})
+        assert missing.status_code == 404
+    finally:
+        app_module.call_gemini = original
+
+def test_regenerate_last_section_keeps_closing():
+    client = setup_app()
+    closing = "Termos em que,\nPede deferimento.\n\nSão Paulo, 10 de março de 2025.\n\nAdvogado - OAB/SP 123.456\n"
+    result_id = app_module.save_result_to_file(FAKE_RESPONSE.rstrip('\n') + "\n\n" + closing)
+
+    original = app_module.call_gemini
+    app_module.call_gemini = lambda contents, **kwargs: "DOCUMENTOS ANEXOS\n\n1. Procuração"
+    try:
+        response = client.post('/api/regenerate_section',
+                               json={'result_id': result_id, 'section': 'DOCUMENTOS ANEXOS'})
+        assert response.status_code == 200
+        updated = app_module.get_result_from_file(result_id)
+        assert updated.endswith("DOCUMENTOS ANEXOS\n\n1. Procuração\n\n" + closing)
+        assert "Requer-se a improcedência total" in updated
+    finally:
+        app_module.call_gemini = original
+
+def test_section_heading_accepts_numbered_or_punctuated_title():
+    ensure = app_module.ensure_section_heading
+    for first_line in ("DO MÉRITO", "DO MÉRITO:", "II - DO MÉRITO", "2. Do Mérito", "**II – DO MÉRITO:**"):
+        assert ensure(f"{first_line}\n\nO autor não comprovou o dano.", "DO MÉRITO") == \
+            "DO MÉRITO\n\nO autor não comprovou o dano."
+    assert ensure("O autor não comprovou o dano.", "DO MÉRITO") == "DO MÉRITO\n\nO autor não comprovou o dano."
+    assert ensure("DOS PEDIDOS\n\nImprocedência.", "DO MÉRITO").startswith("DO MÉRITO\n\nDOS PEDIDOS")
+
+def test_parallel_generation_matches_single_shot_format():
+    setup_app()
+
+    def fake_call_gemini(contents, **kwargs):
+        if contents[0] is app_module.EXTRACTION_PROMPT:
+            return FAKE_RESPONSE.split("```\n", 1)[0] + "```"
+        title = next(t for t, _, _ in app_module.PARALLEL_SECTIONS if f'"{t}"' in contents[1])
+        if title == "CABEÇALHO":
+            return "EXCELENTÍSSIMO SENHOR DOUTOR JUIZ DE DIREITO\n\nCONTESTAÇÃO"
+        return f"Texto da seção {title} gerado em paralelo."
+
+    original = app_module.call_gemini
+    app_module.call_gemini = fake_call_gemini
+    try:
+        result = app_module.generate_contestacao_parallel("texto da petição", "texto do modelo")
+        json_data, contestacao = app_module.extract_json_and_contestacao(result)
+        assert json_data['autor']['nome'] == "João da Silva"
+        assert contestacao.startswith("EXCELENTÍSSIMO")
+        titles = [s['title'] for s in app_module.parse_contestacao_sections(contestacao)]
+        assert titles == ['PRELIMINARMENTE', 'DO MÉRITO', 'DOS PEDIDOS', 'DOCUMENTOS ANEXOS']
+    finally:
+        app_module.call_gemini = original
+
+def test_resultado_page_is_cached_compressed_and_conditional():
+    client = setup_app()
+    result_id = app_module.save_result_to_file(FAKE_RESPONSE)
+
+    first = client.get(f'/resultado?id={result_id}', headers={'Accept-Encoding': 'gzip'})
+    assert first.status_code == 200
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert 'Empresa ABC Ltda' in gzip.decompress(first.data).decode('utf-8')
+    etag = first.headers['ETag']
+
+    # Revalidação com o mesmo ETag retorna 304 sem corpo
+    again = client.get(f'/resultado?id={result_id}',
+                       headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    # Uma nova versão do resultado invalida a página em cache
+    time.sleep(0.01)
+    app_module.save_result_to_file(FAKE_RESPONSE.replace('Empresa ABC Ltda', 'Empresa XYZ Ltda'), result_id)
+    updated = client.get(f'/resultado?id={result_id}', headers={'If-None-Match': etag})
+    assert updated.status_code == 200
+    assert 'Empresa XYZ Ltda' in updated.data.decode('utf-8')
+
+def test_downloads_are_private_and_only_static_is_cached_long():
+    client = setup_app()
+    query = {'secoes': json.dumps([{'titulo': 'DO MÉRITO', 'paragrafos': ['Texto.']}])}
+    for path in ('/download/docx', '/download/txt'):
+        response = client.get(path, query_string=query)
+        assert response.status_code == 200
+        assert response.cache_control.private and response.cache_control.no_store
+        assert not response.cache_control.public and not response.cache_control.max_age
+
+    static_folder = app_module.app.static_folder
+    os.makedirs(static_folder, exist_ok=True)
+    path = os.path.join(static_folder, 'teste-cache.css')
+    with open(path, 'w') as f:
+        f.write('body {}')
+    try:
+        response = client.get('/static/teste-cache.css')
+        assert response.cache_control.public and response.cache_control.max_age == 365 * 24 * 3600
+        response.close()
+    finally:
+        os.remove(path)
+        if not os.listdir(static_folder):
+            os.rmdir(static_folder)
+
+def write_autos_pdf(path, toc=False):
+    """PDF de autos: petição nas páginas 1-3, seguida de procuração e decisões"""
+    import fitz  # PyMuPDF
+    document = fitz.open()
+    pages = [
+        "EXCELENTÍSSIMO SENHOR DOUTOR JUIZ DE DIREITO",
+        "DOS FATOS - o autor alega cobrança indevida",
+        "DOS PEDIDOS - Termos em que, pede deferimento.",
+        "PROCURAÇÃO AD JUDICIA",
+        "DECISÃO - cite-se a parte ré",
+    ]
+    for page_text in pages:
+        document.new_page().insert_text((72, 72), page_text)
+    if toc:
+        document.set_toc([[1, "Petição Inicial", 1], [1, "Procuração", 4], [1, "Decisão", 5]])
+    document.save(path)
+    document.close()
+
+def test_autos_extracts_only_peticao_pages():
+    setup_app()
+    for toc in (False, True):
+        path = os.path.join(tempfile.mkdtemp(), 'autos.pdf')
+        write_autos_pdf(path, toc)
+        text = app_module.extract_text_from_pdf(path, 'auto')
+        assert "DOS FATOS" in text and "Termos em que" in text
+        assert "PROCURAÇÃO" not in text and "DECISÃO" not in text
+
+    assert app_module.extract_text_from_pdf(path, (4, 4)).strip() == "PROCURAÇÃO AD JUDICIA"
+    assert app_module.parse_page_range("2-10") == (2, 10)
+
+def test_autos_mode_accepts_larger_uploads_streamed_to_disk():
+    client = setup_app()
+    app_module.app.config['MAX_CONTENT_LENGTH'] = 1024
+    received = []
+
+    def fake_process(peticao_path, modelo_path, mode=None, peticao_pages=None, texts=None):
+        received.append(peticao_pages)
+        return FAKE_RESPONSE
+
+    original = app_module.process_pdfs_with_gemini
+    app_module.process_pdfs_with_gemini = fake_process
+    try:
+        big = b'%PDF-' + b'0' * 4096
+        rejected = client.post('/api/process', data=upload_data(big), content_type='multipart/form-data')
+        assert rejected.status_code == 413
+
+        accepted = client.post('/api/process?autos=1', data=upload_data(big), content_type='multipart/form-data')
+        assert accepted.status_code == 200
+        assert received == ['auto']
+        # Arquivos parciais do upload não ficam para trás
+        assert os.listdir(app_module.app.config['UPLOAD_FOLDER']) == []
+    finally:
+        app_module.process_pdfs_with_gemini = original
+        app_module.app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+
+PETICAO_TEXT = """EXCELENTÍSSIMO SENHOR DOUTOR JUIZ DE DIREITO DA 2ª VARA CÍVEL DO FORO CENTRAL DA COMARCA DE SÃO PAULO - SP
+Processo n.º 1001234-54.2024.8.26.0100
+JOÃO DA SILVA, CPF 529.982.247-25, por seu advogado (OAB/SP 123.456), em face de
+EMPRESA ABC LTDA, CNPJ 11.222.333/0001-81, cobrando R$ 10.000,00 com base no art. 186 do Código Civil.
+Documento inválido mencionado: 111.111.111-11.
+"""
+
+def test_known_facts_are_validated_and_prefilled():
+    setup_app()
+    assert app_module.is_valid_cnj("1001234-54.2024.8.26.0100")
+    assert not app_module.is_valid_cnj("1001234-55.2024.8.26.0100")
+    assert app_module.is_valid_cpf("529.982.247-25") and not app_module.is_valid_cpf("111.111.111-11")
+    assert app_module.is_valid_cnpj("11.222.333/0001-81") and not app_module.is_valid_cnpj("11.222.333/0001-82")
+
+    facts = app_module.extract_known_facts(PETICAO_TEXT)
+    assert facts['numero_processo'] == "1001234-54.2024.8.26.0100"
+    assert facts['comarca'] == "SÃO PAULO"
+    assert facts['cpfs'] == ["529.982.247-25"]
+    assert facts['oabs'] == ["OAB/SP 123.456"]
+    assert facts['valores'] == ["R$ 10.000,00"]
+    assert facts['artigos'] == ["art. 186 Código Civil"]
+
+    sent = []
+
+    def fake_call_gemini(contents, **kwargs):
+        sent.append(contents)
+        return FAKE_RESPONSE
+
+    original = app_module.call_gemini
+    app_module.call_gemini = fake_call_gemini
+    try:
+        path = os.path.join(tempfile.mkdtemp(), 'peticao.pdf')
+        import fitz  # PyMuPDF
+        document = fitz.open()
+        document.new_page().insert_text((36, 72), PETICAO_TEXT, fontsize=8)
+        document.save(path)
+        document.close()
+
+        result = app_module.process_pdfs_with_gemini(path, path, 'single')
+        json_data, _ = app_module.extract_json_and_contestacao(result)
+        assert json_data['processo']['numero'] == "1001234-54.2024.8.26.0100"
+        assert json_data['autor']['cpf_cnpj'] == "529.982.247-25"
+        assert any("DADOS JÁ IDENTIFICADOS" in part for part in sent[0])
+    finally:
+        app_module.call_gemini = original
+
+
+def test_cited_case_law_number_does_not_override_processo():
+    setup_app()
+    # Jurisprudência citada sem rótulo: só preenche se o modelo deixou o número vazio ou inválido
+    text = "Nesse sentido: TJSP, Apelação 1001234-54.2024.8.26.0100, Rel. Des. Fulano."
+    facts = app_module.extract_known_facts(text)
+    assert facts['numero_processo'] == "1001234-54.2024.8.26.0100" and not facts['numero_rotulado']
+
+    own_number = next(f"0000001-{dv:02d}.2023.8.26.0100" for dv in range(100)
+                      if app_module.is_valid_cnj(f"0000001-{dv:02d}.2023.8.26.0100"))
+    data = app_module.apply_known_facts({'processo': {'numero': own_number}}, facts)
+    assert data['processo']['numero'] == own_number
+    data = app_module.apply_known_facts({'processo': {'numero': '123'}}, facts)
+    assert data['processo']['numero'] == "1001234-54.2024.8.26.0100"
+
+    # Número rotulado ("autos nº") vence a jurisprudência citada antes dele e o número do modelo
+    facts = app_module.extract_known_facts(text + f" Nos autos nº {own_number}, o autor alega...")
+    assert facts['numero_processo'] == own_number and facts['numero_rotulado']
+    data = app_module.apply_known_facts({'processo': {'numero': "1001234-54.2024.8.26.0100"}}, facts)
+    assert data['processo']['numero'] == own_number
+
+def test_known_facts_comarca_and_oab_variants():
+    setup_app()
+    facts = app_module.extract_known_facts(
+        "Sentença proferida pelo juízo da comarca de São Paulo que julgou procedente o pedido. "
+        "Advogado inscrito na OAB/SP sob o nº 266.795."
+    )
+    assert facts['comarca'] == "São Paulo"
+    assert facts['oabs'] == ["OAB/SP 266.795"]
+
+    facts = app_module.extract_known_facts("Foro da Comarca de Santana de Parnaíba, Estado de São Paulo")
+    assert facts['comarca'] == "Santana de Parnaíba"
+
+def test_redis_backend_shares_results_between_nodes():
+    try:
+        import redis  # noqa: F401 (dependência opcional)
+    except ImportError:
+        logger.warning("Pacote redis não instalado; teste ignorado")
+        return
+    import fake_redis_server
+
+    server, url = fake_redis_server.start_server()
+    try:
+        node_a = app_module.CachedResultBackend(app_module.RedisResultBackend(url, 60), size=8, ttl=30)
+        node_b = app_module.CachedResultBackend(app_module.RedisResultBackend(url, 60), size=8, ttl=30)
+        version = node_a.save('abc-1', FAKE_RESPONSE)
+        assert node_b.load('abc-1') == (FAKE_RESPONSE, version)
+        assert node_b.version('abc-1') == version
+        assert node_b.load('missing') == (None, None)
+        assert node_b.list_ids(0, version + 1) == ['abc-1']
+        assert node_b.list_ids(version + 1, version + 2) == []
+
+        # Leituras repetidas são servidas pelo LRU local, sem ida ao servidor
+        server.shutdown()
+        server.server_close()
+        assert node_b.load('abc-1')[0] == FAKE_RESPONSE
+
+        client = setup_app()
+        server, url = fake_redis_server.start_server()
+        app_module.app.config['RESULT_BACKEND'] = 'redis'
+        app_module.app.config['RESULT_REDIS_URL'] = url
+        result_id = app_module.save_result_to_file(FAKE_RESPONSE)
+        app_module._result_backend = None  # simula outro nó, com o LRU vazio
+        response = client.get(f'/resultado?id={result_id}')
+        assert response.status_code == 200
+        assert 'Empresa ABC Ltda' in response.data.decode('utf-8')
+        assert os.listdir(app_module.app.config['RESULT_FOLDER']) == []
+    finally:
+        server.shutdown()
+        server.server_close()
+        app_module.app.config['RESULT_BACKEND'] = 'local'
+        app_module._result_backend = None
+
+def test_shared_folder_backend_writes_atomically():
+    setup_app()
+    folder = tempfile.mkdtemp()
+    backend = app_module.FileResultBackend(folder)
+    version = backend.save('abc-2', FAKE_RESPONSE)
+    assert backend.load('abc-2') == (FAKE_RESPONSE, version)
+    assert os.listdir(folder) == ['abc-2.txt']
+    assert app_module.get_result_from_file('../etc/passwd') is None
+
+def use_fake_gemini(config):
+    """Apontar o SDK e os clientes do Gemini para um fake_gemini_server local; retorna o servidor"""
+    import fake_gemini_server
+    server, url = fake_gemini_server.start_server(config=config)
+    app_module.GEMINI_API_ENDPOINT = url
+    app_module._genai = None
+    app_module._gemini_key_pool = None
+    return server
+
+def restore_gemini(server):
+    server.shutdown()
+    server.server_close()
+    app_module.GEMINI_API_ENDPOINT = None
+    app_module._genai = None
+    app_module._gemini_key_pool = None
+    app_module._context_caches.clear()
+
+def test_context_cache_reuses_prompt_and_modelo_prefix():
+    import fake_gemini_server
+    setup_app()
+    app_module._context_caches.clear()
+    server = use_fake_gemini(fake_gemini_server.FakeGeminiConfig(latency=0, jitter=0))
+    try:
+        prefix = [app_module.PROMPT, "### MODELO DE CONTESTAÇÃO:\nmodelo"]
+        for peticao in ("petição A", "petição B"):
+            assert app_module.call_gemini(prefix + [peticao], cached_prefix=2)
+        stats = server.config.stats
+        assert stats['cache_creates'] == 1 and stats['cache_hits'] == 2
+
+        # Cache removido no provedor: a chamada segue inline e o cache é recriado na próxima
+        server.config.caches.clear()
+        assert app_module.call_gemini(prefix + ["petição C"], cached_prefix=2)
+        assert app_module.call_gemini(prefix + ["petição D"], cached_prefix=2)
+        assert stats['cache_creates'] == 2
+    finally:
+        restore_gemini(server)
+
+def test_context_cache_falls_back_inline_when_unavailable():
+    import fake_gemini_server
+    setup_app()
+    app_module._context_caches.clear()
+    server = use_fake_gemini(fake_gemini_server.FakeGeminiConfig(latency=0, jitter=0, min_cache_tokens=10 ** 6))
+    try:
+        prefix = [app_module.PROMPT, "### MODELO DE CONTESTAÇÃO:\nmodelo"]
+        assert app_module.call_gemini(prefix + ["petição"], cached_prefix=2)
+        assert app_module.call_gemini(prefix + ["petição"], cached_prefix=2)
+        assert server.config.stats['cache_creates'] == 0
+        assert server.config.stats['requests'] == 2
+        assert app_module.metrics_snapshot()['counters']['context_cache.unavailable'] >= 1
+    finally:
+        restore_gemini(server)
+
+def test_context_cache_evicts_expired_and_least_used_prefixes():
+    import fake_gemini_server
+    setup_app()
+    app_module._context_caches.clear()
+    app_module._context_cache_key_locks.clear()
+    server = use_fake_gemini(fake_gemini_server.FakeGeminiConfig(latency=0, jitter=0, min_cache_tokens=10 ** 6))
+    app_module.app.config['CONTEXT_CACHE_SIZE'] = 2
+    try:
+        for modelo in ("modelo A", "modelo B", "modelo C"):
+            app_module.get_context_cache([app_module.PROMPT, modelo])
+        assert len(app_module._context_caches) == 2
+        assert set(app_module._context_cache_key_locks) == set(app_module._context_caches)
+
+        # Prefixo expirado: descartado com o seu lock quando outro é criado
+        expired = next(reversed(app_module._context_caches))
+        app_module._context_caches[expired]['expires'] = 0
+        app_module.get_context_cache([app_module.PROMPT, "modelo D"])
+        assert expired not in app_module._context_caches
+        assert expired not in app_module._context_cache_key_locks
+        assert len(app_module._context_caches) == 2
+    finally:
+        app_module.app.config['CONTEXT_CACHE_SIZE'] = 64
+        restore_gemini(server)
+
+def test_bulk_export_streams_zip_of_documents():
+    client = setup_app()
+    first = app_module.save_result_to_file(FAKE_RESPONSE)
+    second = app_module.save_result_to_file(FAKE_RESPONSE.replace('Empresa ABC Ltda', 'Empresa XYZ S.A.'))
+
+    response = client.post('/api/export', json={'ids': [first, second, 'f00d']})
+    assert response.status_code == 200
+    assert response.is_streamed
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    names = set(archive.namelist())
+    assert names == {f'contestacao_{first}.docx', f'contestacao_{first}.txt',
+                     f'contestacao_{second}.docx', f'contestacao_{second}.txt', 'erros.txt'}
+    assert 'Empresa XYZ S.A.' in archive.read(f'contestacao_{second}.txt').decode('utf-8')
+    assert 'f00d: resultado não encontrado' in archive.read('erros.txt').decode('utf-8')
+    assert archive.read(f'contestacao_{first}.docx').startswith(b'PK')
+
+    # Intervalo de datas: resultados salvos hoje, apenas TXT
+    hoje = datetime.date.today().isoformat()
+    response = client.post('/api/export', data={'de': hoje, 'ate': hoje, 'formatos': 'txt'})
+    assert response.status_code == 200
+    assert sorted(zipfile.ZipFile(io.BytesIO(response.get_data())).namelist()) == sorted(
+        [f'contestacao_{first}.txt', f'contestacao_{second}.txt'])
+
+    assert client.post('/api/export', json={'de': '2000-01-01'}).status_code == 404
+    assert client.post('/api/export', json={'ids': ['../etc']}).status_code == 400
+    assert client.post('/api/export', json={'ids': [first], 'formatos': ['pdf']}).status_code == 400
+
+def test_api_fields_and_compact_references():
+    client = setup_app()
+    original = app_module.process_pdfs_with_gemini
+    app_module.process_pdfs_with_gemini = lambda *args: FAKE_RESPONSE
+    try:
+        # Padrão: resposta completa, como antes
+        full = client.post('/api/process', data=upload_data(b'%PDF-f1'), content_type='multipart/form-data').get_json()
+        assert set(full) == {'result', 'json_data', 'contestacao', 'result_id'}
+
+        selected = client.post('/api/process?fields=result_id,json_data', data=upload_data(b'%PDF-f2'),
+                               content_type='multipart/form-data').get_json()
+        assert set(selected) == {'result_id', 'json_data'}
+        assert selected['json_data']['reu']['nome'] == 'Empresa ABC Ltda'
+
+        invalid = client.post('/api/process?fields=result,foo', data=upload_data(b'%PDF-f3'),
+                              content_type='multipart/form-data')
+        assert invalid.status_code == 400
+
+        # Compacto: referências às seções, legíveis com Range em /api/results/<id>
+        compact = client.post('/api/process?compact=1', data=upload_data(b'%PDF-f4'),
+                              content_type='multipart/form-data').get_json()
+        assert 'result' not in compact and 'contestacao' not in compact
+        refs = compact['referencias']
+        body = FAKE_RESPONSE.encode('utf-8')
+        assert refs['tamanho'] == len(body)
+        merito = next(s for s in refs['secoes'] if s['titulo'] == 'DO MÉRITO')
+        ranged = client.get(f"/api/results/{compact['result_id']}",
+                            headers={'Range': f"bytes={merito['inicio']}-{merito['fim'] - 1}"})
+        assert ranged.status_code == 206
+        assert ranged.data == body[merito['inicio']:merito['fim']]
+        assert ranged.data.decode('utf-8').startswith('DO MÉRITO')
+        assert body[refs['contestacao']['inicio']:].decode('utf-8').startswith('EXCELENTÍSSIMO')
+        assert client.get('/api/results/f00d').status_code == 404
+    finally:
+        app_module.process_pdfs_with_gemini = original
+
+def test_result_text_etag_differs_per_encoding():
+    client = setup_app()
+    text = FAKE_RESPONSE + "Os fatos não correspondem à realidade. " * 100
+    result_id = app_module.save_result_to_file(text)
+    url = f"/api/results/{result_id}"
+
+    plain = client.get(url, headers={'Accept-Encoding': 'identity'})
+    zipped = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers and plain.data == text.encode('utf-8')
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.data) == plain.data
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+    assert 'Accept-Encoding' in zipped.headers['Vary']
+
+    # 304 só para a mesma variante
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']}).status_code == 304
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']}).status_code == 200
+
+    # Range vale sobre o texto sem compressão; If-Range com a ETag comprimida devolve o texto inteiro
+    ranged = client.get(url, headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-6', 'If-Range': plain.headers['ETag']})
+    assert ranged.status_code == 206 and ranged.data == b'```json'
+    stale = client.get(url, headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-6', 'If-Range': zipped.headers['ETag']})
+    assert stale.status_code == 200 and 'Content-Encoding' not in stale.headers
+    assert stale.data == plain.data and stale.headers['ETag'] == plain.headers['ETag']
+
+def test_large_api_response_is_streamed_and_compressed():
+    client = setup_app()
+    large = FAKE_RESPONSE + "Os fatos não correspondem à realidade. " * 20000
+    original = app_module.process_pdfs_with_gemini
+    app_module.process_pdfs_with_gemini = lambda *args: large
+    try:
+        response = client.post('/api/process', data=upload_data(b'%PDF-large'), content_type='multipart/form-data',
+                               headers={'Accept-Encoding': 'gzip'})
+        assert response.is_streamed
+        assert response.headers['Content-Encoding'] == 'gzip'
+        payload = json.loads(gzip.decompress(response.get_data()).decode('utf-8'))
+        assert payload['result'] == large
+        assert payload['contestacao'].endswith('realidade.')
+    finally:
+        app_module.process_pdfs_with_gemini = original
+
+def test_scheduler_prioritizes_interactive_and_shares_bulk_fairly():
+    scheduler = app_module.LLMScheduler(max_concurrency=2, interactive_reserved=1, weights={'a': 1, 'b': 1})
+    scheduler.acquire('bulk', 'a')  # ocupa a única vaga do tráfego em lote
+    order = []
+
+    def bulk(tenant):
+        scheduler.acquire('bulk', tenant)
+        order.append(tenant)
+        scheduler.release('bulk')
+
+    threads = []
+    for tenant in ('a', 'a', 'b'):
+        threads.append(threading.Thread(target=bulk, args=(tenant,)))
+        threads[-1].start()
+        while scheduler.snapshot()['queued']['bulk'] < len(threads):
+            time.sleep(0.005)
+
+    # A vaga reservada atende o tráfego interativo sem esperar o lote
+    assert scheduler.acquire('interactive', 'c') < 0.1
+    scheduler.release('interactive')
+
+    scheduler.release('bulk')
+    for t in threads:
+        t.join()
+    # O cliente b não espera atrás de todos os pedidos já enfileirados por a
+    assert order == ['b', 'a', 'a']
+    assert app_module.metrics_snapshot()['latencies']['scheduler.wait.bulk']['count'] >= 4
+
+    client = setup_app()
+    assert 'scheduler' in client.get('/api/metrics').get_json()
+
+def test_tenant_uses_only_recognised_api_keys():
+    setup_app()
+    config = app_module.app.config
+    config['LLM_TENANT_WEIGHTS'] = 'chave-a=3,10.0.0.5=2'
+    app_module._llm_scheduler = None
+    try:
+        tenant = lambda **headers: app_module.app.test_request_context(
+            '/api/process', headers=headers, environ_base={'REMOTE_ADDR': '10.0.0.9'})
+        with tenant(**{'X-API-Key': 'chave-a'}):
+            assert app_module.request_tenant() == 'chave-a'
+        # Chave inventada ou IP de outro cliente no header: vale o IP de origem
+        for value in ('chave-inventada', '10.0.0.5'):
+            with tenant(**{'X-API-Key': value}):
+                assert app_module.request_tenant() == '10.0.0.9'
+        with tenant():
+            assert app_module.request_tenant() == '10.0.0.9'
+    finally:
+        config['LLM_TENANT_WEIGHTS'] = ''
+        app_module._llm_scheduler = None
+
+def pdf_upload_data(tag):
+    """Par de PDFs reais (petição e modelo), distintos por tag para não serem deduplicados"""
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, 'autos.pdf')
+    write_autos_pdf(path)
+    with open(path, 'rb') as f:
+        data = f.read() + f"\n% {tag}\n".encode('ascii')
+    return upload_data(data, data)
+
+def wait_until(predicate, timeout=8):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+def wait_for_counter(name, minimum=1, timeout=8):
+    return wait_until(lambda: app_module.metrics_snapshot()['counters'].get(name, 0) >= minimum, timeout)
+
+def test_deadline_cancels_gemini_call_and_frees_capacity():
+    import fake_gemini_server
+    client = setup_app()
+    server = use_fake_gemini(fake_gemini_server.FakeGeminiConfig(latency=0, jitter=0))
+    try:
+        # Dentro do prazo, a chamada em streaming retorna normalmente
+        response = client.post('/api/process', data=pdf_upload_data('ok'), content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert 'CONTESTAÇÃO' in response.get_json()['contestacao']
+
+        # Prazo menor que a latência do Gemini (que já enviou os cabeçalhos e ainda processa a
+        # entrada): a requisição termina no prazo, sem resultado guardado
+        server.config.latency = 3
+        saved = set(os.listdir(app_module.app.config['RESULT_FOLDER']))
+        start = time.perf_counter()
+        response = client.post('/api/process', data=pdf_upload_data('slow'), content_type='multipart/form-data',
+                               headers={'X-Request-Timeout': '0.5'})
+        assert response.status_code == 504
+        assert time.perf_counter() - start < 2
+        assert set(os.listdir(app_module.app.config['RESULT_FOLDER'])) == saved
+        assert wait_for_counter('cancelled.requests.deadline')
+        # O fluxo com o Gemini é fechado antes da primeira parte, e só então a vaga no
+        # agendador e a reserva da chave são devolvidas (bem antes dos 3s do provedor)
+        assert wait_for_counter('cancelled.llm_calls.in_flight', timeout=1)
+        assert wait_until(lambda: app_module.get_llm_scheduler().snapshot()['running'] == {'interactive': 0, 'bulk': 0}, 1)
+        assert wait_until(lambda: not any(k['in_flight'] for k in app_module.get_gemini_key_pool().snapshot()), 1)
+        assert time.perf_counter() - start < 2
+    finally:
+        restore_gemini(server)
+
+def test_deadline_during_extraction_closes_pdf():
+    import fitz
+    setup_app()
+    path = os.path.join(tempfile.mkdtemp(), 'autos.pdf')
+    write_autos_pdf(path)
+    opened = []
+    original = fitz.open
+    fitz.open = lambda *args, **kwargs: opened.append(original(*args, **kwargs)) or opened[-1]
+    token = app_module._request_deadline.set(app_module.RequestDeadline(0))
+    try:
+        app_module.extract_text_from_pdf(path)
+        raise AssertionError('a extração deveria ter sido cancelada pelo prazo')
+    except app_module.DeadlineExceeded:
+        pass
+    finally:
+        app_module._request_deadline.reset(token)
+        fitz.open = original
+    assert len(opened) == 1 and opened[0].is_closed
+
+def test_cancellation_closes_stream_before_first_chunk():
+    setup_app()
+
+    class BlockingStream:
+        """Fluxo como o do gRPC: nenhuma parte até o fim do prefill, e cancel() o interrompe"""
+        def __init__(self):
+            self.cancelled = threading.Event()
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            self.cancelled.wait(10)
+            raise RuntimeError('Locally cancelled by application!')
+
+        def cancel(self):
+            self.cancelled.set()
+
+    class BlockingClient:
+        def __init__(self):
+            self.streams = []
+
+        def stream_generate_content(self, request, **kwargs):
+            self.streams.append(BlockingStream())
+            return self.streams[-1]
+
+    client = BlockingClient()
+    app_module._gemini_key_pool = None
+    app_module.get_gemini_key_pool().keys[0]._client = client
+    deadline = app_module.RequestDeadline(0.3)
+    token = app_module._request_deadline.set(deadline)
+    start = time.perf_counter()
+    try:
+        app_module.call_gemini(['petição'], kind='cancelamento-teste')
+        raise AssertionError('a chamada deveria ter sido cancelada pelo prazo')
+    except app_module.DeadlineExceeded:
+        pass
+    finally:
+        app_module._request_deadline.reset(token)
+        app_module._gemini_key_pool = None
+    # O próprio fluxo da chamada foi cancelado antes de qualquer parte, e a vaga voltou em seguida
+    assert client.streams and client.streams[0].cancelled.wait(1)
+    assert wait_until(lambda: app_module.get_llm_scheduler().snapshot()['running'] == {'interactive': 0, 'bulk': 0}, 1)
+    assert time.perf_counter() - start < 2
+
+def test_client_disconnect_cancels_processing():
+    import http.client
+    import fake_gemini_server
+    from werkzeug.serving import make_server
+    setup_app()
+    gemini = use_fake_gemini(fake_gemini_server.FakeGeminiConfig(latency=5, jitter=0))
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        before = app_module.metrics_snapshot()['counters'].get('cancelled.requests.disconnect', 0)
+        boundary = 'limite123'
+        body = b''
+        for name, (stream, filename) in pdf_upload_data('disconnect').items():
+            body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/pdf\r\n\r\n').encode('utf-8') + stream.read() + b'\r\n'
+        body += f'--{boundary}--\r\n'.encode('utf-8')
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=10)
+        connection.request('POST', '/api/process', body=body,
+                           headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        time.sleep(0.5)
+        connection.close()  # usuário fechou a aba
+        assert wait_for_counter('cancelled.requests.disconnect', before + 1, timeout=3)
+    finally:
+        server.shutdown()
+        restore_gemini(gemini)
+
+def test_slow_gemini_call_is_hedged_within_budget():
+    import fake_gemini_server
+    setup_app()
+    server = use_fake_gemini(fake_gemini_server.FakeGeminiConfig(latency=0, jitter=0))
+    config = app_module.app.config
+    config.update(HEDGE_ENABLED=True, HEDGE_MIN_SAMPLES=5)
+    app_module.GEMINI_API_KEYS = ['key-b']
+    app_module._gemini_key_pool = None
+    try:
+        for _ in range(10):
+            app_module.record_latency('llm.call.hedge-teste', 0.2)
+        counters = lambda: app_module.metrics_snapshot()['counters']
+        before = counters()
+
+        # A primeira tentativa demora; a segunda, enviada após o p90 (0,2s), vence e a primeira é cancelada
+        latencies = iter([2.0, 0.0])
+        server.config.draw = lambda: (next(latencies, 0.0), False)
+        app_module._hedge_credit = 1.0
+        start = time.perf_counter()
+        assert 'CONTESTAÇÃO' in app_module.call_gemini(['petição'], kind='hedge-teste')
+        assert time.perf_counter() - start < 1.5
+        after = counters()
+        assert after['hedge.issued'] == before.get('hedge.issued', 0) + 1
+        assert after['hedge.won'] == before.get('hedge.won', 0) + 1
+        # A vaga da original só volta quando a conexão dela termina; no REST, sem prazo,
+        # o fluxo é fechado quando chega a primeira parte (2s)
+        assert wait_until(lambda: app_module.get_llm_scheduler().snapshot()['running'] == {'interactive': 0, 'bulk': 0}, 4)
+        # O hedge foi por outra chave do pool e contou na cota dela; a amostra de latência é a
+        # da tentativa principal (interrompida depois do limiar), não a do hedge vencedor
+        assert server.config.stats['keys'] == {'test-key': 1, 'key-b': 1}
+        pool = app_module.get_gemini_key_pool()
+        # Assim como a reserva da chave
+        assert wait_until(lambda: not any(key['in_flight'] for key in pool.snapshot()), 1)
+        keys = pool.snapshot()
+        assert [key['window_requests'] for key in keys] == [1, 1]
+        assert [key['in_flight'] for key in keys] == [0, 0]
+        assert sum(key['calls'] for key in keys) == 1 and sum(key['errors'] for key in keys) == 0
+        # O limiar recebe o próprio limiar pela principal cancelada; a latência entregue é a do hedge
+        assert list(app_module._latency_samples['llm.call.hedge-teste'])[10:] == [0.2]
+        served = app_module._latency_samples['llm.served.hedge-teste']
+        assert len(served) == 1 and 0.2 <= served[-1] < 1.5
+
+        # Sem crédito no orçamento, a chamada lenta não é repetida
+        latencies = iter([1.0, 0.0])
+        app_module._hedge_credit = 0.0
+        start = time.perf_counter()
+        assert app_module.call_gemini(['petição'], kind='hedge-teste')
+        assert time.perf_counter() - start >= 1.0
+        assert counters()['hedge.issued'] == after['hedge.issued']
+        assert counters()['hedge.budget_denied'] == before.get('hedge.budget_denied', 0) + 1
+    finally:
+        app_module.GEMINI_API_KEYS = []
+        config.update(HEDGE_ENABLED=False, HEDGE_MIN_SAMPLES=20)
+        restore_gemini(server)
+
+def client_metrics():
+    return app_module.app.test_client().get('/api/metrics').get_json()
+
+def test_key_pool_spreads_load_routes_by_size_and_fails_over():
+    import fake_gemini_server
+    setup_app()
+    server = use_fake_gemini(fake_gemini_server.FakeGeminiConfig(latency=0, jitter=0))
+    config = app_module.app.config
+    app_module.GEMINI_API_KEYS = ['key-b']
+    app_module._gemini_key_pool = None
+    config.update(GEMINI_MODEL_TIERS='modelo-pequeno:100,modelo-grande', GEMINI_KEY_RPM=10)
+    try:
+        # Chamadas pequenas e grandes alternam entre as chaves, cada uma no seu modelo
+        for size in (40, 40, 4000, 4000):
+            assert app_module.call_gemini(['x' * size], kind='pool-teste')
+        stats = server.config.stats
+        assert stats['keys'] == {'test-key': 2, 'key-b': 2}
+        assert stats['models'] == {'modelo-pequeno': 2, 'modelo-grande': 2}
+
+        # Cota esgotada na chave escolhida: a chamada segue pela outra e a chave sai do pool
+        server.config.exhausted_keys.add('test-key')
+        for _ in range(3):
+            assert app_module.call_gemini(['petição'], kind='pool-teste')
+        assert stats['keys'] == {'test-key': 3, 'key-b': 5}
+        keys = {key['key']: key for key in client_metrics()['gemini_keys']}
+        assert not keys['chave-1']['healthy'] and 'TooManyRequests' in keys['chave-1']['last_error']
+        assert keys['chave-2']['healthy'] and keys['chave-2']['calls'] == 5
+    finally:
+        app_module.GEMINI_API_KEYS = []
+        config.update(GEMINI_MODEL_TIERS='', GEMINI_KEY_RPM=2000)
+        restore_gemini(server)
+
+def test_empty_key_pool_is_a_configuration_error():
+    setup_app()
+    for api_keys, exclude_all in (([], False), (['unica'], True)):
+        pool = app_module.GeminiKeyPool(api_keys, rpm=10, tpm=1000, cooldown=1)
+        try:
+            pool.acquire(10, exclude=pool.keys if exclude_all else ())
+        except app_module.GeminiConfigError as e:
+            assert 'Nenhuma chave do Gemini' in str(e)
+        else:
+            raise AssertionError('pool sem chave utilizável deveria falhar')
+
+def test_admission_estimates_and_applies_policies():
+    import fake_gemini_server
+    client = setup_app()
+    server = use_fake_gemini(fake_gemini_server.FakeGeminiConfig(latency=0, jitter=0))
+    config = app_module.app.config
+    app_module._llm_usage.clear()
+    app_module._text_cache.clear()
+    try:
+        # Estimativa: textos extraídos ficam no cache e o processamento seguinte os reaproveita
+        pair = {name: (stream.read(), filename) for name, (stream, filename) in pdf_upload_data('estimativa').items()}
+        same_pair = lambda: {name: (io.BytesIO(content), filename) for name, (content, filename) in pair.items()}
+        response = client.post('/api/estimate', data=same_pair(), content_type='multipart/form-data')
+        body = response.get_json()
+        assert response.status_code == 200
+        assert body['estimativa']['modos']['single']['tokens_entrada'] > 0
+        assert body['decisao']['acao'] == 'aceitar' and body['decisao']['modo'] == 'single'
+        hits = app_module.metrics_snapshot()['counters'].get('text_cache.hits', 0)
+        response = client.post('/api/process', data=same_pair(), content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert app_module.metrics_snapshot()['counters']['text_cache.hits'] == hits + 2
+        app_module._llm_usage.clear()
+
+        # Entrada maior que o contexto: recusada sem nenhuma chamada ao Gemini
+        requests_before = server.config.stats['requests']
+        config['ADMISSION_MAX_INPUT_TOKENS'] = 10
+        response = client.post('/api/process', data=pdf_upload_data('grande'), content_type='multipart/form-data')
+        assert response.status_code == 413 and response.get_json()['decisao']['acao'] == 'recusar'
+        assert server.config.stats['requests'] == requests_before
+        config['ADMISSION_MAX_INPUT_TOKENS'] = 1000000
+
+        config['ESTIMATE_OUTPUT_TOKENS_PER_S'] = 10  # geração única ~300s; por seções ~140s
+        # Fora do prazo na geração única: 'chunked' passa para a geração por seções, 'reject' recusa
+        response = client.post('/api/estimate', data=dict(pdf_upload_data('prazo'), admissao='chunked'),
+                               content_type='multipart/form-data', headers={'X-Request-Timeout': '200'})
+        decision = response.get_json()['decisao']
+        assert decision['acao'] == 'reduzir' and decision['modo'] == 'parallel'
+        response = client.post('/api/process', data=dict(pdf_upload_data('prazo'), admissao='reject'),
+                               content_type='multipart/form-data', headers={'X-Request-Timeout': '200'})
+        assert response.status_code == 413
+
+        # Nem por seções cabe no prazo: 'queue' aceita para processamento em segundo plano
+        response = client.post('/api/process', data=dict(pdf_upload_data('fila'), admissao='queue'),
+                               content_type='multipart/form-data', headers={'X-Request-Timeout': '100'})
+        assert response.status_code == 202
+        status_url = response.get_json()['status_url']
+        deadline = time.time() + 10
+        while client.get(status_url).get_json()['status'] in ('queued', 'running') and time.time() < deadline:
+            time.sleep(0.05)
+        job = client.get(status_url).get_json()
+        assert job['status'] == 'done' and job['modo'] == 'parallel'
+        assert app_module.get_result_from_file(job['result_id'])
+    finally:
+        config.update(ESTIMATE_OUTPUT_TOKENS_PER_S=100, ADMISSION_MAX_INPUT_TOKENS=1000000)
+        restore_gemini(server)
+
+def docx_layout(data):
+    """Texto e formatação efetiva (estilo ou direta) de cada parágrafo de um DOCX"""
+    import docx
+    document = docx.Document(io.BytesIO(data))
+    section = document.sections[0]
+    layout = [(section.top_margin, section.bottom_margin, section.left_margin, section.right_margin)]
+    for p in document.paragraphs:
+        style = p.style
+        layout.append((
+            p.text,
+            p.alignment if p.alignment is not None else style.paragraph_format.alignment,
+            p.paragraph_format.first_line_indent or style.paragraph_format.first_line_indent,
+            p.paragraph_format.left_indent or style.paragraph_format.left_indent,
+            [(run.bold or style.font.bold or False, run.font.size or style.font.size) for run in p.runs if run.text],
+        ))
+    return layout
+
+def test_fast_docx_matches_python_docx_layout():
+    setup_app()
+    data = app_module.build_document_data(FAKE_RESPONSE)
+    data['secoes'][1]['paragrafos'].append('Valor de R$ 10.000,00 & juros <12%>\tcom "aspas"')
+
+    baseline = io.BytesIO()
+    app_module.create_word_document(data).save(baseline)
+
+    class WriteOnly:
+        """Destino sem seek, como o corpo de uma resposta em fluxo"""
+        def __init__(self):
+            self.chunks = []
+
+        def write(self, chunk):
+            self.chunks.append(bytes(chunk))
+
+    fast = WriteOnly()
+    app_module.write_fast_docx(data, fast)
+    fast_data = b''.join(fast.chunks)
+    assert zipfile.ZipFile(io.BytesIO(fast_data)).testzip() is None
+    assert docx_layout(fast_data) == docx_layout(baseline.getvalue())
+
+    # Caracteres de controle (que o python-docx rejeita) são descartados
+    data['secoes'][0]['paragrafos'] = ['texto\x0bcom controle\x00']
+    fast = io.BytesIO()
+    app_module.write_fast_docx(data, fast)
+    assert 'textocom controle' in [entry[0] for entry in docx_layout(fast.getvalue())[1:]]
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            logger.info(f"Executando {name}")
+            func()
+    logger.info("Testes concluídos")